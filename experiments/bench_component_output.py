@@ -0,0 +1,124 @@
+# Copyright 2021 Max Planck Institute for Software Systems, and
+# National University of Singapore
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Microbenchmark for how fast `Component` turns simulator output into lines.
+
+Compares the line splitting in `Component._parse_buf()` against the previous
+byte-by-byte implementation, and measures lines per second end-to-end from a
+subprocess writing gem5-style debug lines to `process_out()`. Run from this
+directory with `python3 bench_component_output.py`.
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+from simbricks.orchestration.exectools import Component
+
+LINE = (
+    b'system.pc.simbricks_0: debug message tick=123456789 '
+    b'addr=0xdeadbeef len=64\n'
+)
+
+
+def parse_bytewise(buf: bytearray, data: bytes):
+    """Previous implementation of `Component._parse_buf()`."""
+    buf.extend(data)
+    lines = []
+    start = 0
+    for i in range(0, len(buf)):
+        if buf[i] == ord('\n'):
+            lines.append(buf[start:i].decode('utf-8'))
+            start = i + 1
+    del buf[0:start]
+    if len(data) == 0 and len(buf) > 0:
+        lines.append(buf.decode('utf-8'))
+    return lines
+
+
+# pylint: disable=protected-access
+def bench_parse(n: int):
+    # the previous implementation was fed one line per readline() call
+    buf = bytearray()
+    start = time.perf_counter()
+    lines_old = 0
+    for _ in range(n):
+        lines_old += len(parse_bytewise(buf, LINE))
+    t_old = time.perf_counter() - start
+
+    comp = Component([])
+    data = LINE * n
+    buf = bytearray()
+    start = time.perf_counter()
+    lines_new = 0
+    for i in range(0, len(data), Component.READ_CHUNK):
+        lines_new += len(comp._parse_buf(buf, data[i:i + Component.READ_CHUNK]))
+    lines_new += len(comp._parse_buf(buf, b''))
+    t_new = time.perf_counter() - start
+
+    assert lines_old == lines_new == n
+    print(
+        f'parse: byte-wise {n / t_old:.0f} lines/s, '
+        f'bulk {n / t_new:.0f} lines/s'
+    )
+
+
+class CountingComponent(Component):
+
+    def __init__(self, cmd_parts):
+        super().__init__(cmd_parts)
+        self.lines = 0
+
+    async def process_out(self, lines, eof):
+        self.lines += len(lines)
+
+
+async def bench_subprocess(n: int):
+    comp = CountingComponent([
+        sys.executable,
+        '-c',
+        f'import sys; sys.stdout.buffer.write({LINE!r} * {n})'
+    ])
+    start = time.perf_counter()
+    await comp.start()
+    await comp.wait()
+    duration = time.perf_counter() - start
+    assert comp.lines == n
+    print(f'subprocess -> process_out: {n / duration:.0f} lines/s')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--lines',
+        type=int,
+        default=200000,
+        help='Number of lines to parse (5x as many for the subprocess)'
+    )
+    args = parser.parse_args()
+    bench_parse(args.lines)
+    asyncio.run(bench_subprocess(args.lines * 5))
+
+
+if __name__ == '__main__':
+    main()
@@ -32,14 +32,19 @@ import sys
 import typing as tp
 from signal import SIGINT, signal
 
-from simbricks.orchestration.exectools import LocalExecutor, RemoteExecutor
+from simbricks.orchestration.exectools import (
+    LocalExecutor, RemoteExecutor, probe_executors
+)
 from simbricks.orchestration.experiment.experiment_environment import ExpEnv
+from simbricks.orchestration.experiment.resource_profiles import (
+    ResourceProfiles
+)
 from simbricks.orchestration.experiments import (
     DistributedExperiment, Experiment
 )
 from simbricks.orchestration.runtime.common import Run
 from simbricks.orchestration.runtime.distributed import (
-    DistributedSimpleRuntime, auto_dist
+    DistributedParallelRuntime, DistributedSimpleRuntime, auto_dist
 )
 from simbricks.orchestration.runtime.local import (
     LocalParallelRuntime, LocalSimpleRuntime
@@ -99,6 +104,16 @@ parser.add_argument(
     default=False,
     help='Run experiments even if output already exists'
 )
+parser.add_argument(
+    '--pipeline',
+    action='store_const',
+    const=True,
+    default=False,
+    help=(
+        'For sequential runtimes, prepare the next run and write the output of '
+        'the previous run while the current one executes'
+    )
+)
 parser.add_argument(
     '--verbose',
     action='store_const',
@@ -106,6 +121,27 @@ parser.add_argument(
     default=False,
     help='Verbose output'
 )
+parser.add_argument(
+    '--log-files',
+    action='store_const',
+    const=True,
+    default=False,
+    help=(
+        'Stream simulator output to files next to the output JSON instead of '
+        'embedding it'
+    )
+)
+parser.add_argument(
+    '--output-format',
+    type=str,
+    choices=['json', 'indexed'],
+    default='json',
+    help=(
+        'Format of experiment output: a single JSON file, or a JSON manifest '
+        'with per-simulator compressed output streams that can be read '
+        'selectively'
+    )
+)
 parser.add_argument(
     '--pcap',
     action='store_const',
@@ -146,12 +182,42 @@ g_env.add_argument(
     default=None,
     help='List of hosts to use (json)'
 )
+g_env.add_argument(
+    '--no-probe',
+    action='store_const',
+    const=True,
+    default=False,
+    help=(
+        'Do not probe hosts from --hosts for their resources and required '
+        'files before starting, and do not exclude unreachable ones'
+    )
+)
+g_env.add_argument(
+    '--tarcachedir',
+    metavar='DIR',
+    type=str,
+    default=None,
+    help='Cache directory for node config tars (default: WORKDIR/.tarcache)'
+)
+g_env.add_argument(
+    '--overlaycachedir',
+    metavar='DIR',
+    type=str,
+    default=None,
+    help=(
+        'Cache directory for qcow2 overlay templates of local runs '
+        '(default: WORKDIR/.overlaycache)'
+    )
+)
 g_env.add_argument(
     '--shmdir',
     metavar='DIR',
     type=str,
     default=None,
-    help='Shared memory directory base (workdir if not set)'
+    help=(
+        'Shared memory directory base (if not set, a hugetlbfs mount or '
+        '/dev/shm with enough space is used for local runs, else workdir)'
+    )
 )
 
 g_par = parser.add_argument_group('Parallel Runtime')
@@ -161,21 +227,72 @@ g_par.add_argument(
     action='store_const',
     const='parallel',
     default='sequential',
-    help='Use parallel instead of sequential runtime'
+    help=(
+        'Use parallel instead of sequential runtime, spreading runs across '
+        'all hosts if multiple are specified'
+    )
 )
 g_par.add_argument(
     '--cores',
     metavar='N',
     type=int,
     default=len(os.sched_getaffinity(0)),
-    help='Number of cores to use for parallel runs'
+    help=(
+        'Number of cores to use for parallel runs (per host, unless set in '
+        'the hosts file)'
+    )
 )
 g_par.add_argument(
     '--mem',
     metavar='N',
     type=int,
     default=None,
-    help='Memory limit for parallel runs (in MB)'
+    help=(
+        'Memory limit for parallel runs (in MB, per host, unless set in the '
+        'hosts file)'
+    )
+)
+g_par.add_argument(
+    '--fetch-results',
+    action='store_const',
+    const=True,
+    default=False,
+    help=(
+        'Copy working directories of runs on remote hosts back when running '
+        'in parallel on multiple hosts'
+    )
+)
+g_par.add_argument(
+    '--profile-db',
+    metavar='JSON_FILE',
+    type=str,
+    default=None,
+    help=(
+        'Record measured resource usage of simulators in this file and use '
+        'it instead of static estimates for scheduling parallel runs'
+    )
+)
+g_par.add_argument(
+    '--pin',
+    action='store_const',
+    const=True,
+    default=False,
+    help=(
+        'Pin each simulator to dedicated cores, keeping connected simulators '
+        'on the same NUMA node'
+    )
+)
+g_par.add_argument(
+    '--sched-policy',
+    type=str,
+    choices=LocalParallelRuntime.POLICIES,
+    default='fifo',
+    help=(
+        'Order for starting parallel runs: fifo waits for the next run in '
+        'order, backfill starts any run that fits, largest and shortest '
+        'prefer runs with the largest resource requirements or shortest '
+        'expected duration'
+    )
 )
 
 g_slurm = parser.add_argument_group('Slurm Runtime')
@@ -194,6 +311,78 @@ g_slurm.add_argument(
     default='./slurm/',
     help='Slurm communication directory'
 )
+g_slurm.add_argument(
+    '--slurm-array',
+    action='store_const',
+    const=True,
+    default=False,
+    help='Submit the runs of each experiment as one job array'
+)
+g_slurm.add_argument(
+    '--slurm-pack',
+    metavar='N',
+    type=int,
+    default=1,
+    help=(
+        'Execute up to N runs in parallel in one allocation, sized by their '
+        'resource requirements'
+    )
+)
+g_slurm.add_argument(
+    '--slurm-cores',
+    metavar='N',
+    type=int,
+    default=32,
+    help=(
+        'Cores to allocate for a job with a single run, and maximum for jobs '
+        'with packed runs'
+    )
+)
+g_slurm.add_argument(
+    '--slurm-monitor',
+    action='store_const',
+    const=True,
+    default=False,
+    help=(
+        'Wait for submitted jobs to finish, reporting their progress, and exit '
+        'with an error if any run failed'
+    )
+)
+g_slurm.add_argument(
+    '--slurm-retries',
+    metavar='N',
+    type=int,
+    default=0,
+    help='Resubmit failed runs up to N times when monitoring'
+)
+g_slurm.add_argument(
+    '--slurm-poll',
+    metavar='SECONDS',
+    type=float,
+    default=30,
+    help='Interval for querying job states when monitoring'
+)
+g_slurm.add_argument(
+    '--sbatch',
+    metavar='CMD',
+    type=str,
+    default='sbatch',
+    help='Command to submit jobs with'
+)
+g_slurm.add_argument(
+    '--scancel',
+    metavar='CMD',
+    type=str,
+    default='scancel',
+    help='Command to cancel jobs with'
+)
+g_slurm.add_argument(
+    '--sacct',
+    metavar='CMD',
+    type=str,
+    default='sacct',
+    help='Command to query job states with'
+)
 
 g_dist = parser.add_argument_group('Distributed Runtime')
 g_dist.add_argument(
@@ -204,6 +393,17 @@ g_dist.add_argument(
     default='sequential',
     help='Use sequential distributed runtime instead of local'
 )
+g_dist.add_argument(
+    '--dist-parallel',
+    dest='runtime',
+    action='store_const',
+    const='dist_parallel',
+    default='sequential',
+    help=(
+        'Use parallel distributed runtime, placing runs on hosts with '
+        'available cores and memory (see --cores and --mem)'
+    )
+)
 g_dist.add_argument(
     '--auto-dist',
     action='store_const',
@@ -211,6 +411,16 @@ g_dist.add_argument(
     default=False,
     help='Automatically distribute non-distributed experiments'
 )
+g_dist.add_argument(
+    '--auto-dist-split',
+    action='store_const',
+    const=True,
+    default=False,
+    help=(
+        'When automatically distributing, attach NICs on other hosts to new '
+        'switches there, connected to the original switch'
+    )
+)
 g_dist.add_argument(
     '--proxy-type',
     metavar='TYPE',
@@ -237,9 +447,13 @@ def load_executors(path):
                     ex.ssh_extra_args += h['ssh_args']
                 if 'scp_args' in h:
                     ex.scp_extra_args += h['scp_args']
+                if 'agent' in h:
+                    ex.use_agent = h['agent']
             else:
                 raise RuntimeError('invalid host type "' + h['type'] + '"')
             ex.ip = h['ip']
+            ex.cores = h.get('cores')
+            ex.mem = h.get('mem')
             exs.append(ex)
     return exs
 
@@ -249,6 +463,68 @@ if args.hosts is None:
 else:
     executors = load_executors(args.hosts)
 
+# load experiments
+if not args.pickled:
+    # default: load python modules with experiments
+    experiments = []
+    for path in args.experiments:
+        modname, _ = os.path.splitext(os.path.basename(path))
+
+        class ExperimentModuleLoadError(Exception):
+            pass
+
+        spec = importlib.util.spec_from_file_location(modname, path)
+        if spec is None:
+            raise ExperimentModuleLoadError('spec is None')
+        mod = importlib.util.module_from_spec(spec)
+        if spec.loader is None:
+            raise ExperimentModuleLoadError('spec.loader is None')
+        spec.loader.exec_module(mod)
+        experiments += mod.experiments
+
+    if args.list:
+        for e in experiments:
+            print(e.name)
+        sys.exit(0)
+else:
+    # otherwise load pickled run objects
+    pickled_runs: tp.List[Run] = []
+    for path in args.experiments:
+        with open(path, 'rb') as f:
+            pickled_runs.append(pickle.load(f))
+
+
+def matches_filter(e: Experiment) -> bool:
+    """Whether `e` is selected by the filters specified, if any."""
+    if not args.filter:
+        return True
+    for f in args.filter:
+        if fnmatch.fnmatch(e.name, f):
+            return True
+    return False
+
+
+# probe hosts for their resources and the files required by the experiments,
+# so schedulers and auto_dist can use them and unhealthy hosts are excluded
+if args.hosts is not None and not args.no_probe and not args.pickled:
+    probe_env = ExpEnv(args.repo, args.workdir, args.cpdir)
+    required = set()
+    for e in experiments:
+        if matches_filter(e):
+            for sim in e.all_simulators():
+                required.update(sim.required_files(probe_env))
+    executors = asyncio.run(
+        probe_executors(
+            executors,
+            probe_env.repodir,
+            sorted(required),
+            verbose=args.verbose
+        )
+    )
+    if not executors:
+        print('Error: no usable hosts', file=sys.stderr)
+        sys.exit(1)
+
 
 def warn_multi_exec():
     if len(executors) > 1:
@@ -258,22 +534,76 @@ def warn_multi_exec():
         )
 
 
+profiles = None
+if args.profile_db is not None:
+    profiles = ResourceProfiles(args.profile_db)
+
 # initialize runtime
-if args.runtime == 'parallel':
-    warn_multi_exec()
+if args.runtime == 'parallel' and len(executors) > 1:
+    if args.pin or args.profile_db is not None or args.sched_policy != 'fifo':
+        print(
+            'Warning: --pin, --profile-db and --sched-policy are ignored when '
+            'running on multiple hosts',
+            file=sys.stderr
+        )
+    rt = DistributedParallelRuntime(
+        executors,
+        cores=args.cores,
+        mem=args.mem,
+        verbose=args.verbose,
+        fetch=args.fetch_results
+    )
+elif args.runtime == 'parallel':
     rt = LocalParallelRuntime(
         cores=args.cores,
         mem=args.mem,
         verbose=args.verbose,
-        executor=executors[0]
+        executor=executors[0],
+        policy=args.sched_policy,
+        profiles=profiles,
+        pin=args.pin
     )
 elif args.runtime == 'slurm':
-    rt = SlurmRuntime(args.slurmdir, args, verbose=args.verbose)
+    rt = SlurmRuntime(
+        args.slurmdir,
+        args,
+        verbose=args.verbose,
+        sbatch=args.sbatch,
+        scancel=args.scancel,
+        array=args.slurm_array,
+        pack=args.slurm_pack,
+        cores=args.slurm_cores,
+        monitor=args.slurm_monitor,
+        sacct=args.sacct,
+        poll_interval=args.slurm_poll,
+        retries=args.slurm_retries
+    )
 elif args.runtime == 'dist':
-    rt = DistributedSimpleRuntime(executors, verbose=args.verbose)
+    rt = DistributedSimpleRuntime(
+        executors, verbose=args.verbose, pipeline=args.pipeline
+    )
+elif args.runtime == 'dist_parallel':
+    rt = DistributedParallelRuntime(
+        executors,
+        cores=args.cores,
+        mem=args.mem,
+        verbose=args.verbose,
+        fetch=args.fetch_results
+    )
 else:
     warn_multi_exec()
-    rt = LocalSimpleRuntime(verbose=args.verbose, executor=executors[0])
+    rt = LocalSimpleRuntime(
+        verbose=args.verbose,
+        executor=executors[0],
+        profiles=profiles,
+        pipeline=args.pipeline
+    )
+
+# shared memory placement can only be determined for runs on this machine
+local_runtime = (
+    isinstance(rt, (LocalParallelRuntime, LocalSimpleRuntime)) and
+    isinstance(executors[0], LocalExecutor)
+)
 
 
 # pylint: disable=redefined-outer-name
@@ -283,15 +613,17 @@ def add_exp(
     prereq: tp.Optional[Run],
     create_cp: bool,
     restore_cp: bool,
-    no_simbricks: bool
+    no_simbricks: bool,
+    *,
+    cpdir: str
 ):
     outpath = f'{args.outdir}/{e.name}-{run}.json'
-    if os.path.exists(outpath) and not args.force:
+    # checkpoint runs are skipped based on whether the checkpoint is complete
+    if os.path.exists(outpath) and not args.force and not create_cp:
         print(f'skip {e.name} run {run}')
         return None
 
     workdir = f'{args.workdir}/{e.name}/{run}'
-    cpdir = f'{args.cpdir}/{e.name}/0'
     if args.shmdir is not None:
         shmdir = f'{args.shmdir}/{e.name}/{run}'
 
@@ -302,68 +634,87 @@ def add_exp(
     env.pcap_file = ''
     if args.pcap:
         env.pcap_file = workdir + '/pcap'
+    if local_runtime:
+        if args.overlaycachedir is not None:
+            env.overlay_cachedir = os.path.abspath(args.overlaycachedir)
+        else:
+            env.overlay_cachedir = os.path.abspath(
+                f'{args.workdir}/.overlaycache'
+            )
     if args.shmdir is not None:
         env.shm_base = os.path.abspath(shmdir)
+        if local_runtime:
+            env.detect_shm()
+    elif local_runtime:
+        if not env.select_shm_base(f'{e.name}/{run}', e.shm_pools()):
+            print(
+                f'Warning: no hugetlbfs or /dev/shm with enough space for '
+                f'{e.name}, placing shared memory in workdir',
+                file=sys.stderr
+            )
+            env.detect_shm()
+    if args.log_files:
+        env.logdir = os.path.abspath(f'{args.outdir}/{e.name}-{run}.logs')
+    env.output_format = args.output_format
+    if args.tarcachedir is not None:
+        env.cfgtar_cachedir = os.path.abspath(args.tarcachedir)
+    else:
+        env.cfgtar_cachedir = os.path.abspath(f'{args.workdir}/.tarcache')
 
     run = Run(e, run, env, outpath, prereq)
     rt.add_run(run)
     return run
 
 
-# load experiments
+# add runs
 if not args.pickled:
-    # default: load python modules with experiments
-    experiments = []
-    for path in args.experiments:
-        modname, _ = os.path.splitext(os.path.basename(path))
-
-        class ExperimentModuleLoadError(Exception):
-            pass
-
-        spec = importlib.util.spec_from_file_location(modname, path)
-        if spec is None:
-            raise ExperimentModuleLoadError('spec is None')
-        mod = importlib.util.module_from_spec(spec)
-        if spec.loader is None:
-            raise ExperimentModuleLoadError('spec.loader is None')
-        spec.loader.exec_module(mod)
-        experiments += mod.experiments
-
-    if args.list:
-        for e in experiments:
-            print(e.name)
-        sys.exit(0)
+    cp_runs: tp.Dict[str, Run] = {}
+    """Checkpoint runs by fingerprint of the host configuration."""
 
     for e in experiments:
         if args.auto_dist and not isinstance(e, DistributedExperiment):
-            e = auto_dist(e, executors, args.proxy_type)
-        # apply filter if any specified
-        if (args.filter) and (len(args.filter) > 0):
-            match = False
-            for f in args.filter:
-                match = fnmatch.fnmatch(e.name, f)
-                if match:
-                    break
-
-            if not match:
-                continue
-
-        # if this is an experiment with a checkpoint we might have to create it
+            e = auto_dist(e, executors, args.proxy_type, args.auto_dist_split)
+        if not matches_filter(e):
+            continue
+
+        # if this is an experiment with a checkpoint we might have to create it,
+        # unless another experiment with the same host configuration already
+        # created or is going to create it
         no_simbricks = e.no_simbricks
+        cpdir = f'{args.cpdir}/{e.name}/0'
+        prereq = None
         if e.checkpoint:
-            prereq = add_exp(e, 0, None, True, False, no_simbricks)
-        else:
-            prereq = None
+            fingerprint = e.checkpoint_fingerprint()
+            cpdir = f'{args.cpdir}/by-config/{fingerprint}'
+            cp_env = ExpEnv(args.repo, args.workdir, cpdir)
+            if fingerprint in cp_runs:
+                prereq = cp_runs[fingerprint]
+            elif args.force or not cp_env.has_checkpoint(fingerprint):
+                prereq = add_exp(
+                    e, 0, None, True, False, no_simbricks, cpdir=cpdir
+                )
+                cp_runs[fingerprint] = prereq
+            else:
+                print(f'reusing checkpoint in {cpdir} for {e.name}')
 
         for run in range(args.firstrun, args.firstrun + args.runs):
-            add_exp(e, run, prereq, False, e.checkpoint, no_simbricks)
+            add_exp(
+                e, run, prereq, False, e.checkpoint, no_simbricks, cpdir=cpdir
+            )
 else:
-    # otherwise load pickled run object
-    for path in args.experiments:
-        with open(path, 'rb') as f:
-            rt.add_run(pickle.load(f))
+    for run in pickled_runs:
+        rt.add_run(run)
 
 # register interrupt handler
 signal(SIGINT, lambda *_: rt.interrupt())
 
 asyncio.run(rt.start())
+
+if isinstance(rt, SlurmRuntime) and rt.monitor and not rt.successful():
+    sys.exit(1)
+
+# report failed runs through the exit status, e.g. for dependent Slurm jobs
+if args.pickled:
+    for run in pickled_runs:
+        if run.output is None or not run.output.success:
+            sys.exit(1)
@@ -21,15 +21,38 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import asyncio
+import collections
+import io
+import json
+import math
 import os
 import pathlib
 import re
 import shlex
 import shutil
 import signal
+import sys
+import tarfile
+import tempfile
+import time
 import typing as tp
 from asyncio.subprocess import Process
 
+from simbricks.orchestration import remote_agent
+from simbricks.orchestration.utils.files import file_digest
+from simbricks.orchestration.utils.filewatch import FileWatcher
+from simbricks.orchestration.utils.procstat import ResourceSampler
+
+
+def _stage_archive(files: tp.Dict[str, str]) -> bytes:
+    """Compressed tar containing the file at each path in `files`, named by the
+    corresponding key."""
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz', compresslevel=6) as tar:
+        for (name, path) in files.items():
+            tar.add(path, arcname=name, recursive=False)
+    return buf.getvalue()
+
 
 class HostConfig(object):
 
@@ -47,6 +70,9 @@ class HostConfig(object):
 
 class Component(object):
 
+    READ_CHUNK = 64 * 1024
+    """Maximum number of bytes read from stdout/stderr at once."""
+
     def __init__(self, cmd_parts: tp.List[str], with_stdin=False):
         self.is_ready = False
         self.stdout = []
@@ -56,24 +82,69 @@ class Component(object):
         self.cmd_parts = cmd_parts
         #print(cmd_parts)
         self.with_stdin = with_stdin
+        self.stdout_path: tp.Optional[str] = None
+        """File stdout is written to, if set with `log_to_files()`."""
+        self.stderr_path: tp.Optional[str] = None
+        """File stderr is written to, if set with `log_to_files()`."""
+        self.cpus: tp.Optional[tp.List[int]] = None
+        """Cores the process is restricted to, if set with `pin()`."""
+        self.numa_node: tp.Optional[int] = None
+        self._numactl: tp.Optional[str] = None
 
         self._proc: Process
         self._terminate_future: asyncio.Task
+        self._stdout_f: tp.Optional[tp.TextIO] = None
+        self._stderr_f: tp.Optional[tp.TextIO] = None
+
+    def log_to_files(self, stdout_path: str, stderr_path: str, tail=1000):
+        """
+        Write output lines to files as they arrive instead of collecting all of
+        them in memory.
+
+        Only the last `tail` lines are kept in `stdout` and `stderr`. Has to be
+        called before `start()`.
+        """
+        self.stdout_path = stdout_path
+        self.stderr_path = stderr_path
+        self.stdout = collections.deque(self.stdout, maxlen=tail)
+        self.stderr = collections.deque(self.stderr, maxlen=tail)
+
+    def pin(self, cpus: tp.List[int], numa_node: tp.Optional[int] = None):
+        """
+        Restrict the process to `cpus` and prefer allocating its memory on
+        `numa_node`.
+
+        The command is run through `numactl` for this. If that is not installed,
+        the process is only restricted to `cpus` right after it started. Has to
+        be called before `start()` and only applies to local processes.
+        """
+        self.cpus = cpus
+        self.numa_node = numa_node
+        self._numactl = shutil.which('numactl')
+
+    def _start_cmd(self) -> tp.List[str]:
+        """Command to start, including `numactl` for applying `pin()`."""
+        if not self.cpus or self._numactl is None:
+            return self.cmd_parts
+        cmd = [self._numactl, '--physcpubind=' + ','.join(map(str, self.cpus))]
+        if self.numa_node is not None:
+            cmd.append(f'--preferred={self.numa_node}')
+        return cmd + self.cmd_parts
 
     def _parse_buf(self, buf, data):
         if data is not None:
             buf.extend(data)
         lines = []
-        start = 0
-        for i in range(0, len(buf)):
-            if buf[i] == ord('\n'):
-                l = buf[start:i].decode('utf-8')
-                lines.append(l)
-                start = i + 1
-        del buf[0:start]
+        end = buf.rfind(b'\n')
+        if end >= 0:
+            # '\n' cannot occur inside a multi-byte UTF-8 sequence, so all
+            # complete lines can be decoded at once and split afterwards
+            lines = buf[:end].decode('utf-8').split('\n')
+            del buf[:end + 1]
 
         if len(data) == 0 and len(buf) > 0:
             lines.append(buf.decode('utf-8'))
+            buf.clear()
         return lines
 
     async def _consume_out(self, data: bytes):
@@ -82,6 +153,8 @@ class Component(object):
         if len(ls) > 0 or eof:
             await self.process_out(ls, eof=eof)
             self.stdout.extend(ls)
+            if self._stdout_f is not None and ls:
+                self._stdout_f.write('\n'.join(ls) + '\n')
 
     async def _consume_err(self, data: bytes):
         eof = len(data) == 0
@@ -89,10 +162,12 @@ class Component(object):
         if len(ls) > 0 or eof:
             await self.process_err(ls, eof=eof)
             self.stderr.extend(ls)
+            if self._stderr_f is not None and ls:
+                self._stderr_f.write('\n'.join(ls) + '\n')
 
     async def _read_stream(self, stream: asyncio.StreamReader, fn):
         while True:
-            bs = await stream.readline()
+            bs = await stream.read(self.READ_CHUNK)
             if bs:
                 await fn(bs)
             else:
@@ -100,16 +175,22 @@ class Component(object):
                 return
 
     async def _waiter(self):
-        out_handlers = asyncio.ensure_future(
-            asyncio.wait([
-                self._read_stream(self._proc.stdout, self._consume_out),
-                self._read_stream(self._proc.stderr, self._consume_err)
-            ])
+        out_handlers = asyncio.gather(
+            self._read_stream(self._proc.stdout, self._consume_out),
+            self._read_stream(self._proc.stderr, self._consume_err)
         )
         rc = await self._proc.wait()
         await out_handlers
+        if self._stdout_f is not None:
+            self._stdout_f.close()
+            self._stderr_f.close()
         await self.terminated(rc)
 
+    @property
+    def pid(self) -> int:
+        """Process id of the started (local) process."""
+        return self._proc.pid
+
     async def send_input(self, bs, eof=False):
         self._proc.stdin.write(bs)
         if eof:
@@ -121,12 +202,22 @@ class Component(object):
         else:
             stdin = asyncio.subprocess.DEVNULL
 
+        if self.stdout_path is not None:
+            # pylint: disable=consider-using-with
+            self._stdout_f = open(self.stdout_path, 'w', encoding='utf-8')
+            self._stderr_f = open(self.stderr_path, 'w', encoding='utf-8')
+
         self._proc = await asyncio.create_subprocess_exec(
-            *self.cmd_parts,
+            *self._start_cmd(),
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
             stdin=stdin,
         )
+        if self.cpus and self._numactl is None:
+            try:
+                os.sched_setaffinity(self._proc.pid, self.cpus)
+            except ProcessLookupError:
+                pass
         self._terminate_future = asyncio.create_task(self._waiter())
         await self.started()
 
@@ -158,14 +249,18 @@ class Component(object):
         """Attempts to stop this component by sending signals in the following
         order: interrupt, terminate, kill."""
         await self.interrupt()
-        _, pending = await asyncio.wait([self._proc.wait()], timeout=delay)
+        _, pending = await asyncio.wait(
+            [asyncio.ensure_future(self._proc.wait())], timeout=delay
+        )
         if len(pending) != 0:
             print(
                 f'terminating component {self.cmd_parts[0]} '
                 f'pid {self._proc.pid}'
             )
             await self.terminate()
-            _, pending = await asyncio.wait([self._proc.wait()], timeout=delay)
+            _, pending = await asyncio.wait(
+                [asyncio.ensure_future(self._proc.wait())], timeout=delay
+            )
             if len(pending) != 0:
                 print(
                     f'killing component {self.cmd_parts[0]} '
@@ -215,6 +310,124 @@ class SimpleComponent(Component):
             raise RuntimeError('Command Failed: ' + str(self.cmd_parts))
 
 
+class AgentClient(object):
+    """
+    Client for `remote_agent.py`, which is started with `cmd_parts` and talks a
+    framed JSON protocol over its stdin/stdout.
+
+    For remote hosts, `cmd_parts` runs the agent through ssh, but the agent can
+    just as well be started locally.
+    """
+
+    def __init__(self, label, cmd_parts: tp.List[str]):
+        self.label = label
+        self.cmd_parts = cmd_parts
+        self.calls = 0
+        """Number of round trips to the agent."""
+
+        self._proc: tp.Optional[Process] = None
+        self._next_id = 0
+        self._pending: tp.Dict[int, asyncio.Future] = {}
+        self._event_cbs: tp.Dict[int, tp.Callable[[dict], None]] = {}
+        self._reader: tp.Optional[asyncio.Task] = None
+        self._err_reader: tp.Optional[asyncio.Task] = None
+
+    @staticmethod
+    def agent_source() -> str:
+        """Source code of the agent, e.g. to pass to `python3 -c`."""
+        path = os.path.join(os.path.dirname(__file__), 'remote_agent.py')
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    async def start(self):
+        self._proc = await asyncio.create_subprocess_exec(
+            *self.cmd_parts,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        self._reader = asyncio.create_task(self._read_responses())
+        self._err_reader = asyncio.create_task(self._read_errors())
+        await self.call('ping')
+
+    async def _read_responses(self):
+        try:
+            while True:
+                hdr = await self._proc.stdout.readexactly(4)
+                data = await self._proc.stdout.readexactly(
+                    int.from_bytes(hdr, 'big')
+                )
+                msg = json.loads(data.decode('utf-8'))
+                if 'event' in msg:
+                    cb = self._event_cbs.get(msg['id'])
+                    if cb is not None:
+                        cb(msg)
+                    continue
+
+                fut = self._pending.pop(msg['id'], None)
+                self._event_cbs.pop(msg['id'], None)
+                if fut is None or fut.done():
+                    continue
+                if msg['ok']:
+                    fut.set_result(msg['result'])
+                elif msg.get('type') == 'TimeoutError':
+                    fut.set_exception(TimeoutError(msg['error']))
+                else:
+                    fut.set_exception(
+                        RuntimeError(f'{self.label}: {msg["error"]}')
+                    )
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            for fut in self._pending.values():
+                if not fut.done():
+                    fut.set_exception(
+                        RuntimeError(f'{self.label}: agent terminated')
+                    )
+            self._pending.clear()
+
+    async def _read_errors(self):
+        while True:
+            line = await self._proc.stderr.readline()
+            if not line:
+                return
+            print(self.label, 'ERR:', line.decode('utf-8').rstrip())
+
+    async def call(self, op, on_event=None, **args):
+        """Invokes `op` with keyword arguments `args` in the agent and returns
+        its result. `on_event(msg)` receives intermediate events."""
+        req_id = self._next_id
+        self._next_id += 1
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[req_id] = fut
+        if on_event is not None:
+            self._event_cbs[req_id] = on_event
+
+        data = json.dumps({
+            'id': req_id, 'op': op, 'args': args
+        }).encode('utf-8')
+        self.calls += 1
+        self._proc.stdin.write(len(data).to_bytes(4, 'big') + data)
+        await self._proc.stdin.drain()
+        return await fut
+
+    async def batch(self, calls: tp.List[tp.Tuple[str, dict]]):
+        """Executes several `(op, args)` calls in order with one round trip."""
+        return await self.call(
+            'batch', calls=[{
+                'op': op, 'args': args
+            } for (op, args) in calls]
+        )
+
+    async def stop(self):
+        if self._proc is None or self._proc.returncode is not None:
+            return
+        self._proc.stdin.close()
+        await self._proc.wait()
+        await self._reader
+        await self._err_reader
+
+
 class SimpleRemoteComponent(SimpleComponent):
 
     def __init__(
@@ -225,6 +438,7 @@ class SimpleRemoteComponent(SimpleComponent):
         *args,
         cwd=None,
         ssh_extra_args=None,
+        agent: tp.Optional[AgentClient] = None,
         **kwargs
     ):
         if ssh_extra_args is None:
@@ -232,6 +446,8 @@ class SimpleRemoteComponent(SimpleComponent):
 
         self.host_name = host_name
         self.extra_flags = ssh_extra_args
+        self.agent = agent
+        """Agent on the remote host used to deliver signals, if available."""
         # add a wrapper to print the PID
         remote_parts = ['echo', 'PID', '$$', '&&']
 
@@ -289,7 +505,14 @@ class SimpleRemoteComponent(SimpleComponent):
         await super().process_out(lines, eof)
 
     async def _kill_cmd(self, sig):
-        """Send signal to command by running ssh kill -$sig $PID."""
+        """Send signal to command through the agent or by running ssh kill
+        -$sig $PID."""
+        if self.agent is not None:
+            await self.agent.call(
+                'signal', pids=[self._pid_fut.result()], sig=sig
+            )
+            return
+
         cmd_parts = self._ssh_cmd([
             'kill', '-' + sig, str(self._pid_fut.result())
         ])
@@ -306,26 +529,214 @@ class SimpleRemoteComponent(SimpleComponent):
         await self._kill_cmd('KILL')
 
 
+class AwaitFilesComponent(SimpleRemoteComponent):
+    """Waits on a remote host for a set of paths to exist and reports each path
+    as soon as it appears."""
+
+    # Rotates through the positional parameters, printing and dropping paths
+    # that exist, until none are left or the timeout expires.
+    SCRIPT = (
+        'i=0; '
+        'while [ $# -gt 0 ]; do '
+        'n=$#; '
+        'while [ $n -gt 0 ]; do '
+        'p=$1; shift; n=$((n-1)); '
+        'if [ -e "$p" ]; then echo "READY $p"; else set -- "$@" "$p"; fi; '
+        'done; '
+        'if [ $# -eq 0 ]; then exit 0; fi; '
+        'if [ $i -ge {its} ]; then exit 1; fi; '
+        'sleep {delay}; i=$((i+1)); '
+        'done'
+    )
+
+    def __init__(
+        self,
+        host_name,
+        label,
+        paths,
+        *args,
+        delay=0.05,
+        timeout=30,
+        on_ready=None,
+        **kwargs
+    ):
+        self.pending = set(paths)
+        """Paths that have not appeared yet."""
+        self.on_ready = on_ready
+        its = int(math.ceil(timeout / delay))
+        script = self.SCRIPT.replace('{its}',
+                                     str(its)).replace('{delay}', str(delay))
+        parts = ['/bin/sh', '-c', script, 'sh'] + list(paths)
+        super().__init__(host_name, label, parts, *args, canfail=True, **kwargs)
+
+    async def process_out(self, lines, eof):
+        await super().process_out(lines, eof)
+        for l in lines:
+            if not l.startswith('READY '):
+                continue
+            path = l[len('READY '):]
+            if path in self.pending:
+                self.pending.remove(path)
+                if self.on_ready is not None:
+                    self.on_ready(path)
+
+
+def listening_sockets(
+) -> tp.Tuple[tp.Optional[tp.Set[str]], tp.Optional[tp.Set[int]]]:
+    """
+    Returns paths of listening unix sockets and listening TCP ports on this
+    machine, according to /proc/net. Either is None if this information is not
+    available.
+    """
+    paths = set()
+    try:
+        with open('/proc/net/unix', 'r', encoding='utf-8') as f:
+            next(f)
+            for l in f:
+                parts = l.split()
+                # Flags: __SO_ACCEPTCON is set for listening sockets
+                if len(parts) >= 8 and int(parts[3], 16) & 0x10000:
+                    paths.add(parts[7])
+    except OSError:
+        paths = None
+
+    ports = None
+    for proc_path in ['/proc/net/tcp', '/proc/net/tcp6']:
+        try:
+            with open(proc_path, 'r', encoding='utf-8') as f:
+                next(f)
+                if ports is None:
+                    ports = set()
+                for l in f:
+                    parts = l.split()
+                    # state 0A is TCP_LISTEN
+                    if len(parts) >= 4 and parts[3] == '0A':
+                        ports.add(int(parts[1].rsplit(':', 1)[1], 16))
+        except OSError:
+            pass
+    return (paths, ports)
+
+
 class Executor(object):
 
     def __init__(self):
         self.ip = None
+        self.cores: tp.Optional[int] = None
+        """Number of cores available for simulators, if known."""
+        self.mem: tp.Optional[int] = None
+        """Memory in MB available for simulators, if known."""
+        self.info: tp.Optional[tp.Dict[str, tp.Any]] = None
+        """Result of the last `probe()`."""
+        self.missing_files: tp.Set[str] = set()
+        """Files required by simulators that the last `probe()` found to be
+        missing on the host."""
+
+    def label(self) -> str:
+        return 'localhost'
+
+    async def close(self, verbose=False):
+        """Release resources held by this executor, e.g. connections."""
+        pass
+
+    async def probe(
+        self,
+        repo: str,
+        paths: tp.Iterable[str] = (),
+        verbose=False
+    ) -> tp.Dict[str, tp.Any]:
+        """
+        Query cores, NUMA nodes, available memory and hugepages of the host,
+        whether the repository `repo` exists there and which of `paths` are
+        missing, see `remote_agent.probe()`.
+
+        `cores` and `mem` are set from the result unless already configured.
+        """
+        info = await self._probe({'repo': repo, 'paths': list(paths)}, verbose)
+        self.info = info
+        if self.cores is None:
+            self.cores = info['cores']
+        if self.mem is None:
+            self.mem = info['mem_avail']
+        self.missing_files = set(info['missing'])
+        return info
+
+    async def _probe(self, args, verbose=False) -> tp.Dict[str, tp.Any]:
+        raise NotImplementedError('Please Implement this method')
 
     def create_component(self, label, parts, **kwargs) -> SimpleComponent:
         raise NotImplementedError('Please Implement this method')
 
+    # pylint: disable=unused-argument
+    def resource_sampler(self,
+                         component: Component) -> tp.Optional[ResourceSampler]:
+        """Sampler for the resource usage of a started component, if supported
+        by this executor."""
+        return None
+
     async def await_file(self, path, delay=0.05, verbose=False):
         raise NotImplementedError('Please Implement this method')
 
     async def send_file(self, path, verbose=False):
         raise NotImplementedError('Please Implement this method')
 
+    async def send_files(self, paths, verbose=False) -> tp.Dict[str, float]:
+        """
+        Copy all of `paths` to the host.
+
+        Returns statistics on the transfer: the number of `files` and their
+        `bytes`, how many files and bytes were actually sent, the bytes of files
+        not sent as they were cached on the host, and the (estimated) seconds
+        saved compared to copying each file separately.
+        """
+        paths = list(paths)
+        await asyncio.gather(*[self.send_file(p, verbose) for p in paths])
+        size = sum(os.path.getsize(p) for p in paths)
+        return {
+            'files': len(paths),
+            'files_sent': len(paths),
+            'bytes': size,
+            'bytes_sent': size,
+            'bytes_saved': 0,
+            'seconds_saved': 0.0
+        }
+
+    async def fetch_files(self, paths, verbose=False):
+        """Copy files or directories at `paths` from the host to the same paths
+        on this machine."""
+        raise NotImplementedError('Please Implement this method')
+
     async def mkdir(self, path, verbose=False):
         raise NotImplementedError('Please Implement this method')
 
     async def rmtree(self, path, verbose=False):
         raise NotImplementedError('Please Implement this method')
 
+    async def await_listening(
+        self, paths, ports=(), delay=0.05, verbose=False, timeout=30
+    ) -> bool:
+        """
+        Wait until the unix sockets at `paths` and the TCP `ports` accept
+        connections.
+
+        This only inspects the socket state and does not connect, as SimBricks
+        listeners only accept a single peer. Returns False right away if the
+        socket state is not available on the host, callers then have to fall
+        back to waiting some fixed time.
+        """
+        raise NotImplementedError('Please Implement this method')
+
+    async def mkdirs(self, paths, verbose=False):
+        """Create multiple directories."""
+        for p in paths:
+            await self.mkdir(p, verbose)
+
+    async def rmtrees(self, paths, verbose=False):
+        """Remove multiple directories or files."""
+        xs = []
+        for p in paths:
+            xs.append(self.rmtree(p, verbose))
+        await asyncio.gather(*xs)
+
     # runs the list of commands as strings sequentially
     async def run_cmdlist(self, label, cmds, verbose=True):
         i = 0
@@ -336,25 +747,63 @@ class Executor(object):
             await cmd_c.start()
             await cmd_c.wait()
 
-    async def await_files(self, paths, *args, **kwargs):
+    async def await_files(self, paths, *args, on_ready=None, **kwargs):
+        """
+        Wait for all of `paths` to exist.
+
+        If specified, `on_ready(path)` is invoked for each path as soon as it
+        appears.
+        """
+
+        async def await_one(p):
+            await self.await_file(p, *args, **kwargs)
+            if on_ready is not None:
+                on_ready(p)
+
         xs = []
         for p in paths:
-            xs.append(self.await_file(p, *args, **kwargs))
-        await asyncio.wait(xs)
+            xs.append(await_one(p))
+        await asyncio.gather(*xs)
 
 
 class LocalExecutor(Executor):
 
+    def __init__(self):
+        super().__init__()
+        self._watcher = FileWatcher()
+        """Shared by all `await_file()` calls on this executor."""
+
     def create_component(self, label, parts, **kwargs):
         return SimpleComponent(label, parts, **kwargs)
 
+    def resource_sampler(self, component: Component):
+        return ResourceSampler(component.pid)
+
     async def await_file(self, path, delay=0.05, verbose=False, timeout=30):
         if verbose:
             print(f'await_file({path})')
+        self._watcher.poll_delay = delay
+        await self._watcher.wait(path, timeout)
+
+    async def await_listening(
+        self, paths, ports=(), delay=0.05, verbose=False, timeout=30
+    ):
+        if verbose:
+            print(f'await_listening({paths}, {ports})')
+        paths = set(os.path.abspath(p) for p in paths)
+        ports = set(ports)
         t = 0
-        while not os.path.exists(path):
+        while True:
+            l_paths, l_ports = listening_sockets()
+            if (paths and l_paths is None) or (ports and l_ports is None):
+                return False
+            if paths <= (l_paths or set()) and ports <= (l_ports or set()):
+                return True
             if t >= timeout:
-                raise TimeoutError()
+                raise TimeoutError(
+                    f'timed out waiting for {(paths - l_paths) or ""}'
+                    f'{(ports - l_ports) or ""} to listen'
+                )
             await asyncio.sleep(delay)
             t += delay
 
@@ -362,6 +811,19 @@ class LocalExecutor(Executor):
         # locally we do not need to do anything
         pass
 
+    async def send_files(self, paths, verbose=False):
+        # nothing to transfer, so nothing to report either
+        return {}
+
+    async def fetch_files(self, paths, verbose=False):
+        # locally the files are already in place
+        pass
+
+    async def _probe(self, args, verbose=False):
+        return await asyncio.get_running_loop().run_in_executor(
+            None, remote_agent.probe, args
+        )
+
     async def mkdir(self, path, verbose=False):
         pathlib.Path(path).mkdir(parents=True, exist_ok=True)
 
@@ -374,6 +836,9 @@ class LocalExecutor(Executor):
 
 class RemoteExecutor(Executor):
 
+    STAGE_RATE_MIN_BYTES = 1 << 20
+    """Minimum size of staging transfers to measure the throughput with."""
+
     def __init__(self, host_name, workdir):
         super().__init__()
 
@@ -381,6 +846,179 @@ class RemoteExecutor(Executor):
         self.cwd = workdir
         self.ssh_extra_args = []
         self.scp_extra_args = []
+        self.multiplex = True
+        """Whether to run all ssh and scp commands over one persistent master
+        connection to this host."""
+        self.mux_stats = {'connects': 0, 'commands': 0, 'reused': 0}
+        """Number of master connections established, ssh/scp commands issued
+        and commands that reused the master connection instead of performing
+        their own handshake."""
+
+        self.use_agent = False
+        """Whether to perform filesystem operations, waiting for files and
+        signalling processes through a long-lived agent on the host (see
+        `remote_agent.py`) instead of individual ssh commands."""
+        self.python = 'python3'
+        """Python interpreter on the host used to run the agent."""
+        self.agent_cmd: tp.Optional[tp.List[str]] = None
+        """Command to launch the agent with instead of running it through ssh,
+        e.g. `[sys.executable, 'remote_agent.py']` to run it locally."""
+
+        self._ctl_dir: tp.Optional[str] = None
+        self._ctl_path: tp.Optional[str] = None
+        """Control socket of the master connection, if established."""
+        self._connect_lock: tp.Optional[asyncio.Lock] = None
+        self._agent: tp.Optional[AgentClient] = None
+        self._agent_lock: tp.Optional[asyncio.Lock] = None
+
+        self.stage_cachedir = '.simbricks-stage'
+        """Directory on the host (relative to the home directory) in which
+        files sent with `send_files()` are kept by their content hash."""
+        self._staged: tp.Set[str] = set()
+        """Hashes of files known to be in `stage_cachedir`."""
+        self._stage_rtt: tp.Optional[float] = None
+        """Shortest staging command observed, approximating a round trip."""
+        self._stage_rate: tp.Optional[float] = None
+        """Throughput of the last large staging transfer in bytes per second,
+        excluding the round trip."""
+
+    def label(self) -> str:
+        return self.host_name
+
+    def _ssh_base_cmd(self):
+        return [
+            'ssh',
+            '-o',
+            'UserKnownHostsFile=/dev/null',
+            '-o',
+            'StrictHostKeyChecking=no'
+        ] + self.ssh_extra_args
+
+    def _mux_args(self):
+        """Options for reusing the master connection (if established)."""
+        self.mux_stats['commands'] += 1
+        if self._ctl_path is None:
+            return []
+        self.mux_stats['reused'] += 1
+        return ['-o', f'ControlPath={self._ctl_path}', '-o', 'ControlMaster=no']
+
+    async def connect(self, verbose=False):
+        """
+        Establish the master connection, unless already done.
+
+        Commands issued before this completes (or if it fails) simply open
+        their own connection.
+        """
+        if not self.multiplex or self._ctl_path is not None:
+            return
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+
+        async with self._connect_lock:
+            if self._ctl_path is not None:
+                return
+
+            ctl_dir = tempfile.mkdtemp(prefix='simbricks-ssh-')
+            ctl_path = os.path.join(ctl_dir, 'ctl')
+            # runs `true` and then keeps the master in the background until we
+            # explicitly stop it in close()
+            parts = self._ssh_base_cmd() + [
+                '-o',
+                'ControlMaster=yes',
+                '-o',
+                f'ControlPath={ctl_path}',
+                '-o',
+                'ControlPersist=yes',
+                self.host_name,
+                '--',
+                'true'
+            ]
+            if verbose:
+                print(f'{self.host_name}.connect(): {parts}')
+            proc = await asyncio.create_subprocess_exec(
+                *parts,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+            rc = await proc.wait()
+            if rc != 0 or not os.path.exists(ctl_path):
+                print(
+                    f'{self.host_name}: establishing master connection failed, '
+                    'continuing without multiplexing'
+                )
+                shutil.rmtree(ctl_dir, ignore_errors=True)
+                self.multiplex = False
+                return
+
+            self._ctl_dir = ctl_dir
+            self._ctl_path = ctl_path
+            self.mux_stats['connects'] += 1
+
+    async def agent(self, verbose=False) -> tp.Optional[AgentClient]:
+        """Returns the agent for this host, starting it if necessary, or `None`
+        if `use_agent` is not set."""
+        if not self.use_agent:
+            return None
+        if self._agent_lock is None:
+            self._agent_lock = asyncio.Lock()
+
+        async with self._agent_lock:
+            if self._agent is None:
+                if self.agent_cmd is not None:
+                    parts = self.agent_cmd
+                else:
+                    await self.connect(verbose)
+                    parts = self._ssh_base_cmd() + self._mux_args() + [
+                        self.host_name,
+                        '--',
+                        self.python,
+                        '-u',
+                        '-c',
+                        shlex.quote(AgentClient.agent_source())
+                    ]
+                agent = AgentClient(f'{self.host_name}.agent', parts)
+                await agent.start()
+                self._agent = agent
+        return self._agent
+
+    async def close(self, verbose=False):
+        """Shut down the agent and master connection."""
+        if self._agent is not None:
+            if verbose:
+                print(
+                    f'{self.host_name}: {self._agent.calls} agent round trips'
+                )
+            await self._agent.stop()
+            self._agent = None
+        # the locks are bound to the current event loop once used
+        self._agent_lock = None
+        self._connect_lock = None
+
+        if self._ctl_path is None:
+            return
+
+        parts = self._ssh_base_cmd() + [
+            '-o', f'ControlPath={self._ctl_path}', '-O', 'exit', self.host_name
+        ]
+        self._ctl_path = None
+        proc = await asyncio.create_subprocess_exec(
+            *parts,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        await proc.wait()
+        shutil.rmtree(self._ctl_dir, ignore_errors=True)
+        self._ctl_dir = None
+
+        if verbose:
+            saved = self.mux_stats['reused']
+            print(
+                f'{self.host_name}: {self.mux_stats["commands"]} ssh commands '
+                f'over {self.mux_stats["connects"]} master connection(s), '
+                f'saved {saved} round trips'
+            )
 
     def create_component(self, label, parts, **kwargs):
         return SimpleRemoteComponent(
@@ -388,41 +1026,131 @@ class RemoteExecutor(Executor):
             label,
             parts,
             cwd=self.cwd,
-            ssh_extra_args=self.ssh_extra_args,
+            ssh_extra_args=self.ssh_extra_args + self._mux_args(),
+            agent=self._agent,
             **kwargs
         )
 
     async def await_file(self, path, delay=0.05, verbose=False, timeout=30):
+        await self.await_files([path], delay, verbose, timeout)
+
+    async def await_files(
+        self, paths, delay=0.05, verbose=False, timeout=30, on_ready=None
+    ):
+        """
+        Wait for all of `paths` to exist using a single remote process.
+
+        The remote process reports each path as soon as it appears, so
+        `on_ready(path)` is invoked per path rather than once all have appeared.
+        """
+        paths = list(paths)
+        if not paths:
+            return
         if verbose:
-            print(f'{self.host_name}.await_file({path}) started')
-
-        to_its = timeout / delay
-        loop_cmd = (
-            f'i=0 ; while [ ! -e {path} ] ; do '
-            f'if [ $i -ge {to_its:u} ] ; then exit 1 ; fi ; '
-            f'sleep {delay} ; '
-            'i=$(($i+1)) ; done; exit 0'
-        ) % (path, to_its, delay)
-        parts = ['/bin/sh', '-c', loop_cmd]
-        sc = self.create_component(
-            f"{self.host_name}.await_file('{path}')",
-            parts,
-            canfail=False,
+            print(f'{self.host_name}.await_files({paths}) started')
+
+        agent = await self.agent(verbose)
+        if agent is not None:
+
+            def on_event(msg):
+                if on_ready is not None:
+                    on_ready(msg['path'])
+
+            await agent.call(
+                'await_files',
+                on_event=on_event,
+                paths=paths,
+                delay=delay,
+                timeout=timeout
+            )
+            return
+
+        await self.connect(verbose)
+
+        sc = AwaitFilesComponent(
+            self.host_name,
+            f'{self.host_name}.await_files({paths})',
+            paths,
+            delay=delay,
+            timeout=timeout,
+            on_ready=on_ready,
+            cwd=self.cwd,
+            ssh_extra_args=self.ssh_extra_args + self._mux_args(),
             verbose=verbose
         )
         await sc.start()
         await sc.wait()
 
-    # TODO: Implement opitimized await_files()
+        if sc.pending:
+            raise TimeoutError(
+                f'{self.host_name}: timed out waiting for {sorted(sc.pending)}'
+            )
+
+    async def await_listening(
+        self, paths, ports=(), delay=0.05, verbose=False, timeout=30
+    ):
+        paths = list(paths)
+        ports = list(ports)
+        if not paths and not ports:
+            return True
+        await self.connect(verbose)
+
+        its = int(math.ceil(timeout / delay))
+        # exits with 2 if the socket state is not available
+        script = (
+            'for p in "$@"; do '
+            'case $p in '
+            'tcp:*) [ -r /proc/net/tcp ] || [ -r /proc/net/tcp6 ] || exit 2 ;; '
+            '*) [ -r /proc/net/unix ] || exit 2 ;; '
+            'esac; '
+            'done; '
+            'i=0; '
+            'while :; do '
+            'ok=1; '
+            'for p in "$@"; do '
+            'case $p in '
+            'tcp:*) h=$(printf ":%04X" "${p#tcp:}"); '
+            'cat /proc/net/tcp /proc/net/tcp6 2>/dev/null | '
+            'awk -v h="$h" \'substr($2, length($2) - 4) == h && $4 == "0A" '
+            '{ f = 1 } END { exit !f }\' || ok=0 ;; '
+            '*) awk -v p="$p" \'$8 == p && $4 == "00010000" { f = 1 } '
+            'END { exit !f }\' /proc/net/unix || ok=0 ;; '
+            'esac; '
+            'done; '
+            'if [ $ok -eq 1 ]; then exit 0; fi; '
+            f'if [ $i -ge {its} ]; then exit 1; fi; '
+            f'sleep {delay}; i=$((i+1)); '
+            'done'
+        )
+        args = paths + [f'tcp:{port}' for port in ports]
+        sc = self.create_component(
+            f'{self.host_name}.await_listening({args})',
+            ['/bin/sh', '-c', script, 'sh'] + args,
+            canfail=True,
+            verbose=verbose
+        )
+        await sc.start()
+        await sc.wait()
+        # pylint: disable=protected-access
+        if sc._proc.returncode == 2:
+            return False
+        if sc._proc.returncode != 0:
+            raise TimeoutError(
+                f'{self.host_name}: timed out waiting for {args} to listen'
+            )
+        return True
 
     async def send_file(self, path, verbose):
+        await self.connect(verbose)
         parts = [
             'scp',
             '-o',
             'UserKnownHostsFile=/dev/null',
             '-o',
             'StrictHostKeyChecking=no'
-        ] + self.scp_extra_args + [path, f'{self.host_name}:{path}']
+        ] + self.scp_extra_args + self._mux_args() + [
+            path, f'{self.host_name}:{path}'
+        ]
         sc = SimpleComponent(
             f'{self.host_name}.send_file("{path}")',
             parts,
@@ -432,20 +1160,279 @@ class RemoteExecutor(Executor):
         await sc.start()
         await sc.wait()
 
+    async def _probe(self, args, verbose=False):
+        agent = await self.agent(verbose)
+        if agent is not None:
+            return await agent.call('probe', **args)
+
+        await self.connect(verbose)
+        parts = self._ssh_base_cmd() + self._mux_args() + [
+            self.host_name,
+            '--',
+            self.python,
+            '-c',
+            shlex.quote(AgentClient.agent_source()),
+            '--probe',
+            shlex.quote(json.dumps(args))
+        ]
+        proc = await asyncio.create_subprocess_exec(
+            *parts,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        out, err = await proc.communicate()
+        if proc.returncode != 0:
+            msg = err.decode('utf-8', 'replace').strip()
+            raise RuntimeError(
+                f'probe failed: {msg or f"exit code {proc.returncode}"}'
+            )
+        return json.loads(out)
+
+    async def _stage_cmd(
+        self,
+        script: str,
+        data: tp.Optional[bytes] = None,
+        verbose=False
+    ) -> bytes:
+        """Runs the shell `script` on the host with `data` as its input and
+        returns its output."""
+        await self.connect(verbose)
+        parts = self._ssh_base_cmd() + self._mux_args() + [
+            self.host_name, '--', 'sh', '-c', shlex.quote(script)
+        ]
+        stdin = asyncio.subprocess.PIPE
+        if data is None:
+            stdin = asyncio.subprocess.DEVNULL
+        start = time.monotonic()
+        proc = await asyncio.create_subprocess_exec(
+            *parts,
+            stdin=stdin,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        out, err = await proc.communicate(data)
+        if proc.returncode != 0:
+            raise RuntimeError(
+                f'{self.host_name}: staging files failed: '
+                f'{err.decode("utf-8", "replace").strip()}'
+            )
+        duration = time.monotonic() - start
+        if self._stage_rtt is None or duration < self._stage_rtt:
+            self._stage_rtt = duration
+        # small transfers are dominated by the round trip
+        if data is not None and len(data) >= self.STAGE_RATE_MIN_BYTES:
+            self._stage_rate = len(data) / max(duration - self._stage_rtt, 1e-3)
+        return out
+
+    async def send_files(self, paths, verbose=False):
+        """
+        Copies all of `paths` with at most two ssh commands.
+
+        Files are cached on the host by their content hash, see
+        `stage_cachedir`. Files whose content is not cached yet are sent as a
+        single compressed tar stream, all others are copied from the cache on
+        the host.
+        """
+        paths = list(paths)
+        loop = asyncio.get_running_loop()
+        digests = await loop.run_in_executor(
+            None, lambda: [file_digest(p) for p in paths]
+        )
+        cache = shlex.quote(self.stage_cachedir)
+
+        round_trips = 0
+        for attempt in range(2):
+            # ask which of the files we have not sent before are cached
+            unknown = sorted(set(digests) - self._staged)
+            if unknown:
+                out = await self._stage_cmd(
+                    f'cd {cache} 2>/dev/null || exit 0; '
+                    f'for h in {" ".join(unknown)}; do '
+                    '[ -e "$h" ] && echo "$h"; done; true',
+                    verbose=verbose
+                )
+                round_trips += 1
+                self._staged.update(out.decode('utf-8').split())
+
+            send = {
+                d: p for (p, d) in zip(paths, digests) if d not in self._staged
+            }
+            archive = None
+            script = ['set -e', f'mkdir -p {cache}']
+            if send:
+                archive = await loop.run_in_executor(None, _stage_archive, send)
+                script += [
+                    f't=$(mktemp -d {cache}/.in.XXXXXX)',
+                    'tar -C "$t" -xzf -',
+                    f'mv -f "$t"/* {cache}/',
+                    'rmdir "$t"'
+                ]
+            for (p, d) in zip(paths, digests):
+                dst = shlex.quote(p)
+                dst_dir = shlex.quote(os.path.dirname(p) or '.')
+                script.append(f'mkdir -p {dst_dir}; cp {cache}/{d} {dst}')
+            if verbose:
+                print(
+                    f'{self.host_name}.send_files: {len(paths)} files, '
+                    f'{len(send)} not cached'
+                )
+            try:
+                await self._stage_cmd('\n'.join(script), archive, verbose)
+                round_trips += 1
+                break
+            except RuntimeError:
+                # files we assumed to be cached might have been removed
+                if attempt > 0 or len(send) == len(set(digests)):
+                    raise
+                self._staged.clear()
+        self._staged.update(send)
+
+        sizes = [os.path.getsize(p) for p in paths]
+        # files already cached on the host are not transferred at all
+        cached = sum(size for (size, d) in zip(sizes, digests) if d not in send)
+        seconds_saved = (len(paths) - round_trips) * (self._stage_rtt or 0)
+        if self._stage_rate:
+            seconds_saved += cached / self._stage_rate
+        return {
+            'files': len(paths),
+            'files_sent': len(send),
+            'bytes': sum(sizes),
+            'bytes_sent': len(archive) if archive is not None else 0,
+            'bytes_saved': cached,
+            'seconds_saved': max(seconds_saved, 0.0)
+        }
+
+    async def fetch_files(self, paths, verbose=False):
+        """Copies all of `paths` in a single tar stream over ssh. Relative paths
+        are relative to the working directory on either side."""
+        paths = list(paths)
+        if not paths:
+            return
+        await self.connect(verbose)
+        remote = [
+            'tar', '-C', self.cwd, '-P', '--ignore-failed-read', '-cf', '-'
+        ] + paths
+        src_parts = self._ssh_base_cmd() + self._mux_args() + [
+            self.host_name, '--', ' '.join(shlex.quote(p) for p in remote)
+        ]
+        dst_parts = ['tar', '-P', '-xf', '-']
+        if verbose:
+            print(f'{self.host_name}.fetch_files: {paths}')
+
+        rfd, wfd = os.pipe()
+        try:
+            src = await asyncio.create_subprocess_exec(
+                *src_parts, stdin=asyncio.subprocess.DEVNULL, stdout=wfd
+            )
+            dst = await asyncio.create_subprocess_exec(*dst_parts, stdin=rfd)
+        finally:
+            os.close(rfd)
+            os.close(wfd)
+        try:
+            src_rc, dst_rc = await asyncio.gather(src.wait(), dst.wait())
+        except asyncio.CancelledError:
+            for proc in (src, dst):
+                if proc.returncode is None:
+                    proc.kill()
+            raise
+        if src_rc != 0 or dst_rc != 0:
+            raise RuntimeError(f'{self.host_name}: fetching {paths} failed')
+
     async def mkdir(self, path, verbose=False):
+        await self.mkdirs([path], verbose)
+
+    async def rmtree(self, path, verbose=False):
+        await self.rmtrees([path], verbose)
+
+    async def mkdirs(self, paths, verbose=False):
+        paths = list(paths)
+        agent = await self.agent(verbose)
+        if agent is not None:
+            await agent.call('mkdir', paths=paths)
+            return
+
+        await self.connect(verbose)
         sc = self.create_component(
-            f"{self.host_name}.mkdir('{path}')", ['mkdir', '-p', path],
+            f"{self.host_name}.mkdir('{paths}')", ['mkdir', '-p'] + paths,
             canfail=False,
             verbose=verbose
         )
         await sc.start()
         await sc.wait()
 
-    async def rmtree(self, path, verbose=False):
+    async def rmtrees(self, paths, verbose=False):
+        paths = list(paths)
+        agent = await self.agent(verbose)
+        if agent is not None:
+            await agent.call('rmtree', paths=paths)
+            return
+
+        await self.connect(verbose)
         sc = self.create_component(
-            f'{self.host_name}.rmtree("{path}")', ['rm', '-rf', path],
+            f'{self.host_name}.rmtree("{paths}")', ['rm', '-rf'] + paths,
             canfail=False,
             verbose=verbose
         )
         await sc.start()
         await sc.wait()
+
+
+async def probe_executors(
+    executors: tp.List[Executor],
+    repo: str,
+    paths=(),
+    timeout=30,
+    verbose=False
+) -> tp.List[Executor]:
+    """
+    Probe all `executors` in parallel and return the healthy ones, i.e. those
+    that responded within `timeout` seconds and have the repository at `repo`.
+
+    Connections established for probing are closed again, so the executors can
+    be used from a different event loop afterwards.
+    """
+
+    async def probe_one(executor: Executor) -> tp.Optional[str]:
+        try:
+            info = await asyncio.wait_for(
+                executor.probe(repo, paths, verbose), timeout
+            )
+        except asyncio.TimeoutError:
+            return f'no response within {timeout}s'
+        except (RuntimeError, OSError, ValueError, KeyError) as e:
+            return str(e)
+        finally:
+            await executor.close()
+
+        if not info['repo']:
+            return f'repository {repo} not found'
+        if verbose:
+            hugepages = ', '.join(
+                f'{h["free"]}/{h["total"]} {size}kB'
+                for (size, h) in info['hugepages'].items()
+            )
+            print(
+                f'{executor.label()}: {info["cores"]} cores on '
+                f'{len(info["numa"])} NUMA node(s), {info["mem_avail"]} MB '
+                f'available, hugepages free: {hugepages or "none"}'
+            )
+        if info['missing']:
+            print(
+                f'Warning: {executor.label()} is missing '
+                f'{", ".join(info["missing"])}',
+                file=sys.stderr
+            )
+        return None
+
+    errors = await asyncio.gather(*[probe_one(ex) for ex in executors])
+    healthy = []
+    for (executor, error) in zip(executors, errors):
+        if error is None:
+            healthy.append(executor)
+        else:
+            print(
+                f'Warning: excluding {executor.label()}: {error}',
+                file=sys.stderr
+            )
+    return healthy
@@ -20,7 +20,12 @@
 # TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import json
 import os
+import time
+import typing as tp
+
+from simbricks.orchestration.utils import shm
 
 
 class ExpEnv(object):
@@ -36,6 +41,27 @@ class ExpEnv(object):
         self.workdir = os.path.abspath(workdir)
         self.cpdir = os.path.abspath(cpdir)
         self.shm_base = self.workdir
+        self.shm_mount: tp.Optional[str] = None
+        """Mount point of the memory-backed file system containing `shm_base`,
+        if any."""
+        self.shm_fstype: tp.Optional[str] = None
+        """File system type of `shm_base` if known, `hugetlbfs` means shared
+        memory pools are backed by hugepages."""
+        self.shm_page_size: tp.Optional[int] = None
+        """Size of pages backing shared memory pools, if known."""
+        self.cfgtar_cachedir: tp.Optional[str] = None
+        """If set, config tars are cached in this directory by content hash
+        instead of being rebuilt for every run."""
+        self.overlay_cachedir: tp.Optional[str] = None
+        """If set, qcow2 overlays for host disks are cloned from templates
+        cached in this directory instead of running `qemu-img` for each host.
+        Only supported if simulators run locally."""
+        self.logdir: tp.Optional[str] = None
+        """If set, simulator output is streamed to files in this directory
+        instead of being kept in memory until the run finishes."""
+        self.output_format = 'json'
+        """Format of the experiment output: `json` for a single JSON file or
+        `indexed` for a manifest with separately compressed output streams."""
         self.qemu_img_path = f'{self.repodir}/sims/external/qemu/build/qemu-img'
         self.qemu_path = (
             f'{self.repodir}/sims/external/qemu/build/'
@@ -53,6 +79,45 @@ class ExpEnv(object):
             f'{simics_project_base}/targets/qsp-x86/qsp-modern-core.simics'
         )
 
+    def detect_shm(self):
+        """Determine the (local) file system `shm_base` is on."""
+        m = shm.mount_of(self.shm_base)
+        if m is None:
+            return
+        self.shm_fstype = m.fstype
+        self.shm_page_size = m.page_size()
+        if m.fstype in ['tmpfs', 'hugetlbfs']:
+            self.shm_mount = m.path
+
+    def select_shm_base(self, subdir: str, pools: tp.List[int]) -> bool:
+        """
+        Place shared memory pools with sizes `pools` (in bytes) on a local
+        memory-backed file system with enough free space, preferring hugetlbfs
+        over /dev/shm.
+
+        Sets `shm_base` to `subdir` in a `simbricks` directory on the chosen
+        file system. Returns False and leaves `shm_base` unchanged if there is
+        no suitable one.
+        """
+        for m in shm.candidates():
+            page_size = m.page_size()
+            # hugetlbfs files can only be sized in whole pages
+            if m.fstype == 'hugetlbfs' and any(p % page_size for p in pools):
+                continue
+            if shm.free_bytes(m.path) < shm.usage_for(pools, page_size):
+                continue
+            self.shm_base = os.path.join(m.path, 'simbricks', subdir)
+            self.shm_mount = m.path
+            self.shm_fstype = m.fstype
+            self.shm_page_size = page_size
+            return True
+        return False
+
+    def log_paths(self, sim) -> tp.Tuple[str, str]:
+        """Files for stdout and stderr of a simulator with `logdir` set."""
+        base = f'{self.logdir}/{sim.full_name()}'
+        return (base + '.stdout', base + '.stderr')
+
     def gem5_path(self, variant):
         return f'{self.repodir}/sims/external/gem5/build/X86/gem5.{variant}'
 
@@ -83,11 +148,14 @@ class ExpEnv(object):
     def n2n_eth_path(self, sim_l, sim_c):
         return f'{self.workdir}/n2n.eth.{sim_l.name}.{sim_c.name}'
 
+    def n2n_shm_path(self, sim_l, sim_c):
+        return f'{self.shm_base}/n2n.shm.{sim_l.name}.{sim_c.name}'
+
     def net2host_eth_path(self, sim_n, sim_h):
         return f'{self.workdir}/n2h.eth.{sim_n.name}.{sim_h.name}'
 
     def net2host_shm_path(self, sim_n, sim_h):
-        return f'{self.workdir}/n2h.shm.{sim_n.name}.{sim_h.name}'
+        return f'{self.shm_base}/n2h.shm.{sim_n.name}.{sim_h.name}'
 
     def proxy_shm_path(self, sim):
         return f'{self.shm_base}/proxy.shm.{sim.name}'
@@ -95,6 +163,28 @@ class ExpEnv(object):
     def gem5_outdir(self, sim):
         return f'{self.workdir}/gem5-out.{sim.name}'
 
+    def cp_marker_path(self):
+        """File marking the checkpoints in `cpdir` as complete."""
+        return f'{self.cpdir}/checkpoint.json'
+
+    def has_checkpoint(self, fingerprint: str) -> bool:
+        """Whether `cpdir` contains complete checkpoints for experiments with
+        `fingerprint`."""
+        try:
+            with open(self.cp_marker_path(), 'r', encoding='utf-8') as f:
+                return json.load(f)['fingerprint'] == fingerprint
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def mark_checkpoint(self, fingerprint: str, exp_name: str):
+        marker = {
+            'fingerprint': fingerprint,
+            'experiment': exp_name,
+            'time': time.time()
+        }
+        with open(self.cp_marker_path(), 'w', encoding='utf-8') as f:
+            json.dump(marker, f)
+
     def gem5_cpdir(self, sim):
         return f'{self.cpdir}/gem5-cp.{sim.name}'
 
@@ -20,12 +20,23 @@
 # TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import asyncio
+import bisect
+import concurrent.futures
+import fnmatch
 import json
+import os
 import pathlib
+import shutil
 import time
+import typing as tp
+import zlib
 
 from simbricks.orchestration.experiments import Experiment
 
+INDEXED_FORMAT = 'simbricks-indexed-1'
+"""Value of the `format` key in manifests of the indexed output format."""
+
 
 class ExpOutput(object):
     """Manages an experiment's output."""
@@ -38,6 +49,22 @@ class ExpOutput(object):
         self.sims = {}
         self.success = True
         self.interrupted = False
+        self.startup = None
+        """Time to start all simulators and the critical path of dependent
+        simulators determining it."""
+        self.prep = None
+        """Time spent in the phases of preparing the run."""
+        self.staging = None
+        """Files sent to remote hosts for the run and the bytes and seconds
+        saved by caching and batching them, see `Executor.send_files()`."""
+        self.shm = None
+        """Where shared memory pools were placed and whether they were backed
+        by hugepages."""
+        self.loop_stall = None
+        """How long the orchestrator's event loop was blocked during the run,
+        see `LoopStallMonitor`."""
+        self._indexed = False
+        """Whether `dump()` writes the indexed instead of the JSON format."""
 
     def set_start(self):
         self.start_time = time.time()
@@ -52,21 +79,269 @@ class ExpOutput(object):
         self.success = False
         self.interrupted = True
 
-    def add_sim(self, sim, comp):
+    def set_prep(self, times: tp.Dict[str, float]):
+        self.prep = times
+
+    def set_staging(self, stats: tp.Dict[str, float]):
+        self.staging = stats
+
+    def set_shm(self, env):
+        self.shm = {
+            'base': env.shm_base,
+            'fstype': env.shm_fstype,
+            'page_size': env.shm_page_size,
+            'hugepages': env.shm_fstype == 'hugetlbfs',
+        }
+
+    def set_loop_stall(self, stall: tp.Dict[str, float]):
+        self.loop_stall = stall
+
+    def set_indexed(self, indexed: bool):
+        self._indexed = indexed
+
+    def set_startup(
+        self, total: float, critical_path: tp.List[str], critical_time: float
+    ):
+        self.startup = {
+            'total': total,
+            'critical_path': critical_path,
+            'critical_path_time': critical_time,
+        }
+
+    def add_sim(self, sim, comp, resources: tp.Optional[dict] = None):
         obj = {
             'class': sim.__class__.__name__,
             'cmd': comp.cmd_parts,
-            'stdout': comp.stdout,
-            'stderr': comp.stderr,
         }
+        if resources is not None:
+            # measured resource usage, see `ResourceProfiles`
+            obj['resources'] = resources
+        if comp.stdout_path is not None:
+            # output was streamed to files, only reference those
+            obj['stdout_file'] = os.path.abspath(comp.stdout_path)
+            obj['stderr_file'] = os.path.abspath(comp.stderr_path)
+        else:
+            obj['stdout'] = comp.stdout
+            obj['stderr'] = comp.stderr
         self.sims[sim.full_name()] = obj
 
+    def _public_dict(self):
+        return {k: v for (k, v) in self.__dict__.items() if k[0] != '_'}
+
     def dump(self, outpath: str):
+        if self._indexed:
+            self.dump_indexed(outpath)
+        else:
+            self.dump_json(outpath)
+        self.dump_times(outpath)
+
+    def dump_json(self, outpath: str):
+        """Write output as a single JSON file."""
         pathlib.Path(outpath).parent.mkdir(parents=True, exist_ok=True)
+
+        # store references to log files relative to the output file
+        data = self._public_dict()
+        outdir = os.path.dirname(os.path.abspath(outpath))
+        data['sims'] = {}
+        for name, obj in self.sims.items():
+            obj = dict(obj)
+            for k in ['stdout_file', 'stderr_file']:
+                if k in obj:
+                    obj[k] = os.path.relpath(obj[k], outdir)
+            data['sims'][name] = obj
+
         with open(outpath, 'w', encoding='utf-8') as file:
-            json.dump(self.__dict__, file)
+            json.dump(data, file)
+
+    def dump_times(self, outpath: str):
+        """Write start and end time to `outpath.times`, so they can be looked up
+        without reading the whole output, see `read_duration()`."""
+        times = {'start_time': self.start_time, 'end_time': self.end_time}
+        with open(outpath + '.times', 'w', encoding='utf-8') as file:
+            json.dump(times, file)
+
+    @staticmethod
+    def read_duration(outpath: str) -> float:
+        """Duration in seconds of the run whose output was written to
+        `outpath`."""
+        with open(outpath + '.times', 'r', encoding='utf-8') as file:
+            times = json.load(file)
+        return times['end_time'] - times['start_time']
+
+    async def dump_async(
+        self,
+        outpath: str,
+        pool: tp.Optional[concurrent.futures.Executor] = None
+    ):
+        """
+        Like `dump()`, but serializes in `pool` so the event loop stays
+        responsive for large outputs.
+
+        Without `pool`, the default executor of the event loop is used. JSON
+        encoding in a worker thread regularly releases the GIL, whereas
+        pickling the output for a process pool blocks the loop for about as
+        long as serializing it, so thread pools are preferable.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(pool, self.dump, outpath)
+
+    def dump_indexed(self, outpath: str):
+        """
+        Write output in the indexed format.
+
+        `outpath` receives a JSON manifest, while the output lines of each
+        simulator go to `outpath.streams/`, compressed in blocks of
+        `IndexedStreamWriter.BLOCK_LINES` lines. The manifest records where
+        each block starts, so readers can decode individual line ranges.
+        """
+        pathlib.Path(outpath).parent.mkdir(parents=True, exist_ok=True)
+        streamdir = outpath + '.streams'
+        shutil.rmtree(streamdir, ignore_errors=True)
+        pathlib.Path(streamdir).mkdir()
+
+        data = self._public_dict()
+        data['format'] = INDEXED_FORMAT
+        data['sims'] = {}
+        for name, obj in self.sims.items():
+            m_obj = {
+                k: v
+                for (k, v) in obj.items()
+                if k not in ['stdout', 'stderr', 'stdout_file', 'stderr_file']
+            }
+            m_obj['streams'] = {}
+            for stream in ['stdout', 'stderr']:
+                fname = f'{name}.{stream}.z'
+                writer = IndexedStreamWriter(os.path.join(streamdir, fname))
+                if stream + '_file' in obj:
+                    with open(
+                        obj[stream + '_file'], 'r', encoding='utf-8'
+                    ) as f:
+                        for l in f:
+                            writer.add(l.rstrip('\n'))
+                else:
+                    for l in obj[stream]:
+                        writer.add(l)
+                index = writer.close()
+                index['file'] = os.path.join(os.path.basename(streamdir), fname)
+                m_obj['streams'][stream] = index
+            data['sims'][name] = m_obj
+
+        with open(outpath, 'w', encoding='utf-8') as file:
+            json.dump(data, file)
 
     def load(self, file: str):
         with open(file, 'r', encoding='utf-8') as fp:
-            for k, v in json.load(fp).items():
-                self.__dict__[k] = v
+            data = json.load(fp)
+
+        if data.get('format') == INDEXED_FORMAT:
+            reader = IndexedOutputReader(file, data)
+            for name, obj in data['sims'].items():
+                for stream in ['stdout', 'stderr']:
+                    obj[stream] = reader.lines(name, stream)
+                del obj['streams']
+            del data['format']
+
+        for k, v in data.items():
+            self.__dict__[k] = v
+
+        # read in output that was streamed to log files
+        outdir = os.path.dirname(os.path.abspath(file))
+        for obj in self.sims.values():
+            for stream in ['stdout', 'stderr']:
+                path = obj.get(stream + '_file')
+                if path is None:
+                    continue
+                path = os.path.join(outdir, path)
+                obj[stream + '_file'] = path
+                with open(path, 'r', encoding='utf-8') as f:
+                    obj[stream] = f.read().splitlines()
+
+
+class IndexedStreamWriter(object):
+    """Writes lines to a file as independently compressed blocks."""
+
+    BLOCK_LINES = 4096
+
+    def __init__(self, path: str):
+        # pylint: disable=consider-using-with
+        self.f = open(path, 'wb')
+        self.lines: tp.List[str] = []
+        self.num_lines = 0
+        self.blocks: tp.List[tp.Tuple[int, int, int]] = []
+        """First line, offset and length of each block."""
+        self.offset = 0
+
+    def _flush(self):
+        if not self.lines:
+            return
+        data = zlib.compress(('\n'.join(self.lines)).encode('utf-8'))
+        self.f.write(data)
+        self.blocks.append((self.num_lines, self.offset, len(data)))
+        self.offset += len(data)
+        self.num_lines += len(self.lines)
+        self.lines = []
+
+    def add(self, line: str):
+        self.lines.append(line)
+        if len(self.lines) >= self.BLOCK_LINES:
+            self._flush()
+
+    def close(self):
+        """Finish writing and return the index for the manifest."""
+        self._flush()
+        self.f.close()
+        return {'lines': self.num_lines, 'blocks': self.blocks}
+
+
+class IndexedOutputReader(object):
+    """
+    Random access to output written with `ExpOutput.dump_indexed()`.
+
+    Only the manifest is read upfront, lines are decoded on demand one block at
+    a time.
+    """
+
+    def __init__(self, path: str, manifest: tp.Optional[dict] = None):
+        self.path = path
+        if manifest is None:
+            with open(path, 'r', encoding='utf-8') as fp:
+                manifest = json.load(fp)
+        if manifest.get('format') != INDEXED_FORMAT:
+            raise ValueError(f'{path} is not in the indexed output format')
+        self.manifest = manifest
+
+    def sims(self, pattern: str = '*') -> tp.List[str]:
+        """Names of simulators matching the glob `pattern`."""
+        return fnmatch.filter(self.manifest['sims'].keys(), pattern)
+
+    def num_lines(self, sim: str, stream: str = 'stdout') -> int:
+        return self.manifest['sims'][sim]['streams'][stream]['lines']
+
+    def lines(
+        self,
+        sim: str,
+        stream: str = 'stdout',
+        start: int = 0,
+        end: tp.Optional[int] = None
+    ) -> tp.List[str]:
+        """Lines `start` (inclusive) to `end` (exclusive) of a simulator's
+        `stream`."""
+        index = self.manifest['sims'][sim]['streams'][stream]
+        if end is None or end > index['lines']:
+            end = index['lines']
+        if start >= end:
+            return []
+
+        blocks = index['blocks']
+        first = bisect.bisect_right([b[0] for b in blocks], start) - 1
+        path = os.path.join(os.path.dirname(self.path), index['file'])
+        lines = []
+        with open(path, 'rb') as f:
+            for (b_start, offset, length) in blocks[first:]:
+                if b_start >= end:
+                    break
+                f.seek(offset)
+                b_lines = zlib.decompress(f.read(length)
+                                         ).decode('utf-8').split('\n')
+                lines += b_lines[max(start - b_start, 0):end - b_start]
+        return lines
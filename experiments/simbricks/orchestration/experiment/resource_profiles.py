@@ -0,0 +1,121 @@
+# Copyright 2021 Max Planck Institute for Software Systems, and
+# National University of Singapore
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import math
+import os
+import tempfile
+import typing as tp
+
+from simbricks.orchestration.experiment.experiment_environment import ExpEnv
+from simbricks.orchestration.experiment.experiment_output import ExpOutput
+from simbricks.orchestration.experiments import Experiment
+from simbricks.orchestration.simulators import Simulator
+
+
+class ResourceProfiles(object):
+    """
+    Resource usage measured in earlier runs, used to estimate the requirements
+    of simulators instead of the static `Simulator.resreq_*()` values.
+
+    Profiles are keyed by `Simulator.resource_key()` and persisted as JSON.
+    For each key, the largest observed peak memory and CPU utilization are
+    kept.
+    """
+
+    def __init__(self, path: str, margin: float = 1.1):
+        self.path = path
+        self.margin = margin
+        """Factor applied to measured peak memory to leave some headroom."""
+        self.profiles: tp.Dict[str, tp.Dict[str, float]] = self._read()
+        self._updated: tp.Set[str] = set()
+
+    def _read(self) -> tp.Dict[str, tp.Dict[str, float]]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def add_sample(self, key: str, resources: tp.Dict[str, float]):
+        """Add one measurement as stored in the experiment output."""
+        util = 0
+        if resources['wall_time'] > 0:
+            util = resources['cpu_time'] / resources['wall_time']
+        empty = {'peak_rss_mb': 0, 'cpu_util': 0, 'samples': 0}
+        prof = self.profiles.setdefault(key, empty)
+        prof['peak_rss_mb'] = max(prof['peak_rss_mb'], resources['peak_rss_mb'])
+        prof['cpu_util'] = max(prof['cpu_util'], util)
+        prof['samples'] += 1
+        self._updated.add(key)
+
+    def add_output(self, out: ExpOutput):
+        """Add the measurements of all simulators in an experiment output."""
+        for obj in out.sims.values():
+            if 'resources' in obj:
+                self.add_sample(obj['resources']['key'], obj['resources'])
+
+    def save(self):
+        """Write profiles back, merging with concurrent updates of the file."""
+        profiles = self._read()
+        for key in self._updated:
+            prof = self.profiles[key]
+            old = profiles.get(key)
+            if old is not None:
+                prof['peak_rss_mb'] = max(
+                    prof['peak_rss_mb'], old['peak_rss_mb']
+                )
+                prof['cpu_util'] = max(prof['cpu_util'], old['cpu_util'])
+            profiles[key] = prof
+        self.profiles = profiles
+        self._updated.clear()
+
+        # write atomically so readers never see a partial file
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(profiles, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def resreq_mem(self, sim: Simulator, env: ExpEnv) -> int:
+        """Memory required for `sim` (in MB)."""
+        prof = self.profiles.get(sim.resource_key(env))
+        if prof is None:
+            return sim.resreq_mem()
+        return max(1, int(math.ceil(prof['peak_rss_mb'] * self.margin)))
+
+    def resreq_cores(self, sim: Simulator, env: ExpEnv) -> int:
+        """Number of cores required for `sim`."""
+        prof = self.profiles.get(sim.resource_key(env))
+        if prof is None:
+            return sim.resreq_cores()
+        # allow for some measurement noise before rounding up
+        return max(1, int(math.ceil(prof['cpu_util'] - 0.05)))
+
+    def exp_resreq(self, exp: Experiment, env: ExpEnv) -> tp.Tuple[int, int]:
+        """Cores and memory required for all simulators in `exp`."""
+        cores = 0
+        mem = 0
+        for sim in exp.all_simulators():
+            cores += self.resreq_cores(sim, env)
+            mem += self.resreq_mem(sim, env)
+        return (cores, mem)
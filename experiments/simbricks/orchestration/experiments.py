@@ -20,7 +20,9 @@
 # TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import hashlib
 import itertools
+import json
 import typing as tp
 
 from simbricks.orchestration import simulators
@@ -127,6 +129,24 @@ class Experiment(object):
             cores += s.resreq_cores()
         return cores
 
+    def checkpoint_fingerprint(self) -> str:
+        """
+        Hash of everything that affects the checkpoints of this experiment.
+
+        Experiments with the same fingerprint can share checkpoints.
+        """
+        cfg = {h.name: h.checkpoint_config() for h in self.hosts}
+        data = json.dumps(cfg, sort_keys=True).encode('utf-8')
+        return hashlib.sha256(data).hexdigest()
+
+    def shm_pools(self) -> tp.List[int]:
+        """Sizes (in bytes) of all shared memory pools created in
+        `ExpEnv.shm_base`."""
+        pools = []
+        for s in self.all_simulators():
+            pools += s.shm_pools()
+        return pools
+
 
 class DistributedExperiment(Experiment):
     """Describes a distributed simulation experiment."""
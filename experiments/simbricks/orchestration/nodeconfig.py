@@ -22,10 +22,65 @@
 
 from __future__ import annotations
 
+import hashlib
 import io
+import os
 import tarfile
+import tempfile
+import threading
 import typing as tp
 
+from simbricks.orchestration.utils.files import clone_file
+
+_file_digests: tp.Dict[tp.Tuple[str, int, int], bytes] = {}
+"""Digests of config files on disk, by path, size and modification time."""
+_file_digests_lock = threading.Lock()
+
+
+def _content_digest(f: tp.IO) -> bytes:
+    """Digest of the contents of an IO handle from `config_files()`. For files
+    on disk, the contents are only read if they changed since last time."""
+    key = None
+    path = getattr(f, 'name', None)
+    if isinstance(path, str) and os.path.isfile(path):
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        with _file_digests_lock:
+            if key in _file_digests:
+                return _file_digests[key]
+
+    f.seek(0, io.SEEK_SET)
+    h = hashlib.sha256()
+    while True:
+        buf = f.read(1024 * 1024)
+        if not buf:
+            break
+        h.update(buf)
+    digest = h.digest()
+
+    if key is not None:
+        with _file_digests_lock:
+            _file_digests[key] = digest
+    return digest
+
+
+def _tar_digest(contents: tp.List[tp.Tuple[str, tp.IO]]) -> str:
+    h = hashlib.sha256()
+    for (n, f) in contents:
+        h.update(n.encode('utf-8') + b'\0' + _content_digest(f))
+    return h.hexdigest()
+
+
+def _write_tar(path: str, contents: tp.List[tp.Tuple[str, tp.IO]]):
+    with tarfile.open(path, 'w:') as tar:
+        for (n, f) in contents:
+            f_i = tarfile.TarInfo(n)
+            f_i.mode = 0o777
+            f.seek(0, io.SEEK_END)
+            f_i.size = f.tell()
+            f.seek(0, io.SEEK_SET)
+            tar.addfile(tarinfo=f_i, fileobj=f)
+
 
 class AppConfig():
     """Defines the application to run on a node or host."""
@@ -100,26 +155,50 @@ class NodeConfig():
             self.run_cmds() + self.cleanup_cmds() + exit_es
         return '\n'.join(es)
 
-    def make_tar(self, path):
-        with tarfile.open(path, 'w:') as tar:
-            # add main run script
-            cfg_i = tarfile.TarInfo('guest/run.sh')
-            cfg_i.mode = 0o777
-            cfg_f = self.strfile(self.config_str())
-            cfg_f.seek(0, io.SEEK_END)
-            cfg_i.size = cfg_f.tell()
-            cfg_f.seek(0, io.SEEK_SET)
-            tar.addfile(tarinfo=cfg_i, fileobj=cfg_f)
-            cfg_f.close()
-
-            # add additional config files
-            for (n, f) in self.config_files().items():
-                f_i = tarfile.TarInfo('guest/' + n)
-                f_i.mode = 0o777
-                f.seek(0, io.SEEK_END)
-                f_i.size = f.tell()
-                f.seek(0, io.SEEK_SET)
-                tar.addfile(tarinfo=f_i, fileobj=f)
+    def tar_contents(self) -> tp.List[tp.Tuple[str, tp.IO]]:
+        """Files to put in the config tar, with their paths in the tar."""
+        contents = [('guest/run.sh', self.strfile(self.config_str()))]
+        for (n, f) in self.config_files().items():
+            contents.append(('guest/' + n, f))
+        return contents
+
+    def tar_digest(self) -> str:
+        """Hash of the contents of the config tar."""
+        contents = self.tar_contents()
+        try:
+            return _tar_digest(contents)
+        finally:
+            for (_, f) in contents:
+                f.close()
+
+    def make_tar(self, path, cachedir: tp.Optional[str] = None):
+        """
+        Write the config tar to `path`.
+
+        With `cachedir` set, tars are stored there by a hash of their contents
+        and only built if not cached yet. The cached tar is then cloned to
+        `path`. Not hard-linked, as simulators open it as a writable disk.
+        """
+        contents = self.tar_contents()
+        try:
+            if cachedir is None:
+                _write_tar(path, contents)
+                return
+
+            cached = os.path.join(cachedir, _tar_digest(contents) + '.tar')
+            if not os.path.exists(cached):
+                os.makedirs(cachedir, exist_ok=True)
+                fd, tmp = tempfile.mkstemp(dir=cachedir, suffix='.tmp')
+                os.close(fd)
+                try:
+                    _write_tar(tmp, contents)
+                    os.replace(tmp, cached)
+                except BaseException:
+                    os.unlink(tmp)
+                    raise
+            clone_file(cached, path)
+        finally:
+            for (_, f) in contents:
                 f.close()
 
     def prepare_pre_cp(self) -> tp.List[str]:
@@ -50,11 +50,14 @@ class NetProxy(SimProxy):
                                     bool]] = []
         """List of tuples ((netL,netC), with_listener)"""
         self.shm_size = 2048
-        """Shared memory size in GB"""
+        """Shared memory size in MB"""
 
     def start_delay(self):
         return 10
 
+    def shm_pools(self):
+        return [self.shm_size * 1024 * 1024]
+
 
 class NetProxyListener(NetProxy):
 
@@ -64,6 +67,9 @@ class NetProxyListener(NetProxy):
         self.connecter = None
         self.listen = True
 
+    def listen_ports(self):
+        return [self.port]
+
     def add_nic(self, nic):
         self.nics.append((nic, True))
 
@@ -0,0 +1,234 @@
+# Copyright 2022 Max Planck Institute for Software Systems, and
+# National University of Singapore
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Agent executing filesystem and process operations on behalf of an executor.
+
+This file is shipped verbatim to remote hosts and run with `python3 -c`, so it
+must only depend on the standard library. It speaks a simple framed protocol on
+stdin/stdout: every message is a 4 byte big-endian length followed by a JSON
+object of that length.
+
+Requests have the form `{"id": N, "op": "...", "args": {...}}` and are answered
+with `{"id": N, "ok": true, "result": ...}` or `{"id": N, "ok": false,
+"error": "...", "type": "..."}`. Long-running operations may send intermediate
+`{"id": N, "event": "...", ...}` messages before the final response. Requests
+are processed concurrently.
+
+Run with `--probe ARGS` instead, it prints the result of `probe()` for the JSON
+object `ARGS` and exits.
+"""
+
+import glob
+import json
+import os
+import shutil
+import signal
+import struct
+import sys
+import threading
+import time
+
+HDR = struct.Struct('>I')
+
+
+def _cpulist(s):
+    cpus = set()
+    for part in s.strip().split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.update(range(int(first), int(last) + 1))
+        elif part:
+            cpus.add(int(part))
+    return cpus
+
+
+def probe(args):
+    """
+    Resources of this host: usable cores, usable cores per NUMA node, available
+    memory (in MB) and total and free hugepages per page size (in kB).
+
+    Also reports whether the repository `args['repo']` exists and which of
+    `args['paths']` are missing.
+    """
+    usable = os.sched_getaffinity(0)
+    numa = {}
+    for path in glob.glob('/sys/devices/system/node/node*/cpulist'):
+        node = os.path.basename(os.path.dirname(path))[len('node'):]
+        with open(path, 'r', encoding='utf-8') as f:
+            cpus = _cpulist(f.read()) & usable
+        if cpus:
+            numa[node] = len(cpus)
+
+    mem_avail = None
+    with open('/proc/meminfo', 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('MemAvailable:'):
+                mem_avail = int(line.split()[1]) // 1024
+
+    hugepages = {}
+    for d in glob.glob('/sys/kernel/mm/hugepages/hugepages-*kB'):
+        size = os.path.basename(d)[len('hugepages-'):-len('kB')]
+        counts = {}
+        for key in ('nr_hugepages', 'free_hugepages'):
+            with open(os.path.join(d, key), 'r', encoding='utf-8') as f:
+                counts[key] = int(f.read())
+        hugepages[size] = {
+            'total': counts['nr_hugepages'], 'free': counts['free_hugepages']
+        }
+
+    return {
+        'host': os.uname().nodename,
+        'cores': len(usable),
+        'numa': numa,
+        'mem_avail': mem_avail,
+        'hugepages': hugepages,
+        'repo': os.path.isdir(args.get('repo', '.')),
+        'missing': [p for p in args.get('paths', []) if not os.path.exists(p)]
+    }
+
+
+class Agent(object):
+
+    def __init__(self, fin, fout):
+        self.fin = fin
+        self.fout = fout
+        self.out_lock = threading.Lock()
+
+    def send(self, msg):
+        data = json.dumps(msg).encode('utf-8')
+        with self.out_lock:
+            self.fout.write(HDR.pack(len(data)) + data)
+            self.fout.flush()
+
+    def recv(self):
+        hdr = self.fin.read(HDR.size)
+        if len(hdr) < HDR.size:
+            return None
+        (length,) = HDR.unpack(hdr)
+        data = self.fin.read(length)
+        if len(data) < length:
+            return None
+        return json.loads(data.decode('utf-8'))
+
+    def op_ping(self, _):
+        return {'pid': os.getpid(), 'host': os.uname().nodename}
+
+    def op_mkdir(self, args):
+        for p in args['paths']:
+            os.makedirs(p, exist_ok=True)
+
+    def op_rmtree(self, args):
+        for p in args['paths']:
+            if os.path.isdir(p) and not os.path.islink(p):
+                shutil.rmtree(p, ignore_errors=True)
+            elif os.path.lexists(p):
+                os.unlink(p)
+
+    def op_stat(self, args):
+        res = {}
+        for p in args['paths']:
+            try:
+                st = os.stat(p)
+                res[p] = {
+                    'mode': st.st_mode,
+                    'size': st.st_size,
+                    'mtime': st.st_mtime
+                }
+            except OSError:
+                res[p] = None
+        return res
+
+    def op_await_files(self, args, req_id=None):
+        pending = list(args['paths'])
+        delay = args.get('delay', 0.05)
+        deadline = time.monotonic() + args.get('timeout', 30)
+        while True:
+            left = []
+            for p in pending:
+                if os.path.exists(p):
+                    if req_id is not None:
+                        self.send({'id': req_id, 'event': 'ready', 'path': p})
+                else:
+                    left.append(p)
+            pending = left
+            if not pending:
+                return None
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f'timed out waiting for {pending}')
+            time.sleep(delay)
+
+    def op_signal(self, args):
+        sig = getattr(signal, 'SIG' + args.get('sig', 'TERM'))
+        for pid in args['pids']:
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def op_probe(self, args):
+        return probe(args)
+
+    def op_batch(self, args):
+        """Executes a list of calls in order, stopping at the first error."""
+        results = []
+        for call in args['calls']:
+            fn = getattr(self, 'op_' + call['op'])
+            results.append(fn(call.get('args', {})))
+        return results
+
+    def handle(self, req):
+        try:
+            op = req['op']
+            fn = getattr(self, 'op_' + op, None)
+            if fn is None:
+                raise ValueError(f'unknown operation {op}')
+            if op == 'await_files':
+                result = fn(req.get('args', {}), req['id'])
+            else:
+                result = fn(req.get('args', {}))
+            self.send({'id': req['id'], 'ok': True, 'result': result})
+        except Exception as e:  # pylint: disable=broad-except
+            self.send({
+                'id': req['id'],
+                'ok': False,
+                'type': type(e).__name__,
+                'error': str(e)
+            })
+
+    def run(self):
+        while True:
+            req = self.recv()
+            if req is None or req.get('op') == 'exit':
+                return
+            threading.Thread(target=self.handle, args=(req,),
+                             daemon=True).start()
+
+
+def main():
+    if sys.argv[1:2] == ['--probe']:
+        json.dump(probe(json.loads(sys.argv[2])), sys.stdout)
+        return
+    Agent(sys.stdin.buffer, sys.stdout.buffer).run()
+
+
+if __name__ == '__main__':
+    main()
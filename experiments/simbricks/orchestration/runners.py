@@ -23,6 +23,7 @@
 import asyncio
 import itertools
 import shlex
+import time
 import traceback
 import typing as tp
 from abc import ABC, abstractmethod
@@ -37,6 +38,10 @@ from simbricks.orchestration.experiments import (
 )
 from simbricks.orchestration.simulators import Simulator
 from simbricks.orchestration.utils import graphlib
+from simbricks.orchestration.utils.loopmon import LoopStallMonitor
+from simbricks.orchestration.utils.overlays import OverlayCache
+from simbricks.orchestration.utils.placement import Placement
+from simbricks.orchestration.utils.procstat import ResourceSampler
 
 
 class ExperimentBaseRunner(ABC):
@@ -46,9 +51,16 @@ class ExperimentBaseRunner(ABC):
         self.env = env
         self.verbose = verbose
         self.out = ExpOutput(exp)
+        self.out.set_indexed(env.output_format == 'indexed')
         self.running: tp.List[tp.Tuple[Simulator, SimpleComponent]] = []
         self.sockets = []
         self.wait_sims: tp.List[Component] = []
+        self.start_times: tp.Dict[Simulator, tp.Tuple[float, float]] = {}
+        """Time when starting each simulator began and when it was ready."""
+        self.samplers: tp.Dict[Simulator, ResourceSampler] = {}
+        """Resource usage samplers for simulators on supporting executors."""
+        self.placement: tp.Optional[Placement] = None
+        """If set, simulators are pinned to the cores assigned here."""
 
     @abstractmethod
     def sim_executor(self, sim: Simulator) -> Executor:
@@ -66,7 +78,11 @@ class ExperimentBaseRunner(ABC):
 
     async def start_sim(self, sim: Simulator):
         """Start a simulator and wait for it to be ready."""
+        begin = time.monotonic()
+        await self._start_sim(sim)
+        self.start_times[sim] = (begin, time.monotonic())
 
+    async def _start_sim(self, sim: Simulator):
         name = sim.full_name()
         if self.verbose:
             print(f'{self.exp.name}: starting {name}')
@@ -82,8 +98,16 @@ class ExperimentBaseRunner(ABC):
         sc = executor.create_component(
             name, shlex.split(run_cmd), verbose=self.verbose, canfail=True
         )
+        if self.env.logdir is not None:
+            sc.log_to_files(*self.env.log_paths(sim))
+        if self.placement is not None and self.placement.cpus.get(sim):
+            sc.pin(self.placement.cpus[sim], self.placement.nodes.get(sim))
         await sc.start()
         self.running.append((sim, sc))
+        sampler = executor.resource_sampler(sc)
+        if sampler is not None:
+            sampler.start()
+            self.samplers[sim] = sampler
 
         # add sockets for cleanup
         for s in sim.sockets_cleanup(self.env):
@@ -97,10 +121,18 @@ class ExperimentBaseRunner(ABC):
 
             await executor.await_files(wait_socks, verbose=self.verbose)
 
-        # add time delay if required
-        delay = sim.start_delay()
-        if delay > 0:
-            await asyncio.sleep(delay)
+        use_delay = sim.use_start_delay()
+        if not use_delay and (wait_socks or sim.listen_ports()):
+            # fall back to the delay if the host cannot tell whether the
+            # sockets are listening
+            use_delay = not await executor.await_listening(
+                wait_socks, sim.listen_ports(), verbose=self.verbose
+            )
+        if use_delay:
+            # add time delay if required
+            delay = sim.start_delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
 
         if sim.wait_terminate():
             self.wait_sims.append(sc)
@@ -118,15 +150,57 @@ class ExperimentBaseRunner(ABC):
         pass
 
     async def prepare(self):
-        # generate config tars
-        copies = []
-        for host in self.exp.hosts:
+        begin = time.monotonic()
+        times = {}
+
+        async def timed(name, coro):
+            start = time.monotonic()
+            await coro
+            times[name] = time.monotonic() - start
+
+        # generate config tars in worker threads, then copy them to executors
+        loop = asyncio.get_running_loop()
+
+        async def prepare_tar(host):
             path = self.env.cfgtar_path(host)
             if self.verbose:
                 print('preparing config tar:', path)
-            host.node_config.make_tar(path)
-            copies.append(self.sim_executor(host).send_file(path, self.verbose))
-        await asyncio.wait(copies)
+            await loop.run_in_executor(
+                None, host.node_config.make_tar, path, self.env.cfgtar_cachedir
+            )
+
+        await timed(
+            'tars',
+            asyncio.gather(*[prepare_tar(host) for host in self.exp.hosts])
+        )
+
+        # send all tars for an executor in one batch
+        tars: tp.Dict[Executor, tp.List[str]] = {}
+        for host in self.exp.hosts:
+            paths = tars.setdefault(self.sim_executor(host), [])
+            paths.append(self.env.cfgtar_path(host))
+        staging = {}
+
+        async def send_tars(executor, paths):
+            stats = await executor.send_files(paths, self.verbose)
+            for (key, value) in stats.items():
+                staging[key] = staging.get(key, 0) + value
+
+        sends = [send_tars(ex, paths) for (ex, paths) in tars.items()]
+        await timed('staging', asyncio.gather(*sends))
+        if staging:
+            self.out.set_staging(staging)
+
+        # create disk overlays in bulk
+        overlays = []
+        for sim in self.exp.all_simulators():
+            overlays += sim.disk_overlays(self.env)
+        preps = []
+        if overlays:
+            cache = OverlayCache(
+                self.env.overlay_cachedir, self.env.qemu_img_path
+            )
+            preps.append(timed('overlays', cache.create(overlays)))
 
         # prepare all simulators in parallel
         sims = []
@@ -138,7 +212,11 @@ class ExperimentBaseRunner(ABC):
                     'prepare_' + self.exp.name, prep_cmds, verbose=self.verbose
                 )
             )
-        await asyncio.wait(sims)
+        preps.append(timed('prep_cmds', asyncio.gather(*sims)))
+        await asyncio.gather(*preps)
+
+        times['total'] = time.monotonic() - begin
+        self.out.set_prep(times)
 
     async def wait_for_sims(self):
         """Wait for simulators to terminate (the ones marked to wait on)."""
@@ -147,26 +225,85 @@ class ExperimentBaseRunner(ABC):
         for sc in self.wait_sims:
             await sc.wait()
 
-    async def run(self):
+    def startup_critical_path(
+        self, graph: tp.Dict[Simulator, tp.Set[Simulator]]
+    ) -> tp.Tuple[tp.List[Simulator], float]:
+        """
+        Determine the chain of dependent simulators that took longest to start.
+
+        Returns the simulators on this path in start order and the sum of their
+        start durations.
+        """
+        finish: tp.Dict[Simulator, float] = {}
+        pred: tp.Dict[Simulator, tp.Optional[Simulator]] = {}
+        for sim in graphlib.TopologicalSorter(graph).static_order():
+            if sim not in self.start_times:
+                continue
+            begin, ready = self.start_times[sim]
+            best = None
+            for d in graph.get(sim, ()):
+                if d in finish and (best is None or finish[d] > finish[best]):
+                    best = d
+            pred[sim] = best
+            prev = finish[best] if best is not None else 0
+            finish[sim] = (ready - begin) + prev
+
+        if not finish:
+            return ([], 0)
+        last = max(finish, key=lambda s: finish[s])
+        path = []
+        sim = last
+        while sim is not None:
+            path.append(sim)
+            sim = pred[sim]
+        path.reverse()
+        return (path, finish[last])
+
+    async def start_sims(self):
+        """Start all simulators, each as soon as all its dependencies are
+        ready."""
+        graph = self.sim_graph()
+        ts = graphlib.TopologicalSorter(graph)
+        ts.prepare()
+        starting: tp.Dict[asyncio.Task, Simulator] = {}
+        begin = time.monotonic()
         try:
-            self.out.set_start()
-
-            graph = self.sim_graph()
-            ts = graphlib.TopologicalSorter(graph)
-            ts.prepare()
             while ts.is_active():
-                # start ready simulators in parallel
-                starts = []
-                sims = []
                 for sim in ts.get_ready():
-                    starts.append(self.start_sim(sim))
-                    sims.append(sim)
-
-                # wait for starts to complete
-                await asyncio.wait(starts)
+                    task = asyncio.create_task(self.start_sim(sim))
+                    starting[task] = sim
 
-                for sim in sims:
+                done, _ = await asyncio.wait(
+                    starting.keys(), return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    sim = starting.pop(task)
+                    task.result()  # raises if starting failed
                     ts.done(sim)
+        finally:
+            for task in starting:
+                task.cancel()
+            if starting:
+                await asyncio.wait(starting.keys())
+
+        total = time.monotonic() - begin
+        path, path_time = self.startup_critical_path(graph)
+        self.out.set_startup(total, [s.full_name() for s in path], path_time)
+        if self.verbose:
+            print(
+                f'{self.exp.name}: all simulators started after {total:.2f}s, '
+                f'critical path ({path_time:.2f}s): '
+                f'{" -> ".join(s.full_name() for s in path)}'
+            )
+
+    async def run(self):
+        stall_monitor = LoopStallMonitor()
+        stall_monitor.start()
+        try:
+            self.out.set_start()
+            self.out.set_shm(self.env)
+
+            await self.start_sims()
 
             await self.before_wait()
             await self.wait_for_sims()
@@ -190,25 +327,42 @@ class ExperimentBaseRunner(ABC):
             # "interrupt, terminate, kill" all processes
             scs = []
             for _, sc in self.running:
-                scs.append(sc.int_term_kill())
-            await asyncio.wait(scs)
+                scs.append(asyncio.create_task(sc.int_term_kill()))
+            if scs:
+                await asyncio.wait(scs)
 
             # wait for all processes to terminate
             for _, sc in self.running:
                 await sc.wait()
 
-            # remove all sockets
-            scs = []
+            # remove all sockets, batched per executor
+            exec_socks: tp.Dict[Executor, tp.List[str]] = {}
             for (executor, sock) in self.sockets:
-                scs.append(executor.rmtree(sock))
+                exec_socks.setdefault(executor, []).append(sock)
+            scs = []
+            for (executor, socks) in exec_socks.items():
+                scs.append(executor.rmtrees(socks))
             if scs:
-                await asyncio.wait(scs)
+                await asyncio.gather(*scs)
 
             # add all simulator components to the output
             for sim, sc in self.running:
-                self.out.add_sim(sim, sc)
+                resources = None
+                if sim in self.samplers:
+                    await self.samplers[sim].stop()
+                    resources = self.samplers[sim].result()
+                    resources['key'] = sim.resource_key(self.env)
+                self.out.add_sim(sim, sc, resources)
 
             await self.after_cleanup()
+
+            await stall_monitor.stop()
+            self.out.set_loop_stall(stall_monitor.result())
+
+            if self.env.create_cp and self.out.success:
+                self.env.mark_checkpoint(
+                    self.exp.checkpoint_fingerprint(), self.exp.name
+                )
         return self.out
 
 
@@ -20,9 +20,11 @@
 # TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-from simbricks.orchestration.runtime.common import Run, Runtime
+from simbricks.orchestration.runtime.common import (
+    Run, Runtime, SequentialRuntime
+)
 from simbricks.orchestration.runtime.distributed import (
-    DistributedSimpleRuntime, auto_dist
+    DistributedParallelRuntime, DistributedSimpleRuntime, auto_dist
 )
 from simbricks.orchestration.runtime.local import (
     LocalParallelRuntime, LocalSimpleRuntime
@@ -23,15 +23,23 @@
 # Allow own class to be used as type for a method's argument
 from __future__ import annotations
 
+import asyncio
+import concurrent.futures
 import pathlib
 import shutil
+import sys
+import traceback
 import typing as tp
 from abc import ABCMeta, abstractmethod
 
-from simbricks.orchestration.exectools import LocalExecutor
+from simbricks.orchestration.exectools import Executor, LocalExecutor
 from simbricks.orchestration.experiment.experiment_environment import ExpEnv
 from simbricks.orchestration.experiment.experiment_output import ExpOutput
 from simbricks.orchestration.experiments import Experiment
+from simbricks.orchestration.runners import ExperimentBaseRunner
+from simbricks.orchestration.simulators import Simulator
+from simbricks.orchestration.utils import shm
+from simbricks.orchestration.utils.loopmon import LoopStallMonitor
 
 
 class Run(object):
@@ -57,22 +65,74 @@ class Run(object):
     def name(self):
         return self.experiment.name + '.' + str(self.index)
 
+    def shm_demand(self) -> tp.Tuple[tp.Optional[str], int]:
+        """Memory-backed file system the shared memory pools of this run are
+        placed on and the space they take there, or `(None, 0)` if they are not
+        on such a file system."""
+        if self.env.shm_mount is None:
+            return (None, 0)
+        return (
+            self.env.shm_mount,
+            shm.usage_for(self.experiment.shm_pools(), self.env.shm_page_size)
+        )
+
+    def shm_fits(self) -> bool:
+        """Whether there currently is enough space for the shared memory pools
+        of this run."""
+        mount, size = self.shm_demand()
+        return mount is None or shm.free_bytes(mount) >= size
+
+    def missing_files(
+        self,
+        executor: Executor,
+        sims: tp.Optional[tp.Iterable[Simulator]] = None
+    ) -> tp.Set[str]:
+        """Files required by `sims` (by default all simulators of this run)
+        that are missing on `executor` according to its last probe."""
+        if not executor.missing_files:
+            return set()
+        if sims is None:
+            sims = self.experiment.all_simulators()
+        return {
+            f for sim in sims for f in sim.required_files(self.env)
+        } & executor.missing_files
+
     async def prep_dirs(self, executor=LocalExecutor()):
+        await self.prep_dirs_all([executor])
+
+    async def prep_dirs_all(self, executors: tp.List[Executor]):
+        """Prepare directories for this run locally and on all `executors` in
+        parallel."""
         shutil.rmtree(self.env.workdir, ignore_errors=True)
-        await executor.rmtree(self.env.workdir)
         shutil.rmtree(self.env.shm_base, ignore_errors=True)
-        await executor.rmtree(self.env.shm_base)
-
+        rm_dirs = [self.env.workdir, self.env.shm_base]
         if self.env.create_cp:
             shutil.rmtree(self.env.cpdir, ignore_errors=True)
-            await executor.rmtree(self.env.cpdir)
+            rm_dirs.append(self.env.cpdir)
+        await asyncio.gather(*[e.rmtrees(rm_dirs) for e in executors])
 
-        pathlib.Path(self.env.workdir).mkdir(parents=True, exist_ok=True)
-        await executor.mkdir(self.env.workdir)
-        pathlib.Path(self.env.cpdir).mkdir(parents=True, exist_ok=True)
-        await executor.mkdir(self.env.cpdir)
-        pathlib.Path(self.env.shm_base).mkdir(parents=True, exist_ok=True)
-        await executor.mkdir(self.env.shm_base)
+        dirs = [self.env.workdir, self.env.cpdir, self.env.shm_base]
+        for d in dirs:
+            pathlib.Path(d).mkdir(parents=True, exist_ok=True)
+        await asyncio.gather(*[e.mkdirs(dirs) for e in executors])
+
+        # output logs are written by the orchestrator, so they are always local
+        if self.env.logdir is not None:
+            shutil.rmtree(self.env.logdir, ignore_errors=True)
+            pathlib.Path(self.env.logdir).mkdir(parents=True, exist_ok=True)
+
+    async def remove_shm(self, executors: tp.List[Executor]):
+        """Remove the shared memory pools of this run locally and on all
+        `executors`, so they stop occupying memory-backed file systems. Nothing
+        is removed if they are placed in (a parent of) the working directory."""
+        shm_base = pathlib.PurePath(self.env.shm_base)
+        workdir = pathlib.PurePath(self.env.workdir)
+        if shm_base == workdir or shm_base in workdir.parents:
+            return
+        shutil.rmtree(shm_base, ignore_errors=True)
+        await asyncio.gather(
+            *[e.rmtrees([self.env.shm_base]) for e in executors]
+        )
 
 
 class Runtime(metaclass=ABCMeta):
@@ -99,3 +159,203 @@ class Runtime(metaclass=ABCMeta):
         cleanly and their output collected.
         """
         self._interrupted = True
+
+    def job_failed(self, job: asyncio.Task, run: Run) -> bool:
+        """
+        Check whether the finished `job` executing `run` failed.
+
+        Runs fail if executing them raised an exception, which is reported here,
+        or if they were cancelled before their simulators started.
+        """
+        if job.cancelled():
+            return True
+        exc = job.exception()
+        if exc is not None:
+            print(f'run {run.name()} failed:', file=sys.stderr)
+            traceback.print_exception(type(exc), exc, exc.__traceback__)
+            return True
+        return job.result() is None
+
+    def skip_failed(self, runs: tp.List[Run], failed: tp.Set[Run]) -> None:
+        """Remove runs from `runs` whose prerequisite run is in `failed`,
+        including transitively, and add them to `failed`."""
+        while True:
+            skipped = [run for run in runs if run.prereq in failed]
+            if not skipped:
+                return
+            for run in skipped:
+                print(
+                    f'skipping run {run.name()}: prerequisite run '
+                    f'{run.prereq.name()} failed'
+                )
+                runs.remove(run)
+                failed.add(run)
+
+
+class SequentialRuntime(Runtime):
+    """
+    Base class for runtimes executing runs one after the other.
+
+    In pipelined mode, the next run is prepared and the output of the previous
+    run is written while the simulators of the current run execute. Runs still
+    start in the same order and only after their predecessor completed, and
+    errors surface at the same point as when not pipelining.
+    """
+
+    def __init__(
+        self,
+        verbose=False,
+        pipeline=False,
+        output_pool: tp.Optional[concurrent.futures.Executor] = None
+    ):
+        super().__init__()
+        self.runnable: tp.List[Run] = []
+        self.complete: tp.List[Run] = []
+        self.verbose = verbose
+        self.pipeline = pipeline
+        """Overlap preparation and output writing with execution of runs."""
+        self.output_pool = output_pool
+        """Pool to serialize run output in, see `ExpOutput.dump_async()`."""
+        self._running: tp.Optional[asyncio.Task] = None
+        self._preparing: tp.Dict[Run, asyncio.Task] = {}
+        """Preparation of the next run started ahead of time."""
+        self._writing: tp.Optional[asyncio.Future] = None
+        """Output of the previous run being written."""
+
+    def add_run(self, run: Run):
+        self.runnable.append(run)
+
+    @abstractmethod
+    async def prepare_run(self, run: Run) -> ExperimentBaseRunner:
+        """Prepares directories and simulators for `run` and returns the
+        runner to execute it with."""
+        pass
+
+    @abstractmethod
+    async def close(self):
+        """Releases executors after all runs are done."""
+        pass
+
+    # pylint: disable=unused-argument
+    def can_run(self, run: Run) -> bool:
+        """Checked right before `run` is started, runs for which this returns
+        False are skipped."""
+        return True
+
+    async def write_output(self, run: Run):
+        """Writes the collected output of `run` to its output file."""
+        # if the log is huge, this step takes some time
+        if self.verbose:
+            print(
+                f'Writing collected output of run {run.name()} to JSON file ...'
+            )
+        await run.output.dump_async(run.outpath, self.output_pool)
+
+    def can_overlap(self, cur: Run, nxt: Run) -> bool:
+        """Whether `nxt` can be prepared while `cur` is executing, i.e. it
+        neither depends on `cur` nor shares directories it resets."""
+        if nxt.prereq is cur or cur.env.workdir == nxt.env.workdir:
+            return False
+        if cur.env.create_cp or nxt.env.create_cp:
+            return cur.env.cpdir != nxt.env.cpdir
+        return True
+
+    async def cleanup_run(self, run: Run):
+        """Called after the simulators of `run` terminated, for releasing
+        resources held on its executors."""
+        pass
+
+    async def do_run(self, run: Run):
+        """Actually executes `run`."""
+        try:
+            runner = await self.prepare_run(run)
+        except asyncio.CancelledError:
+            # it is safe to just exit here because we are not running any
+            # simulators yet
+            return
+
+        try:
+            run.output = await runner.run()  # already handles CancelledError
+        finally:
+            await self.cleanup_run(run)
+        self.complete.append(run)
+        await self.write_output(run)
+
+    async def _start_sequential(self):
+        for run in self.runnable:
+            if self._interrupted:
+                return
+            if not self.can_run(run):
+                continue
+
+            self._running = asyncio.create_task(self.do_run(run))
+            await self._running
+
+    async def _start_pipelined(self):
+        for i, run in enumerate(self.runnable):
+            if self._interrupted:
+                return
+
+            prep = self._preparing.pop(run, None)
+            if not self.can_run(run):
+                if prep is not None:
+                    prep.cancel()
+                    await asyncio.gather(prep, return_exceptions=True)
+                continue
+
+            if prep is None:
+                prep = asyncio.create_task(self.prepare_run(run))
+            self._running = prep
+            try:
+                runner = await prep
+            except asyncio.CancelledError:
+                # not running any simulators yet
+                return
+
+            if i + 1 < len(self.runnable):
+                nxt = self.runnable[i + 1]
+                if self.can_overlap(run, nxt):
+                    self._preparing[nxt] = asyncio.create_task(
+                        self.prepare_run(nxt)
+                    )
+
+            self._running = asyncio.create_task(runner.run())
+            try:
+                run.output = await self._running
+            finally:
+                await self.cleanup_run(run)
+            self.complete.append(run)
+
+            # keep at most one output being written at a time
+            if self._writing is not None:
+                await self._writing
+            self._writing = asyncio.ensure_future(self.write_output(run))
+
+    async def start(self):
+        stall_monitor = LoopStallMonitor()
+        stall_monitor.start()
+        try:
+            if self.pipeline:
+                await self._start_pipelined()
+            else:
+                await self._start_sequential()
+        finally:
+            preps = list(self._preparing.values())
+            self._preparing.clear()
+            for prep in preps:
+                prep.cancel()
+            await asyncio.gather(*preps, return_exceptions=True)
+            try:
+                if self._writing is not None:
+                    await self._writing
+            finally:
+                self._writing = None
+                await self.close()
+                await stall_monitor.stop()
+                if self.verbose:
+                    print(stall_monitor.summary())
+
+    def interrupt(self):
+        super().interrupt()
+        if self._running:
+            self._running.cancel()
@@ -21,35 +21,61 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import asyncio
+import concurrent.futures
+import copy
+import itertools
+import sys
 import typing as tp
 
 from simbricks.orchestration import proxy
-from simbricks.orchestration.exectools import Executor
+from simbricks.orchestration.exectools import Executor, LocalExecutor
 from simbricks.orchestration.experiments import (
     DistributedExperiment, Experiment
 )
-from simbricks.orchestration.runners import ExperimentDistributedRunner
-from simbricks.orchestration.runtime.common import Run, Runtime
+from simbricks.orchestration.runners import (
+    ExperimentDistributedRunner, ExperimentSimpleRunner
+)
+from simbricks.orchestration.runtime.common import (
+    Run, Runtime, SequentialRuntime
+)
+from simbricks.orchestration.simulators import (
+    HostSim, I40eMultiNIC, MemDevSim, NetMemSim, NICSim, Simulator, SwitchNet
+)
+from simbricks.orchestration.utils.loopmon import LoopStallMonitor
+from simbricks.orchestration.utils.partition import Partitioner
 
 
-class DistributedSimpleRuntime(Runtime):
+class DistributedSimpleRuntime(SequentialRuntime):
 
-    def __init__(self, executors, verbose=False):
-        super().__init__()
-        self.runnable: tp.List[Run] = []
-        self.complete: tp.List[Run] = []
-        self.verbose = verbose
+    def __init__(
+        self,
+        executors,
+        verbose=False,
+        pipeline=False,
+        output_pool: tp.Optional[concurrent.futures.Executor] = None
+    ):
+        super().__init__(verbose, pipeline, output_pool)
         self.executors = executors
 
-        self._running: asyncio.Task
-
     def add_run(self, run: Run):
         if not isinstance(run.experiment, DistributedExperiment):
             raise RuntimeError('Only distributed experiments supported')
 
-        self.runnable.append(run)
+        super().add_run(run)
 
-    async def do_run(self, run: Run):
+    def can_run(self, run: Run) -> bool:
+        exp = tp.cast(DistributedExperiment, run.experiment)
+        for sim in exp.all_simulators():
+            missing = run.missing_files(
+                self.executors[exp.host_mapping[sim]], [sim]
+            )
+            if missing:
+                missing_str = ', '.join(sorted(missing))
+                print(f'skipping run {run.name()}: missing {missing_str}')
+                return False
+        return True
+
+    async def prepare_run(self, run: Run) -> ExperimentDistributedRunner:
         runner = ExperimentDistributedRunner(
             self.executors,
             # we ensure the correct type in add_run()
@@ -57,54 +83,473 @@ class DistributedSimpleRuntime(Runtime):
             run.env,
             self.verbose
         )
+        await run.prep_dirs_all(self.executors)
+        await runner.prepare()
+        return runner
+
+    async def cleanup_run(self, run: Run):
+        await run.remove_shm(self.executors)
+
+    async def close(self):
+        for executor in self.executors:
+            await executor.close(self.verbose)
+
+
+class DistributedParallelRuntime(Runtime):
+    """
+    Execute runs in parallel on a pool of executors.
+
+    Each logical host of a `DistributedExperiment`, or the single host of a
+    plain `Experiment`, is placed on a different executor with enough free
+    cores and memory, so several runs that each only use part of the pool run
+    at the same time. Runs restoring a checkpoint use the same executors as the
+    run that created it, and otherwise executors that already ran hosts with the
+    same disk images are preferred.
+
+    With `fetch` set, the working directories of runs on remote executors are
+    copied back in batches of `fetch_batch` runs per executor, each in a single
+    transfer.
+    """
+
+    PROXY_BASE_PORT = 12345
+    """Lowest port assigned to listening proxies."""
+
+    def __init__(
+        self,
+        executors: tp.List[Executor],
+        cores: tp.Optional[int] = None,
+        mem: tp.Optional[int] = None,
+        verbose=False,
+        *,
+        output_pool: tp.Optional[concurrent.futures.Executor] = None,
+        fetch=False,
+        fetch_batch=16
+    ):
+        super().__init__()
+        self.executors = executors
+        self.cores = [ex.cores or cores for ex in executors]
+        """Cores available on each executor, None for no limit."""
+        self.mem = [ex.mem or mem for ex in executors]
+        """Memory in MB available on each executor, None for no limit."""
+        self.verbose = verbose
+        self.output_pool = output_pool
+        """Pool to serialize run output in, see `ExpOutput.dump_async()`."""
+        self.fetch = fetch
+        self.fetch_batch = fetch_batch
+        self.runnable: tp.List[Run] = []
+        self.complete: tp.Set[Run] = set()
+        self.failed: tp.Set[Run] = set()
+        """Runs that failed or were skipped because their prerequisite did."""
+
+        self._cores_used = [0] * len(executors)
+        self._mem_used = [0] * len(executors)
+        self._ports_used: tp.List[tp.Set[int]] = [set() for _ in executors]
+        self._demands: tp.Dict[Run, tp.List[tp.Tuple[int, int]]] = {}
+        """Cores and memory required on each logical host of a run."""
+        self._eligible: tp.Dict[Run, tp.List[tp.Set[int]]] = {}
+        """Executors with all files required on each logical host of a run."""
+        self._mappings: tp.Dict[Run, tp.List[int]] = {}
+        """Executor of each logical host of started runs."""
+        self._images: tp.List[tp.Set[str]] = [set() for _ in executors]
+        """Disk images used by runs on each executor, likely still cached."""
+        self._cp_execs: tp.Dict[str, tp.Set[int]] = {}
+        """Executors holding (part of) the checkpoint in each cpdir."""
+        self._fetch_paths: tp.List[tp.List[str]] = [[] for _ in executors]
+        """Working directories of completed runs not yet fetched."""
+        self._fetch_tasks: tp.Set[asyncio.Task] = set()
+        self._pending_jobs: tp.Set[asyncio.Task] = set()
+        self._job_runs: tp.Dict[asyncio.Task, Run] = {}
+        self._starter_task: asyncio.Task
+
+    @staticmethod
+    def host_sims(exp: Experiment) -> tp.List[tp.List[Simulator]]:
+        """Simulators on each logical host of `exp`."""
+        if not isinstance(exp, DistributedExperiment):
+            return [list(exp.all_simulators())]
+        sims = [[] for _ in range(exp.num_hosts)]
+        for sim in exp.all_simulators():
+            sims[exp.host_mapping[sim]].append(sim)
+        return sims
+
+    def demands(self, run: Run) -> tp.List[tp.Tuple[int, int]]:
+        """Cores and memory required on each logical host of `run`."""
+        demands = []
+        for sims in self.host_sims(run.experiment):
+            demands.append((
+                sum(sim.resreq_cores() for sim in sims),
+                sum(sim.resreq_mem() for sim in sims)
+            ))
+        return demands
+
+    def images(self, run: Run) -> tp.List[tp.Set[str]]:
+        """Disk images used on each logical host of `run`."""
+        images = []
+        for sims in self.host_sims(run.experiment):
+            images.append({
+                sim.node_config.disk_image
+                for sim in sims
+                if isinstance(sim, HostSim)
+            })
+        return images
+
+    def fits(self, i: int, demand: tp.Tuple[int, int]) -> bool:
+        cores, mem = demand
+        if self.cores[i] is not None and (
+            self._cores_used[i] + cores > self.cores[i]
+        ):
+            return False
+        if self.mem[i] is not None and self._mem_used[i] + mem > self.mem[i]:
+            return False
+        return True
+
+    def add_run(self, run: Run):
+        exp = run.experiment
+        if isinstance(exp, DistributedExperiment):
+            if exp.num_hosts > len(self.executors):
+                raise RuntimeError('Not enough executors for run')
+            if not exp.all_sims_assigned():
+                raise RuntimeError('Not all simulators assigned to a host')
+            # runs of the same experiment may run concurrently on different
+            # executors, with different proxy addresses and ports
+            run.experiment = copy.deepcopy(exp)
+
+        demands = self.demands(run)
+        eligible = []
+        for sims in self.host_sims(run.experiment):
+            eligible.append({
+                i for (i, ex) in enumerate(self.executors)
+                if not run.missing_files(ex, sims)
+            })
+        for (demand, execs) in zip(demands, eligible):
+            if not execs:
+                raise RuntimeError(
+                    f'No host has all files required by run {run.name()}'
+                )
+            if not any(
+                self.cores[i] is None or demand[0] <= self.cores[i]
+                for i in execs
+            ):
+                raise RuntimeError('Not enough cores available for run')
+            if not any(
+                self.mem[i] is None or demand[1] <= self.mem[i] for i in execs
+            ):
+                raise RuntimeError('Not enough memory available for run')
+        self._demands[run] = demands
+        self._eligible[run] = eligible
+        self.runnable.append(run)
+
+        # checkpoints left by earlier invocations are only known to exist here
+        if (
+            run.env.restore_cp and run.prereq is None and
+            run.env.cpdir not in self._cp_execs and
+            run.env.has_checkpoint(exp.checkpoint_fingerprint())
+        ):
+            self._cp_execs[run.env.cpdir] = {
+                i for (i, ex) in enumerate(self.executors)
+                if isinstance(ex, LocalExecutor)
+            }
+
+    def place(self, run: Run) -> tp.Optional[tp.List[int]]:
+        """Pick an executor for each logical host of `run` that currently has
+        enough resources available, or return None."""
+        demands = self._demands[run]
+        prereq_mapping = self._mappings.get(run.prereq)
+        if prereq_mapping is not None and len(prereq_mapping) == len(demands):
+            # the checkpoint is only available on the same executors
+            mapping = prereq_mapping
+            if all(self.fits(i, d) for (i, d) in zip(mapping, demands)):
+                return mapping
+            return None
+
+        images = self.images(run)
+        eligible = self._eligible[run]
+        cp_execs = set()
+        if run.env.restore_cp:
+            cp_execs = self._cp_execs.get(run.env.cpdir, set())
+
+        mapping = [-1] * len(demands)
+        used = set()
+        for h in sorted(range(len(demands)), key=lambda h: -demands[h][0]):
+            candidates = [
+                i for i in eligible[h]
+                if i not in used and self.fits(i, demands[h])
+            ]
+            if not candidates:
+                return None
+            prefs = {
+                i: self.preference(i, images[h], cp_execs) for i in candidates
+            }
+            i = max(candidates, key=prefs.__getitem__)
+            mapping[h] = i
+            used.add(i)
+        return mapping
+
+    def preference(self, i: int, images: tp.Set[str], cp_execs: tp.Set[int]):
+        """Sort key for placing a logical host using the disk `images` on
+        executor `i`: prefer executors with the checkpoint, then those that
+        already used the images, then those with the most free cores."""
+        return (
+            i in cp_execs,
+            len(images & self._images[i]),
+            (self.cores[i] or 0) - self._cores_used[i]
+        )
+
+    def reserve(self, run: Run, mapping: tp.List[int]):
+        for i, (cores, mem) in zip(mapping, self._demands[run]):
+            self._cores_used[i] += cores
+            self._mem_used[i] += mem
+        for i, images in zip(mapping, self.images(run)):
+            self._images[i] |= images
+        if run.env.create_cp:
+            self._cp_execs[run.env.cpdir] = set(mapping)
+
+        exp = run.experiment
+        if isinstance(exp, DistributedExperiment):
+            for lp in exp.proxies_listen:
+                i = mapping[exp.host_mapping[lp]]
+                port = self.PROXY_BASE_PORT
+                while port in self._ports_used[i]:
+                    port += 1
+                lp.port = port
+                self._ports_used[i].add(port)
+        self._mappings[run] = mapping
+
+    def release(self, run: Run):
+        mapping = self._mappings[run]
+        for i, (cores, mem) in zip(mapping, self._demands[run]):
+            self._cores_used[i] -= cores
+            self._mem_used[i] -= mem
 
+        exp = run.experiment
+        if isinstance(exp, DistributedExperiment):
+            for lp in exp.proxies_listen:
+                self._ports_used[mapping[exp.host_mapping[lp]]].discard(lp.port)
+
+    async def do_run(self, run: Run, mapping: tp.List[int]):
+        """Actually executes `run` on the executors in `mapping`."""
+        execs = [self.executors[i] for i in mapping]
         try:
-            for executor in self.executors:
-                await run.prep_dirs(executor)
+            if isinstance(run.experiment, DistributedExperiment):
+                runner = ExperimentDistributedRunner(
+                    execs, run.experiment, run.env, self.verbose
+                )
+            else:
+                runner = ExperimentSimpleRunner(
+                    execs[0], run.experiment, run.env, self.verbose
+                )
+            await run.prep_dirs_all(execs)
             await runner.prepare()
         except asyncio.CancelledError:
             # it is safe to just exit here because we are not running any
             # simulators yet
             return
 
-        run.output = await runner.run()  # already handles CancelledError
-        self.complete.append(run)
+        print('starting run ', run.name())
+        try:
+            run.output = await runner.run()  # already handles CancelledError
+        finally:
+            await run.remove_shm(execs)
 
         # if the log is huge, this step takes some time
         if self.verbose:
             print(
                 f'Writing collected output of run {run.name()} to JSON file ...'
             )
-        run.output.dump(run.outpath)
+        await run.output.dump_async(run.outpath, self.output_pool)
+        print('finished run ', run.name())
+        if self.fetch:
+            self.queue_fetch(run)
+        return run
+
+    async def fetch_results(self, i: int):
+        """Copy the working directories of completed runs back from executor
+        `i`."""
+        paths = self._fetch_paths[i]
+        self._fetch_paths[i] = []
+        if not paths:
+            return
+        executor = self.executors[i]
+        if self.verbose:
+            print(f'fetching results of {len(paths)} runs from {executor.ip}')
+        try:
+            await executor.fetch_files(paths, self.verbose)
+        except RuntimeError as e:
+            print(f'Warning: {e}', file=sys.stderr)
+
+    def queue_fetch(self, run: Run):
+        """Schedule fetching the results of a completed run."""
+        for i in set(self._mappings[run]):
+            if isinstance(self.executors[i], LocalExecutor):
+                continue
+            self._fetch_paths[i].append(run.env.workdir)
+            if len(self._fetch_paths[i]) >= self.fetch_batch:
+                task = asyncio.create_task(self.fetch_results(i))
+                self._fetch_tasks.add(task)
+                task.add_done_callback(self._fetch_tasks.discard)
+
+    async def wait_completion(self):
+        """Wait for any run to terminate and release its resources."""
+        assert self._pending_jobs
+
+        done, self._pending_jobs = await asyncio.wait(
+            self._pending_jobs, return_when=asyncio.FIRST_COMPLETED
+        )
+
+        for job in done:
+            # do_run() returns None if cancelled, so keep track of runs here
+            run = self._job_runs.pop(job)
+            if self.job_failed(job, run):
+                self.failed.add(run)
+            else:
+                self.complete.add(run)
+            self.release(run)
+
+    async def do_start(self):
+        """Asynchronous execution loop for starting runs, starts any run whose
+        prerequisite completed and for which executors are available."""
+        waiting = list(self.runnable)
+        while waiting:
+            self.skip_failed(waiting, self.failed)
+            for run in list(waiting):
+                if run.prereq is not None and run.prereq not in self.complete:
+                    continue
+                mapping = self.place(run)
+                if mapping is None:
+                    continue
+                self.reserve(run, mapping)
+                waiting.remove(run)
+
+                job = asyncio.create_task(self.do_run(run, mapping))
+                self._pending_jobs.add(job)
+                self._job_runs[job] = run
+
+            if waiting:
+                if not self._pending_jobs:
+                    raise RuntimeError(
+                        f'run {waiting[0].name()} can never be started'
+                    )
+                await self.wait_completion()
+
+        # wait for all runs to finish
+        while self._pending_jobs:
+            await self.wait_completion()
 
     async def start(self):
-        for run in self.runnable:
+        """Execute all defined runs."""
+        stall_monitor = LoopStallMonitor()
+        stall_monitor.start()
+        self._starter_task = asyncio.create_task(self.do_start())
+        try:
+            await self._starter_task
+        except asyncio.CancelledError:
+            for job in self._pending_jobs:
+                job.cancel()
+            # wait for all runs to finish
+            if self._pending_jobs:
+                await asyncio.wait(self._pending_jobs)
+        finally:
             if self._interrupted:
-                return
-
-            self._running = asyncio.create_task(self.do_run(run))
-            await self._running
+                for task in self._fetch_tasks:
+                    task.cancel()
+            else:
+                fetches = map(self.fetch_results, range(len(self.executors)))
+                await asyncio.gather(*fetches)
+            await asyncio.gather(*self._fetch_tasks, return_exceptions=True)
+            await asyncio.gather(
+                *[executor.close(self.verbose) for executor in self.executors]
+            )
+            await stall_monitor.stop()
+            if self.verbose:
+                print(stall_monitor.summary())
 
     def interrupt(self):
         super().interrupt()
-        if self._running:
-            self._running.cancel()
+        self._starter_task.cancel()
+
+
+def _links(
+    e: Experiment
+) -> tp.Tuple[tp.Dict[tp.Tuple[Simulator, Simulator], float],
+              tp.List[tp.Tuple[Simulator, Simulator]]]:
+    """
+    Links between the experiment's simulators that can be carried through a
+    proxy, weighted by expected traffic, and the remaining channels, which
+    require simulators to run on the same host. Other dependencies only order
+    the start of simulators.
+
+    Ethernet links between a NIC and its network have weight 1. A link between
+    two networks is weighted with the number of NICs on its smaller side.
+    """
+    links = {}
+    local = []
+    for sim in e.all_simulators():
+        if isinstance(sim, HostSim):
+            for dev in sim.pcidevs + sim.memdevs + sim.net_directs:
+                local.append((sim, dev))
+        elif isinstance(sim, I40eMultiNIC):
+            for sn in sim.subnics:
+                local.append((sim, sn))
+
+    for sim in itertools.chain(e.all_simulators(), [s for (_, s) in local]):
+        if not isinstance(sim, NICSim) or sim.network is None:
+            continue
+        if isinstance(sim, (MemDevSim, NetMemSim)):
+            local.append((sim, sim.network))
+        else:
+            links[(sim, sim.network)] = 1
+    for net in e.networks:
+        for net_l in net.net_connect:
+            links[(net, net_l)] = max(1, min(len(net.nics), len(net_l.nics)))
+    return (links, local)
+
+
+def _split_network(
+    de: DistributedExperiment, net: SwitchNet, part: int, nics: tp.List[NICSim]
+) -> SwitchNet:
+    """Move `nics` to a new switch on `part` connected to `net`."""
+    sub = SwitchNet()
+    base = net.name or f'net{de.networks.index(net)}'
+    sub.name = f'{base}_{part}'
+    sub.sync = net.sync
+    sub.sync_mode = net.sync_mode
+    sub.sync_period = net.sync_period
+    sub.eth_latency = net.eth_latency
+    for nic in nics:
+        net.nics.remove(nic)
+        nic.set_network(sub)
+    sub.connect_network(net)
+    de.add_network(sub)
+    de.assign_sim_host(sub, part)
+    return sub
 
 
 def auto_dist(
-    e: Experiment, execs: tp.List[Executor], proxy_type: str = 'sockets'
+    e: Experiment,
+    execs: tp.List[Executor],
+    proxy_type: str = 'sockets',
+    split_nets: bool = False,
+    imbalance: float = 0.1
 ):
     """
     Converts an Experiment into a DistributedExperiment.
 
-    Assigns network to executor zero, and then round-robin assignment of hosts
-    to executors, while also assigning all nics for a host to the same executor.
+    Simulators are partitioned across all executors, balancing their
+    `resreq_cores()` relative to the executors' cores (if known) while
+    minimizing the traffic through proxies. Only Ethernet links between NICs
+    and networks and between networks are proxied, all other connected
+    simulators end up on the same executor. With `split_nets`, NICs of a switch
+    on another executor are attached to a new switch there, which connects to
+    the original one through a single proxied link.
+
+    The expected cut, i.e. the number of proxied links and their weight, is
+    printed and stored in the experiment's metadata. `e` itself is left
+    unchanged, the distributed experiment is built from a copy.
     """
 
     if len(execs) < 2:
         raise RuntimeError('auto_dist needs at least two hosts')
-    elif len(execs) > 2:
-        print('Warning: currently auto_dist only uses the first two hosts')
+    # connecting proxies and splitting networks modifies the simulators
+    e = copy.deepcopy(e)
 
     if proxy_type == 'sockets':
         proxy_listener_c = proxy.SocketsNetProxyListener
@@ -115,43 +560,120 @@ def auto_dist(
     else:
         raise RuntimeError('Unknown proxy type specified')
 
+    # simulators that have to run on the same host form one unit
+    links, local = _links(e)
+    units: tp.Dict[Simulator, Simulator] = {}
+
+    def find(sim):
+        while units.setdefault(sim, sim) is not sim:
+            sim = units[sim]
+        return sim
+
+    for a, b in local:
+        units[find(b)] = find(a)
+    weights = {}
+    mems = {}
+    for sim in e.all_simulators():
+        u = find(sim)
+        weights[u] = weights.get(u, 0) + sim.resreq_cores()
+        mems[u] = mems.get(u, 0) + sim.resreq_mem()
+    unit_links = {}
+    for (a, b), w in links.items():
+        key = (find(a), find(b))
+        unit_links[key] = unit_links.get(key, 0) + w
+
+    capacities = [ex.cores or 1 for ex in execs]
+    if None in [ex.cores for ex in execs]:
+        capacities = [1] * len(execs)
+    partitioner = Partitioner(capacities, [ex.mem for ex in execs], imbalance)
+    assignment = partitioner.partition(weights, mems, unit_links)
+
     # Create the distributed experiment
-    de = DistributedExperiment(e.name, 2)
+    de = DistributedExperiment(e.name, len(execs))
     de.timeout = e.timeout
     de.checkpoint = e.checkpoint
     de.no_simbricks = e.no_simbricks
     de.metadata = e.metadata.copy()
-
-    # create listening proxy on host 0
-    lp = proxy_listener_c()
-    lp.name = 'listener'
-    de.add_proxy(lp)
-    de.assign_sim_host(lp, 0)
-
-    # assign networks to first host
+    for h in e.hosts:
+        de.add_host(h)
+    for dev in e.pcidevs:
+        de.add_pcidev(dev)
+    for dev in e.memdevs:
+        de.add_memdev(dev)
+    for dev in e.netmems:
+        de.add_netmem(dev)
     for net in e.networks:
         de.add_network(net)
-        de.assign_sim_host(net, 0)
+    for sim in e.all_simulators():
+        de.assign_sim_host(sim, assignment[find(sim)])
+    for h in e.hosts:
+        # devices not added to the experiment itself, e.g. ports of multi-port
+        # NICs, run with their host
+        for dev in h.pcidevs:
+            de.assign_sim_host(dev, assignment[find(h)])
 
-    # create connecting proxy on host 1
-    cp = proxy_connecter_c(lp)
-    cp.name = 'connecter'
-    de.add_proxy(cp)
-    de.assign_sim_host(cp, 1)
+    if split_nets:
+        for net in list(e.networks):
+            if not isinstance(net, SwitchNet):
+                continue
+            remote: tp.Dict[int, tp.List[NICSim]] = {}
+            for nic in net.nics:
+                part = de.host_mapping[nic]
+                if part != de.host_mapping[net]:
+                    remote.setdefault(part, []).append(nic)
+            for part, nics in remote.items():
+                if len(nics) > 1:
+                    _split_network(de, net, part, nics)
+        links, _ = _links(de)
 
-    # round-robin assignment for hosts
-    k = 0
-    for h in e.hosts:
-        de.add_host(h)
-        de.assign_sim_host(h, k)
-        for nic in h.nics:
-            de.assign_sim_host(nic, k)
+    # one pair of proxies for each pair of hosts with links between them
+    proxies: tp.Dict[tp.Tuple[int, int],
+                     tp.Tuple[proxy.NetProxyListener,
+                              proxy.NetProxyConnecter]] = {}
+    listeners = [0] * len(execs)
+
+    def get_proxy(a: int, b: int):
+        key = (min(a, b), max(a, b))
+        if key not in proxies:
+            lp = proxy_listener_c()
+            lp.name = f'listener-{key[0]}-{key[1]}'
+            lp.port += listeners[key[0]]
+            listeners[key[0]] += 1
+            de.add_proxy(lp)
+            de.assign_sim_host(lp, key[0])
 
-            if k != 0:
-                cp.add_nic(nic)
-        k = (k + 1) % 2
+            cp = proxy_connecter_c(lp)
+            cp.name = f'connecter-{key[0]}-{key[1]}'
+            de.add_proxy(cp)
+            de.assign_sim_host(cp, key[1])
+            proxies[key] = (lp, cp)
+        return proxies[key]
 
-    for nic in e.nics:
-        de.add_nic(nic)
+    cut = 0
+    cut_weight = 0
+    for (a, b), w in links.items():
+        part_a = de.host_mapping[a]
+        part_b = de.host_mapping[b]
+        if part_a == part_b:
+            continue
+        cut += 1
+        cut_weight += w
+        lp, cp = get_proxy(part_a, part_b)
+        if isinstance(a, NICSim):
+            # added on the side of the NIC
+            (lp if de.host_mapping[lp] == part_a else cp).add_nic(a)
+        else:
+            # added on the side of the listening network
+            (lp if de.host_mapping[lp] == part_b else cp).add_n2n(a, b)
 
+    loads = [0] * len(execs)
+    for sim in de.all_simulators():
+        loads[de.host_mapping[sim]] += sim.resreq_cores()
+    print(
+        f'auto_dist: {e.name}: {cut} proxied links (weight {cut_weight}), '
+        f'cores per host {loads}'
+    )
+    de.metadata['auto_dist'] = {
+        'proxied_links': cut, 'cut_weight': cut_weight, 'cores': loads
+    }
     return de
@@ -21,100 +21,186 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import asyncio
+import concurrent.futures
 import typing as tp
 
 from simbricks.orchestration import exectools
+from simbricks.orchestration.experiment.experiment_output import ExpOutput
+from simbricks.orchestration.experiment.resource_profiles import (
+    ResourceProfiles
+)
 from simbricks.orchestration.runners import ExperimentSimpleRunner
-from simbricks.orchestration.runtime.common import Run, Runtime
+from simbricks.orchestration.runtime.common import (
+    Run, Runtime, SequentialRuntime
+)
+from simbricks.orchestration.simulators import Simulator
+from simbricks.orchestration.utils import shm
+from simbricks.orchestration.utils.loopmon import LoopStallMonitor
+from simbricks.orchestration.utils.placement import CorePlacer, Placement
 
 
-class LocalSimpleRuntime(Runtime):
+class LocalSimpleRuntime(SequentialRuntime):
     """Execute runs locally in sequence."""
 
     def __init__(
         self,
         verbose=False,
-        executor: exectools.Executor = exectools.LocalExecutor()
+        executor: exectools.Executor = exectools.LocalExecutor(),
+        profiles: tp.Optional[ResourceProfiles] = None,
+        pipeline=False,
+        output_pool: tp.Optional[concurrent.futures.Executor] = None
     ):
-        super().__init__()
-        self.runnable: tp.List[Run] = []
-        self.complete: tp.List[Run] = []
-        self.verbose = verbose
+        super().__init__(verbose, pipeline, output_pool)
         self.executor = executor
-        self._running: tp.Optional[asyncio.Task] = None
-
-    def add_run(self, run: Run):
-        self.runnable.append(run)
+        self.profiles = profiles
+        """If set, measured resource usage of runs is recorded here."""
 
-    async def do_run(self, run: Run):
-        """Actually executes `run`."""
-        try:
-            runner = ExperimentSimpleRunner(
-                self.executor, run.experiment, run.env, self.verbose
-            )
-            await run.prep_dirs(self.executor)
-            await runner.prepare()
-        except asyncio.CancelledError:
-            # it is safe to just exit here because we are not running any
-            # simulators yet
-            return
+    async def prepare_run(self, run: Run) -> ExperimentSimpleRunner:
+        runner = ExperimentSimpleRunner(
+            self.executor, run.experiment, run.env, self.verbose
+        )
+        await run.prep_dirs(self.executor)
+        await runner.prepare()
+        return runner
 
-        run.output = await runner.run()  # already handles CancelledError
-        self.complete.append(run)
+    async def cleanup_run(self, run: Run):
+        await run.remove_shm([self.executor])
 
-        # if the log is huge, this step takes some time
-        if self.verbose:
+    def can_run(self, run: Run) -> bool:
+        if not run.shm_fits():
             print(
-                f'Writing collected output of run {run.name()} to JSON file ...'
+                f'skipping run {run.name()}: not enough space for '
+                f'shared memory in {run.env.shm_mount}'
             )
-        run.output.dump(run.outpath)
+            return False
+        missing = run.missing_files(self.executor)
+        if missing:
+            missing_str = ', '.join(sorted(missing))
+            print(f'skipping run {run.name()}: missing {missing_str}')
+            return False
+        return True
 
-    async def start(self):
-        """Execute the runs defined in `self.runnable`."""
-        for run in self.runnable:
-            if self._interrupted:
-                return
+    async def write_output(self, run: Run):
+        await super().write_output(run)
+        if self.profiles is not None:
+            self.profiles.add_output(run.output)
 
-            self._running = asyncio.create_task(self.do_run(run))
-            await self._running
-
-    def interrupt(self):
-        super().interrupt()
-        if self._running:
-            self._running.cancel()
+    async def close(self):
+        if self.profiles is not None:
+            self.profiles.save()
+        await self.executor.close(self.verbose)
 
 
 class LocalParallelRuntime(Runtime):
     """Execute runs locally in parallel on multiple cores."""
 
+    POLICIES = ['fifo', 'backfill', 'largest', 'shortest']
+    """
+    Supported scheduling policies.
+
+    `fifo` starts runs strictly in the order they were added. The other
+    policies start any run whose prerequisite has completed and whose
+    resources are available, trying runs in the order they were added
+    (`backfill`), by decreasing resource requirements (`largest`), or by
+    increasing expected duration (`shortest`). So that a stream of small runs
+    cannot starve a large one, a run overtaken `max_overtake` times while
+    waiting for resources reserves them: no other runs are started until it
+    fits.
+    """
+
     def __init__(
         self,
         cores: int,
         mem: tp.Optional[int] = None,
         verbose=False,
-        executor: exectools.Executor = exectools.LocalExecutor()
+        executor: exectools.Executor = exectools.LocalExecutor(),
+        *,
+        policy: str = 'fifo',
+        profiles: tp.Optional[ResourceProfiles] = None,
+        pin: bool = False,
+        output_pool: tp.Optional[concurrent.futures.Executor] = None
     ):
         super().__init__()
+        if policy not in self.POLICIES:
+            raise RuntimeError(f'Unknown scheduling policy {policy}')
+        if pin and not isinstance(executor, exectools.LocalExecutor):
+            raise RuntimeError('Pinning is only supported for local runs')
         self.runs_noprereq: tp.List[Run] = []
         """Runs with no prerequesite runs."""
         self.runs_prereq: tp.List[Run] = []
         """Runs with prerequesite runs."""
         self.complete: tp.Set[Run] = set()
+        self.failed: tp.Set[Run] = set()
+        """Runs that failed or were skipped because their prerequisite did."""
         self.cores = cores
         self.mem = mem
         self.verbose = verbose
         self.executor = executor
+        self.policy = policy
+        self.max_overtake = 8
+        """How often a run waiting for resources may be overtaken by runs
+        considered after it before it reserves them."""
+        self.profiles = profiles
+        """If set, resource requirements of runs are estimated from these
+        profiles, which are also updated with the measured usage."""
+        self.placer: tp.Optional[CorePlacer] = CorePlacer() if pin else None
+        """If set, each simulator is pinned to dedicated cores, with connected
+        simulators on the same NUMA node where possible."""
+        self.output_pool = output_pool
+        """Pool to serialize run output in, see `ExpOutput.dump_async()`."""
 
         self._pending_jobs: tp.Set[asyncio.Task] = set()
+        self._job_runs: tp.Dict[asyncio.Task, Run] = {}
+        self._resreqs: tp.Dict[Run, tp.Tuple[int, int]] = {}
+        """Cores and memory required by each run, determined when added."""
+        self._placements: tp.Dict[Run, Placement] = {}
+        self._overtaken: tp.Dict[Run, int] = {}
+        """How often each run waiting for resources has been overtaken."""
+        self._shm_free: tp.Dict[str, int] = {}
+        """Space on memory-backed file systems not reserved for shared memory
+        of admitted runs."""
         self._starter_task: asyncio.Task
 
+    def sim_cores(self, sim: Simulator, run: Run) -> int:
+        if self.profiles is not None:
+            return self.profiles.resreq_cores(sim, run.env)
+        return sim.resreq_cores()
+
+    def place(self, run: Run) -> tp.Optional[Placement]:
+        """Assign cores to the simulators in `run`."""
+        demands = {}
+        graph = {}
+        for sim in run.experiment.all_simulators():
+            demands[sim] = self.sim_cores(sim, run)
+            graph[sim] = set(sim.dependencies() + sim.extra_deps)
+        return self.placer.place(demands, graph)
+
+    def resreq(self, run: Run) -> tp.Tuple[int, int]:
+        """Cores and memory required for `run`."""
+        if self.profiles is not None:
+            return self.profiles.exp_resreq(run.experiment, run.env)
+        return (run.experiment.resreq_cores(), run.experiment.resreq_mem())
+
     def add_run(self, run: Run):
-        if run.experiment.resreq_cores() > self.cores:
+        cores, mem = self.resreq(run)
+        self._resreqs[run] = (cores, mem)
+        if cores > self.cores:
             raise RuntimeError('Not enough cores available for run')
 
-        if self.mem is not None and run.experiment.resreq_mem() > self.mem:
+        if self.placer is not None and cores > self.placer.num_cpus():
+            raise RuntimeError('Not enough cores to pin simulators of run')
+
+        if self.mem is not None and mem > self.mem:
             raise RuntimeError('Not enough memory available for run')
 
+        mount, shm_size = run.shm_demand()
+        if mount is not None:
+            free = self._shm_free.setdefault(mount, shm.free_bytes(mount))
+            if shm_size > free:
+                raise RuntimeError(
+                    f'Not enough space for shared memory in {mount}'
+                )
+
         if run.prereq is None:
             self.runs_noprereq.append(run)
         else:
@@ -126,6 +212,7 @@ class LocalParallelRuntime(Runtime):
             runner = ExperimentSimpleRunner(
                 self.executor, run.experiment, run.env, self.verbose
             )
+            runner.placement = self._placements.get(run)
             await run.prep_dirs(executor=self.executor)
             await runner.prepare()
         except asyncio.CancelledError:
@@ -134,14 +221,20 @@ class LocalParallelRuntime(Runtime):
             return
 
         print('starting run ', run.name())
-        run.output = await runner.run()  # already handles CancelledError
+        try:
+            run.output = await runner.run()  # already handles CancelledError
+        finally:
+            # only then is the space credited again in wait_completion()
+            await run.remove_shm([self.executor])
 
         # if the log is huge, this step takes some time
         if self.verbose:
             print(
                 f'Writing collected output of run {run.name()} to JSON file ...'
             )
-        run.output.dump(run.outpath)
+        await run.output.dump_async(run.outpath, self.output_pool)
+        if self.profiles is not None:
+            self.profiles.add_output(run.output)
         print('finished run ', run.name())
         return run
 
@@ -153,27 +246,43 @@ class LocalParallelRuntime(Runtime):
             self._pending_jobs, return_when=asyncio.FIRST_COMPLETED
         )
 
-        for run in done:
-            run = await run
-            self.complete.add(run)
-            self.cores_used -= run.experiment.resreq_cores()
-            self.mem_used -= run.experiment.resreq_mem()
+        for job in done:
+            # do_run() returns None if cancelled, so keep track of runs here
+            run = self._job_runs.pop(job)
+            if self.job_failed(job, run):
+                self.failed.add(run)
+            else:
+                self.complete.add(run)
+            cores, mem = self._resreqs[run]
+            self.cores_used -= cores
+            self.mem_used -= mem
+            if run in self._placements:
+                self.placer.release(self._placements.pop(run))
+            mount, shm_size = run.shm_demand()
+            if mount is not None:
+                self._shm_free[mount] += shm_size
 
     def enough_resources(self, run: Run):
-        """Check if enough cores and mem are available for the run."""
-        exp = run.experiment  # pylint: disable=redefined-outer-name
+        """Check if enough cores, mem and shared memory space are available for
+        the run."""
+        cores, mem = self._resreqs[run]
 
         if self.cores is not None:
-            enough_cores = (self.cores - self.cores_used) >= exp.resreq_cores()
+            enough_cores = (self.cores - self.cores_used) >= cores
         else:
             enough_cores = True
+        if self.placer is not None:
+            enough_cores = enough_cores and self.placer.num_free() >= cores
+
+        mount, shm_size = run.shm_demand()
+        enough_shm = mount is None or self._shm_free[mount] >= shm_size
 
         if self.mem is not None:
-            enough_mem = (self.mem - self.mem_used) >= exp.resreq_mem()
+            enough_mem = (self.mem - self.mem_used) >= mem
         else:
             enough_mem = True
 
-        return enough_cores and enough_mem
+        return enough_cores and enough_mem and enough_shm
 
     def prereq_ready(self, run: Run):
         """Check if the prerequesite run for `run` has completed."""
@@ -182,36 +291,101 @@ class LocalParallelRuntime(Runtime):
 
         return run.prereq in self.complete
 
+    def expected_duration(self, run: Run) -> tp.Optional[float]:
+        """Expected duration of `run` in seconds, based on the output of a
+        previous execution or else the experiment's timeout."""
+        try:
+            return ExpOutput.read_duration(run.outpath)
+        except (OSError, ValueError, KeyError, TypeError):
+            return run.experiment.timeout
+
+    def sort_runs(self, runs: tp.List[Run]) -> tp.List[Run]:
+        """Order in which runs are considered for starting."""
+        if self.policy == 'largest':
+            return sorted(
+                runs,
+                key=lambda r: (-self._resreqs[r][0], -self._resreqs[r][1])
+            )
+        if self.policy == 'shortest':
+            durations = {run: self.expected_duration(run) for run in runs}
+            # runs without an estimate go last
+            return sorted(
+                runs, key=lambda r: (durations[r] is None, durations[r] or 0)
+            )
+        return runs
+
+    def next_run(self, runs: tp.List[Run]) -> tp.Optional[Run]:
+        """Pick the next run to start from `runs` or return None if none of
+        them can be started before another run completes."""
+        if self.policy == 'fifo':
+            run = runs[0]
+            if not self.enough_resources(run):
+                print('waiting for resources')
+                return None
+            if not self.prereq_ready(run):
+                print('waiting for prereq')
+                return None
+            return run
+
+        blocked = []
+        for run in runs:
+            if not self.prereq_ready(run):
+                continue
+            if self.enough_resources(run):
+                for b in blocked:
+                    self._overtaken[b] = self._overtaken.get(b, 0) + 1
+                return run
+            if self._overtaken.get(run, 0) >= self.max_overtake:
+                # wait for the resources of running runs to be released
+                return None
+            blocked.append(run)
+        return None
+
     async def do_start(self):
         """Asynchronously execute the runs defined in `self.runs_noprereq +
-        self.runs_prereq."""
-        #self.completions = asyncio.Queue()
+        self.runs_prereq`, in the order determined by `self.policy`."""
         self.cores_used = 0
         self.mem_used = 0
 
-        runs = self.runs_noprereq + self.runs_prereq
-        for run in runs:
-            # if necessary, wait for enough memory or cores
-            while not self.enough_resources(run):
-                print('waiting for resources')
+        runs = self.sort_runs(self.runs_noprereq + self.runs_prereq)
+        while runs:
+            self.skip_failed(runs, self.failed)
+            if not runs:
+                break
+            run = self.next_run(runs)
+            if run is None:
+                # if necessary, wait for enough memory or cores, or for
+                # prerequesite runs to complete
+                if not self._pending_jobs:
+                    raise RuntimeError(
+                        f'Run {runs[0].name()} can never be started'
+                    )
                 await self.wait_completion()
-
-            # if necessary, wait for prerequesite runs to complete
-            while not self.prereq_ready(run):
-                print('waiting for prereq')
-                await self.wait_completion()
-
-            self.cores_used += run.experiment.resreq_cores()
-            self.mem_used += run.experiment.resreq_mem()
+                continue
+
+            runs.remove(run)
+            cores, mem = self._resreqs[run]
+            self.cores_used += cores
+            self.mem_used += mem
+            if self.placer is not None:
+                # cannot fail, enough_resources() checked for free cores
+                self._placements[run] = self.place(run)
+            mount, shm_size = run.shm_demand()
+            if mount is not None:
+                self._shm_free[mount] -= shm_size
 
             job = asyncio.create_task(self.do_run(run))
             self._pending_jobs.add(job)
+            self._job_runs[job] = run
 
         # wait for all runs to finish
-        await asyncio.wait(self._pending_jobs)
+        while self._pending_jobs:
+            await self.wait_completion()
 
     async def start(self):
         """Execute all defined runs."""
+        stall_monitor = LoopStallMonitor()
+        stall_monitor.start()
         self._starter_task = asyncio.create_task(self.do_start())
         try:
             await self._starter_task
@@ -219,7 +393,15 @@ class LocalParallelRuntime(Runtime):
             for job in self._pending_jobs:
                 job.cancel()
             # wait for all runs to finish
-            await asyncio.wait(self._pending_jobs)
+            if self._pending_jobs:
+                await asyncio.wait(self._pending_jobs)
+        finally:
+            if self.profiles is not None:
+                self.profiles.save()
+            await self.executor.close(self.verbose)
+            await stall_monitor.stop()
+            if self.verbose:
+                print(stall_monitor.summary())
 
     def interrupt(self):
         super().interrupt()
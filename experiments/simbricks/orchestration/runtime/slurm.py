@@ -21,101 +21,505 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import asyncio
+import copy
+import json
 import os
 import pathlib
 import pickle
 import re
+import shlex
+import shutil
 import typing as tp
 
 from simbricks.orchestration.runtime.common import Run, Runtime
 
+_SLURM_QUEUED = ['PENDING', 'REQUEUED', 'REQUEUE_HOLD', 'REQUEUE_FED']
+"""Slurm job states before a job started."""
+_SLURM_ACTIVE = [
+    'RUNNING',
+    'CONFIGURING',
+    'COMPLETING',
+    'RESIZING',
+    'SIGNALING',
+    'STAGE_OUT',
+    'STOPPED',
+    'SUSPENDED'
+]
+"""Slurm job states of started but not yet terminated jobs."""
+
+
+class SlurmJob(object):
+    """A batch job executing one or more runs."""
+
+    def __init__(self, name: str, runs: tp.List[Run], kind: str = 'single'):
+        self.name = name
+        self.runs = runs
+        self.kind = kind
+        """`single` for one run, `array` for a job array with one task per
+        run, indexed by run index, or `pack` for runs sharing an allocation."""
+        self.job_id: tp.Optional[int] = None
+        self.script: tp.Optional[str] = None
+
+    def dep_ref(self, run: Run) -> str:
+        """Reference to the (array task) executing `run` for dependencies."""
+        if self.kind == 'array':
+            return f'{self.job_id}_{run.index}'
+        return str(self.job_id)
+
+    def prereqs(self) -> tp.List[Run]:
+        prereqs = []
+        for run in self.runs:
+            if run.prereq is not None and run.prereq not in prereqs:
+                prereqs.append(run.prereq)
+        return prereqs
+
 
 class SlurmRuntime(Runtime):
 
-    def __init__(self, slurmdir, args, verbose=False, cleanup=True):
+    def __init__(
+        self,
+        slurmdir,
+        args,
+        *,
+        verbose=False,
+        cleanup=True,
+        sbatch: str = 'sbatch',
+        scancel: str = 'scancel',
+        array: bool = False,
+        pack: int = 1,
+        cores: int = 32,
+        max_submits: int = 16,
+        monitor: bool = False,
+        sacct: str = 'sacct',
+        poll_interval: float = 30,
+        retries: int = 0
+    ):
         super().__init__()
         self.runnable: tp.List[Run] = []
         self.slurmdir = slurmdir
         self.args = args
         self.verbose = verbose
         self.cleanup = cleanup
+        self.sbatch = sbatch
+        """Command to submit jobs with, may include arguments."""
+        self.scancel = scancel
+        """Command to cancel jobs with, may include arguments."""
+        self.array = array
+        """Submit runs of the same experiment as one job array."""
+        self.pack = pack
+        """Maximum number of runs to execute in parallel in one allocation."""
+        self.cores = cores
+        """Cores allocated for a job running a single run, and maximum number
+        of cores of a job with packed runs."""
+        self.max_submits = max_submits
+        """Maximum number of concurrent submissions."""
+        self.monitor = monitor
+        """Track submitted jobs until all runs finished instead of returning
+        right after submission."""
+        self.sacct = sacct
+        """Command to query job states with, may include arguments."""
+        self.poll_interval = poll_interval
+        self.retries = retries
+        """How often a failed run is resubmitted when monitoring."""
 
+        self.jobs: tp.List[SlurmJob] = []
+        self.states: tp.Dict[Run, str] = {}
+        """State of each run: `submitted`, `pending`, `running`, `done` or
+        `failed`."""
+        self.attempts: tp.Dict[Run, int] = {}
+        """Number of times each run was submitted."""
+        self.failures: tp.Dict[Run, int] = {}
+        self._run_jobs: tp.Dict[Run, SlurmJob] = {}
+        """Most recent job of each run."""
+        self._submitted: tp.Dict[SlurmJob, asyncio.Future] = {}
+        self._submitting: tp.List[asyncio.Task] = []
+        self._sem: tp.Optional[asyncio.Semaphore] = None
         self._start_task: asyncio.Task
 
     def add_run(self, run: Run):
         self.runnable.append(run)
 
-    def prep_run(self, run: Run):
-        exp = run.experiment
-        e_idx = exp.name + f'-{run.index}' + '.exp'
-        exp_path = os.path.join(self.slurmdir, e_idx)
+    def make_jobs(self) -> tp.List[SlurmJob]:
+        """Group runs into jobs, only runs with the same prerequisite end up in
+        the same job."""
+        jobs = []
+        rest = []
+        if self.array:
+            groups: tp.Dict[tp.Tuple[str, tp.Optional[Run]], tp.List[Run]] = {}
+            for run in self.runnable:
+                key = (run.experiment.name, run.prereq)
+                groups.setdefault(key, []).append(run)
+            for (name, _), runs in groups.items():
+                if len(runs) > 1:
+                    jobs.append(SlurmJob(name, runs, 'array'))
+                else:
+                    rest += runs
+        else:
+            rest = list(self.runnable)
 
-        log_idx = exp.name + f'-{run.index}' + '.log'
-        exp_log = os.path.join(self.slurmdir, log_idx)
+        packs: tp.Dict[tp.Optional[Run], tp.List[Run]] = {}
+        for run in rest:
+            pack = packs.get(run.prereq)
+            if pack and not self._fits_pack(pack, run):
+                jobs.append(self._pack_job(pack))
+                pack = None
+            if not pack:
+                pack = []
+                packs[run.prereq] = pack
+            pack.append(run)
+        for pack in packs.values():
+            jobs.append(self._pack_job(pack))
 
-        sc_idx = exp.name + f'-{run.index}' + '.sh'
-        exp_script = os.path.join(self.slurmdir, sc_idx)
-        print(exp_path)
-        print(exp_log)
-        print(exp_script)
+        # submit jobs in the order their first run was added
+        order = {run: i for (i, run) in enumerate(self.runnable)}
+        jobs.sort(key=lambda j: order[j.runs[0]])
+        return jobs
 
-        # write out pickled run
-        with open(exp_path, 'wb', encoding='utf-8') as f:
-            run.prereq = None  # we don't want to pull in the prereq too
+    def _fits_pack(self, pack: tp.List[Run], run: Run) -> bool:
+        cores = sum(r.experiment.resreq_cores() for r in pack)
+        return (
+            len(pack) < self.pack and
+            cores + run.experiment.resreq_cores() <= self.cores
+        )
+
+    def _pack_job(self, runs: tp.List[Run]) -> SlurmJob:
+        if len(runs) == 1:
+            return SlurmJob(f'{runs[0].experiment.name}-{runs[0].index}', runs)
+        name = f'pack-{runs[0].experiment.name}-{runs[0].index}'
+        return SlurmJob(name, runs, 'pack')
+
+    def exp_path(self, run: Run) -> str:
+        return os.path.join(
+            self.slurmdir, f'{run.experiment.name}-{run.index}.exp'
+        )
+
+    def write_run(self, run: Run):
+        """Write out pickled run."""
+        # we don't want to pull in the prereq too
+        run = copy.copy(run)
+        run.prereq = None
+        with open(self.exp_path(run), 'wb') as f:
             pickle.dump(run, f)
 
+    def remove_output(self, run: Run):
+        """Remove output left over from an earlier attempt, so it is not
+        mistaken for the output of the job about to be submitted."""
+        for path in [run.outpath, run.outpath + '.times']:
+            if os.path.exists(path):
+                os.remove(path)
+        shutil.rmtree(run.outpath + '.streams', ignore_errors=True)
+
+    def prep_job(self, job: SlurmJob) -> str:
+        for run in job.runs:
+            self.remove_output(run)
+            self.write_run(run)
+
+        exp = job.runs[0].experiment
+        exp_script = os.path.join(self.slurmdir, job.name + '.sh')
+        if job.kind == 'array':
+            exp_log = os.path.join(self.slurmdir, f'{job.name}-%a.log')
+        else:
+            exp_log = os.path.join(self.slurmdir, job.name + '.log')
+        if self.verbose:
+            print(exp_script)
+            print(exp_log)
+
+        if job.kind == 'pack':
+            cores = sum(r.experiment.resreq_cores() for r in job.runs)
+            mem = sum(r.experiment.resreq_mem() for r in job.runs)
+            timeouts = [r.experiment.timeout for r in job.runs]
+            timeout = None if None in timeouts else max(timeouts)
+        else:
+            cores = self.cores
+            mem = exp.resreq_mem()
+            timeout = exp.timeout
+
+        extra = ''
+        if self.verbose:
+            extra = '--verbose'
+
         # create slurm batch script
         with open(exp_script, 'w', encoding='utf-8') as f:
             f.write('#!/bin/sh\n')
             f.write(f'#SBATCH -o {exp_log} -e {exp_log}\n')
-            #f.write('#SBATCH -c %d\n' % (exp.resreq_cores(),))
-            f.write(f'#SBATCH --mem={exp.resreq_mem()}M\n')
-            f.write(f'#SBATCH --job-name="{run.name()}"\n')
+            f.write(f'#SBATCH --mem={mem}M\n')
+            f.write(f'#SBATCH --job-name="{job.name}"\n')
             f.write('#SBATCH --exclude=spyder[01-05],spyder16\n')
-            f.write('#SBATCH -c 32\n')
+            f.write(f'#SBATCH -c {cores}\n')
             f.write('#SBATCH --nodes=1\n')
-            if exp.timeout is not None:
-                h = int(exp.timeout / 3600)
-                m = int((exp.timeout % 3600) / 60)
-                s = int(exp.timeout % 60)
+            if job.kind == 'array':
+                indices = ','.join(str(r.index) for r in job.runs)
+                f.write(f'#SBATCH --array={indices}\n')
+            if timeout is not None:
+                h = int(timeout / 3600)
+                m = int((timeout % 3600) / 60)
+                s = int(timeout % 60)
                 f.write(f'#SBATCH --time={h:02d}:{m:02d}:{s:02d}\n')
 
-            extra = ''
-            if self.verbose:
-                extra = '--verbose'
-
-            f.write(f'python3 run.py {extra} --pickled {exp_path}\n')
+            if job.kind == 'array':
+                f.write('case "$SLURM_ARRAY_TASK_ID" in\n')
+                for run in job.runs:
+                    f.write(
+                        f'{run.index}) exp_path={self.exp_path(run)}; '
+                        f'workdir={run.env.workdir} ;;\n'
+                    )
+                f.write('*) exit 1 ;;\n')
+                f.write('esac\n')
+                f.write(f'python3 run.py {extra} --pickled $exp_path\n')
+            elif job.kind == 'pack':
+                paths = ' '.join(self.exp_path(r) for r in job.runs)
+                f.write(
+                    f'python3 run.py {extra} --parallel --cores {cores} '
+                    f'--mem {mem} --pickled {paths}\n'
+                )
+            else:
+                f.write(
+                    f'python3 run.py {extra} --pickled '
+                    f'{self.exp_path(job.runs[0])}\n'
+                )
             f.write('status=$?\n')
             if self.cleanup:
-                f.write(f'rm -rf {run.env.workdir}\n')
+                if job.kind == 'array':
+                    f.write('rm -rf $workdir\n')
+                else:
+                    for run in job.runs:
+                        f.write(f'rm -rf {run.env.workdir}\n')
             f.write('exit $status\n')
 
+        job.script = exp_script
         return exp_script
 
-    async def _do_start(self):
-        pathlib.Path(self.slurmdir).mkdir(parents=True, exist_ok=True)
+    async def submit_job(self, job: SlurmJob, deps: tp.List[str]):
+        """Submit `job` with `sbatch`, once dependencies have job ids."""
+        cmd = shlex.split(self.sbatch)
+        if deps:
+            cmd.append('--dependency=afterok:' + ':'.join(deps))
+        cmd.append(job.script)
 
-        jid_re = re.compile(r'Submitted batch job ([0-9]+)')
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.PIPE
+        )
+        output, _ = await proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError('running sbatch failed')
 
-        for run in self.runnable:
-            if run.prereq is None:
-                dep_cmd = ''
-            else:
-                dep_cmd = '--dependency=afterok:' + str(run.prereq.job_id)
+        m = re.search(r'Submitted batch job ([0-9]+)', output.decode())
+        if m is None:
+            raise RuntimeError('cannot retrieve id of submitted job')
+        job.job_id = int(m.group(1))
+        for run in job.runs:
+            run.job_id = job.job_id
+
+    async def _submit(self, job: SlurmJob):
+        deps = []
+        for prereq in job.prereqs():
+            prereq_job = self._run_jobs[prereq]
+            await self._submitted[prereq_job]
+            if self.states[prereq] != 'done':
+                deps.append(prereq_job.dep_ref(prereq))
+
+        async with self._sem:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.prep_job, job)
 
-            script = self.prep_run(run)
+            # don't lose track of jobs if interrupted while submitting
+            task = asyncio.create_task(self.submit_job(job, deps))
+            self._submitting.append(task)
+            await asyncio.shield(task)
+
+    async def submit_jobs(self, jobs: tp.List[SlurmJob]):
+        """Submit `jobs`, each as soon as the jobs it depends on have been
+        submitted."""
+        for job in jobs:
+            self.jobs.append(job)
+            for run in job.runs:
+                self._run_jobs[run] = job
+                self.states[run] = 'submitted'
+                self.attempts[run] = self.attempts.get(run, 0) + 1
+
+        futs = []
+        for job in jobs:
+            fut = asyncio.ensure_future(self._submit(job))
+            self._submitted[job] = fut
+            futs.append(fut)
+        try:
+            await asyncio.gather(*futs)
+        finally:
+            for fut in futs:
+                fut.cancel()
 
-            stream = os.popen(f'sbatch {dep_cmd} {script}')
-            output = stream.read()
-            result = stream.close()
+    async def cancel_jobs(self, job_ids: tp.List[int]):
+        if not job_ids:
+            return
+        scancel_process = await asyncio.create_subprocess_exec(
+            *shlex.split(self.scancel), *[str(j) for j in job_ids]
+        )
+        await scancel_process.wait()
 
-            if result is not None:
-                raise RuntimeError('running sbatch failed')
+    async def query_states(
+        self, job_ids: tp.List[int]
+    ) -> tp.Optional[tp.Dict[str, str]]:
+        """Slurm states of jobs and array tasks by id, queried in one batch.
+        Returns None if the query failed."""
+        proc = await asyncio.create_subprocess_exec(
+            *shlex.split(self.sacct),
+            '-n',
+            '-P',
+            '-X',
+            '-o',
+            'JobID,State',
+            '-j',
+            ','.join(str(j) for j in job_ids),
+            stdout=asyncio.subprocess.PIPE
+        )
+        output, _ = await proc.communicate()
+        if proc.returncode != 0:
+            print('querying job states failed, retrying')
+            return None
 
-            m = jid_re.search(output)
-            if m is None:
-                raise RuntimeError('cannot retrieve id of submitted job')
-            run.job_id = int(m.group(1))
+        states = {}
+        for line in output.decode().splitlines():
+            fields = line.split('|')
+            if len(fields) >= 2:
+                # e.g. `CANCELLED by 1000`
+                states[fields[0]] = fields[1].split(' ')[0]
+        return states
+
+    def slurm_state(self, run: Run, states: tp.Dict[str, str]):
+        """Slurm state of the job (array task) executing `run` in `states`,
+        None if it is not listed."""
+        job = self._run_jobs[run]
+        ref = job.dep_ref(run)
+        if ref in states:
+            return states[ref]
+        if job.kind == 'array':
+            # array tasks that have not started yet share one entry
+            for jid, state in states.items():
+                if jid.startswith(f'{job.job_id}_['):
+                    return state
+        return states.get(str(job.job_id))
+
+    def output_success(self, run: Run) -> bool:
+        """Whether the job of `run` wrote an output file marked successful."""
+        try:
+            with open(run.outpath, 'r', encoding='utf-8') as f:
+                return json.load(f).get('success', False)
+        except (OSError, ValueError):
+            return False
+
+    def summary_table(self) -> str:
+        """Number of runs in each state per experiment."""
+        cols = ['pending', 'running', 'done', 'failed']
+        rows: tp.Dict[str, tp.Dict[str, int]] = {}
+        for run, state in self.states.items():
+            if state == 'submitted':
+                state = 'pending'
+            row = rows.setdefault(run.experiment.name, dict.fromkeys(cols, 0))
+            row[state] += 1
+        total = {c: sum(r[c] for r in rows.values()) for c in cols}
+
+        width = max([len(name) for name in rows] + [len('experiment')])
+        lines = ['experiment'.ljust(width) + ''.join(f'{c:>9}' for c in cols)]
+        for name, row in list(rows.items()) + [('total', total)]:
+            lines.append(
+                name.ljust(width) + ''.join(f'{row[c]:>9}' for c in cols)
+            )
+        return '\n'.join(lines)
+
+    def successful(self) -> bool:
+        return all(state == 'done' for state in self.states.values())
+
+    async def monitor_jobs(self):
+        """Track jobs until all runs are done or failed, resubmitting failed
+        runs and runs depending on them up to `retries` times."""
+        loop = asyncio.get_running_loop()
+        active_states = ['submitted', 'pending', 'running']
+        last_table = None
+        while True:
+            active = [r for (r, s) in self.states.items() if s in active_states]
+            if not active:
+                break
+            await asyncio.sleep(self.poll_interval)
+
+            job_ids = {self._run_jobs[run].job_id for run in active}
+            states = await self.query_states(sorted(job_ids))
+            if states is None:
+                continue
+
+            finished = []
+            for run in active:
+                state = self.slurm_state(run, states)
+                if state is None:
+                    # not yet known to accounting
+                    continue
+                if state in _SLURM_QUEUED:
+                    self.states[run] = 'pending'
+                elif state in _SLURM_ACTIVE:
+                    self.states[run] = 'running'
+                else:
+                    finished.append(run)
+
+            results = await loop.run_in_executor(
+                None, lambda: [self.output_success(r) for r in finished]
+            )
+            failed = []
+            for run, success in zip(finished, results):
+                if success:
+                    self.states[run] = 'done'
+                else:
+                    self.states[run] = 'failed'
+                    self.failures[run] = self.failures.get(run, 0) + 1
+                    failed.append(run)
+            resubmit = [r for r in failed if self.failures[r] <= self.retries]
+
+            # dependent jobs can never start now, so cancel them and resubmit
+            # them together with their prerequisite if it is retried
+            cancel = set()
+            for run, state in self.states.items():
+                if run.prereq in failed and state in active_states:
+                    cancel.add(self._run_jobs[run].job_id)
+                    if run.prereq in resubmit:
+                        resubmit.append(run)
+                    else:
+                        self.states[run] = 'failed'
+            await self.cancel_jobs(sorted(cancel))
+
+            jobs = []
+            for run in resubmit:
+                name = (
+                    f'{run.experiment.name}-{run.index}-'
+                    f'attempt{self.attempts[run] + 1}'
+                )
+                jobs.append(SlurmJob(name, [run]))
+                print(f'resubmitting run {run.name()}')
+            await self.submit_jobs(jobs)
+
+            table = self.summary_table()
+            if table != last_table:
+                print(table)
+                last_table = table
+
+        for run, state in self.states.items():
+            if state == 'failed':
+                job = self._run_jobs[run]
+                print(f'run {run.name()} failed (job {job.dep_ref(run)})')
+
+    async def _do_start(self):
+        pathlib.Path(self.slurmdir).mkdir(parents=True, exist_ok=True)
+        self._sem = asyncio.Semaphore(self.max_submits)
+
+        jobs = self.make_jobs()
+        for job in jobs:
+            for prereq in job.prereqs():
+                if prereq not in self.runnable:
+                    raise RuntimeError(
+                        f'prerequisite {prereq.name()} of {job.name} is not '
+                        'submitted'
+                    )
+        await self.submit_jobs(jobs)
+
+        if self.monitor:
+            await self.monitor_jobs()
 
     async def start(self):
         self._start_task = asyncio.create_task(self._do_start())
@@ -124,15 +528,8 @@ class SlurmRuntime(Runtime):
         except asyncio.CancelledError:
             # stop all runs that have already been scheduled
             # (existing slurm job id)
-            job_ids = []
-            for run in self.runnable:
-                if run.job_id:
-                    job_ids.append(str(run.job_id))
-
-            scancel_process = await asyncio.create_subprocess_shell(
-                f"scancel {' '.join(job_ids)}"
-            )
-            await scancel_process.wait()
+            await asyncio.gather(*self._submitting, return_exceptions=True)
+            await self.cancel_jobs([j.job_id for j in self.jobs if j.job_id])
 
     def interrupt(self):
         super().interrupt()
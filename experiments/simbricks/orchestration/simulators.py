@@ -29,6 +29,10 @@ import typing as tp
 from simbricks.orchestration.experiment.experiment_environment import ExpEnv
 from simbricks.orchestration.nodeconfig import NodeConfig
 
+SHM_QUEUE_POOL_SIZE = 2 * 8192 * 2048
+"""Size of the shared memory for the queue pair of one SimBricks connection
+with the default parameters (see `lib/simbricks/base/if.c`)."""
+
 
 class Simulator(object):
     """Base class for all simulators."""
@@ -45,20 +49,53 @@ class Simulator(object):
         """Memory required for this simulator (in MB)."""
         return 64
 
+    def shm_pools(self) -> tp.List[int]:
+        """Sizes (in bytes) of the shared memory pools this simulator creates
+        in `ExpEnv.shm_base`."""
+        return []
+
     def full_name(self):
         """Full name of the simulator."""
         return ''
 
+    # pylint: disable=unused-argument
+    def resource_key(self, env: ExpEnv) -> str:
+        """
+        Identifies the configuration of this simulator for resource profiles.
+
+        Simulators with the same key are expected to use similar amounts of
+        memory and CPU time, see `ResourceProfiles`.
+        """
+        return self.__class__.__name__
+
     # pylint: disable=unused-argument
     def prep_cmds(self, env: ExpEnv) -> tp.List[str]:
         """Commands to run to prepare simulator."""
         return []
 
+    # pylint: disable=unused-argument
+    def disk_overlays(self, env: ExpEnv) -> tp.List[tp.Tuple[str, str]]:
+        """qcow2 overlays to create before running as pairs of backing image
+        and overlay path, when not created by `prep_cmds()`."""
+        return []
+
     # pylint: disable=unused-argument
     def run_cmd(self, env: ExpEnv) -> tp.Optional[str]:
         """Command to run to execute simulator."""
         return None
 
+    def required_files(self, env: ExpEnv) -> tp.List[str]:
+        """Files from the repository that have to be present on the host running
+        this simulator, by default the executable in `run_cmd()`."""
+        # only the base implementation returns None, subclasses return commands
+        cmd = self.run_cmd(env)  # pylint: disable=assignment-from-none
+        if not cmd:
+            return []
+        exe = cmd.split(maxsplit=1)[0]
+        if not exe.startswith(env.repodir + '/'):
+            return []
+        return [exe]
+
     def dependencies(self) -> tp.List[Simulator]:
         """Other simulators this one depends on."""
         return []
@@ -73,9 +110,23 @@ class Simulator(object):
     def sockets_wait(self, env: ExpEnv):
         return []
 
+    # TCP ports peers on other machines connect to, checked for readiness
+    def listen_ports(self) -> tp.List[int]:
+        return []
+
     def start_delay(self):
         return 5
 
+    def use_start_delay(self):
+        """
+        Whether to sleep for `start_delay()` after the sockets in
+        `sockets_wait()` appeared.
+
+        By default, the runner instead continues as soon as these sockets and
+        `listen_ports()` are listening.
+        """
+        return False
+
     def wait_terminate(self):
         return False
 
@@ -103,6 +154,20 @@ class PCIDevSim(Simulator):
     def sockets_wait(self, env):
         return [env.dev_pci_path(self)]
 
+    def shm_pools(self):
+        return [SHM_QUEUE_POOL_SIZE]
+
+    def checkpoint_config(self) -> tp.Dict[str, tp.Any]:
+        """Everything about this device that affects the state of the host it
+        is attached to, see `HostSim.checkpoint_config()`."""
+        return {
+            'class': self.__class__.__name__,
+            'sync_mode': self.sync_mode,
+            'start_tick': self.start_tick,
+            'sync_period': self.sync_period,
+            'pci_latency': self.pci_latency,
+        }
+
 
 class NICSim(PCIDevSim):
     """Base class for NIC simulators."""
@@ -144,6 +209,17 @@ class NICSim(PCIDevSim):
     def is_nic(self):
         return True
 
+    def shm_pools(self):
+        # one pool for both the PCIe and the Ethernet queues
+        return [2 * SHM_QUEUE_POOL_SIZE]
+
+    def checkpoint_config(self):
+        cfg = super().checkpoint_config()
+        cfg.update({'mac': self.mac, 'eth_latency': self.eth_latency})
+        if self.network is not None:
+            cfg['network'] = self.network.checkpoint_config()
+        return cfg
+
     def sockets_cleanup(self, env):
         return super().sockets_cleanup(env) + [env.nic_eth_path(self)]
 
@@ -203,6 +279,17 @@ class NetSim(Simulator):
     def sockets_wait(self, env: ExpEnv):
         return [s for (_, s) in self.listen_sockets(env)]
 
+    def checkpoint_config(self) -> tp.Dict[str, tp.Any]:
+        """Everything about this network that affects the state of connected
+        hosts, see `HostSim.checkpoint_config()`."""
+        return {
+            'class': self.__class__.__name__,
+            'opt': self.opt,
+            'sync_mode': self.sync_mode,
+            'sync_period': self.sync_period,
+            'eth_latency': self.eth_latency,
+        }
+
 
 # FIXME: Class hierarchy is broken here as an ugly hack
 class MemDevSim(NICSim):
@@ -229,6 +316,21 @@ class MemDevSim(NICSim):
     def sockets_wait(self, env):
         return [env.dev_mem_path(self)]
 
+    def shm_pools(self):
+        return [SHM_QUEUE_POOL_SIZE]
+
+    def checkpoint_config(self):
+        return {
+            'class': self.__class__.__name__,
+            'sync_mode': self.sync_mode,
+            'start_tick': self.start_tick,
+            'sync_period': self.sync_period,
+            'mem_latency': self.mem_latency,
+            'addr': self.addr,
+            'size': self.size,
+            'as_id': self.as_id,
+        }
+
 
 class NetMemSim(NICSim):
     """Base class for netork memory simulators."""
@@ -254,6 +356,9 @@ class NetMemSim(NICSim):
     def sockets_wait(self, env):
         return [env.nic_eth_path(self)]
 
+    def shm_pools(self):
+        return [SHM_QUEUE_POOL_SIZE]
+
 
 class HostSim(Simulator):
     """Base class for host simulators."""
@@ -315,6 +420,47 @@ class HostSim(Simulator):
             deps.append(dev)
         return deps
 
+    def sockets_wait(self, env: ExpEnv):
+        return [env.net2host_eth_path(n, self) for n in self.net_directs]
+
+    def shm_pools(self):
+        return [SHM_QUEUE_POOL_SIZE for _ in self.net_directs]
+
+    def checkpoint_config(self) -> tp.Dict[str, tp.Any]:
+        """
+        Everything that affects the state of this host when it is
+        checkpointed.
+
+        This includes the complete config tar, as the guest extracts it during
+        boot, so even commands running after the checkpoint are part of the
+        checkpointed state.
+        """
+        return {
+            'class': self.__class__.__name__,
+            'node_config': self.node_config.__class__.__name__,
+            'memory': self.node_config.memory,
+            'cores': self.node_config.cores,
+            'threads': self.node_config.threads,
+            'disk_image': self.node_config.disk_image,
+            'kcmd_append': self.node_config.kcmd_append,
+            'cpu_freq': self.cpu_freq,
+            'sync_mode': self.sync_mode,
+            'sync_period': self.sync_period,
+            'pci_latency': self.pci_latency,
+            'mem_latency': self.mem_latency,
+            'pcidevs': [d.checkpoint_config() for d in self.pcidevs],
+            'memdevs': [d.checkpoint_config() for d in self.memdevs],
+            'net_directs': [n.checkpoint_config() for n in self.net_directs],
+            'cfgtar': self.node_config.tar_digest(),
+        }
+
+    def resource_key(self, env: ExpEnv) -> str:
+        app = self.node_config.app.__class__.__name__
+        return (
+            f'{super().resource_key(env)}:{self.node_config.__class__.__name__}'
+            f':{app}:{self.node_config.memory}M:{self.node_config.cores}c'
+        )
+
     def wait_terminate(self):
         return self.wait
 
@@ -336,13 +482,33 @@ class QemuHost(HostSim):
     def resreq_mem(self):
         return 8192
 
+    def resource_key(self, env):
+        return f'{super().resource_key(env)}:sync={self.sync}'
+
     def prep_cmds(self, env):
+        if env.overlay_cachedir is not None:
+            # created from a cached template, see disk_overlays()
+            return []
         return [
             f'{env.qemu_img_path} create -f qcow2 -o '
             f'backing_file="{env.hd_path(self.node_config.disk_image)}" '
             f'{env.hdcopy_path(self)}'
         ]
 
+    def disk_overlays(self, env):
+        if env.overlay_cachedir is None:
+            return []
+        return [
+            (env.hd_path(self.node_config.disk_image), env.hdcopy_path(self))
+        ]
+
+    def required_files(self, env):
+        return [
+            env.qemu_path,
+            env.qemu_img_path,
+            env.hd_path(self.node_config.disk_image)
+        ]
+
     def run_cmd(self, env):
         accel = ',accel=kvm:tcg' if not self.sync else ''
         if self.node_config.kcmd_append:
@@ -411,9 +577,30 @@ class Gem5Host(HostSim):
     def resreq_mem(self):
         return 4096
 
+    def resource_key(self, env):
+        cpu_type = self.cpu_type_cp if env.create_cp else self.cpu_type
+        return f'{super().resource_key(env)}:{self.variant}:{cpu_type}'
+
+    def checkpoint_config(self):
+        cfg = super().checkpoint_config()
+        cfg.update({
+            'cpu_type_cp': self.cpu_type_cp,
+            'variant': self.variant,
+            'sys_clock': self.sys_clock,
+            'extra_main_args': self.extra_main_args,
+            'extra_config_args': self.extra_config_args,
+        })
+        return cfg
+
     def prep_cmds(self, env):
         return [f'mkdir -p {env.gem5_cpdir(self)}']
 
+    def required_files(self, env):
+        return [
+            env.gem5_path(self.variant),
+            env.hd_raw_path(self.node_config.disk_image)
+        ]
+
     def run_cmd(self, env):
         cpu_type = self.cpu_type
         if env.create_cp:
@@ -512,6 +699,17 @@ class SimicsHost(HostSim):
     def resreq_mem(self):
         return self.node_config.memory
 
+    def checkpoint_config(self):
+        cfg = super().checkpoint_config()
+        cfg.update({
+            'cpu_class': self.cpu_class,
+            'append_cmdline': self.append_cmdline,
+        })
+        return cfg
+
+    def required_files(self, env):
+        return [env.simics_path, env.hd_raw_path(self.node_config.disk_image)]
+
     def run_cmd(self, env):
         if self.node_config.kcmd_append:
             raise RuntimeError(
@@ -657,6 +855,11 @@ class CorundumVerilatorNIC(NICSim):
         # this is a guess
         return 512
 
+    def checkpoint_config(self):
+        cfg = super().checkpoint_config()
+        cfg['clock_freq'] = self.clock_freq
+        return cfg
+
     def run_cmd(self, env):
         return self.basic_run_cmd(
             env, '/corundum/corundum_verilator', str(self.clock_freq)
@@ -762,6 +965,11 @@ class SwitchNet(NetSim):
         super().__init__()
         self.sync = True
 
+    def checkpoint_config(self):
+        cfg = super().checkpoint_config()
+        cfg['sync'] = self.sync
+        return cfg
+
     def run_cmd(self, env):
         cmd = env.repodir + '/sims/net/switch/net_switch'
         cmd += f' -S {self.sync_period} -E {self.eth_latency}'
@@ -773,17 +981,20 @@ class SwitchNet(NetSim):
             cmd += ' -p ' + env.pcap_file
         for (_, n) in self.connect_sockets(env):
             cmd += ' -s ' + n
-        for (_, n) in self.listen_sockets(env):
-            cmd += ' -h ' + n
+        for (net, n) in self.listen_sockets(env):
+            cmd += f' -h {n}:{env.n2n_shm_path(self, net)}'
         return cmd
 
+    def shm_pools(self):
+        # one shm region per listening eth socket
+        return [SHM_QUEUE_POOL_SIZE] * len(self.net_listen)
+
     def sockets_cleanup(self, env):
         # cleanup here will just have listening eth sockets, switch also creates
-        # shm regions for each with a "-shm" suffix
-        cleanup = []
-        for s in super().sockets_cleanup(env):
-            cleanup.append(s)
-            cleanup.append(s + '-shm')
+        # shm regions for each
+        cleanup = super().sockets_cleanup(env)
+        for net in self.net_listen:
+            cleanup.append(env.n2n_shm_path(self, net))
         return cleanup
 
 
@@ -795,6 +1006,11 @@ class MemSwitchNet(NetSim):
         """ AS_ID,VADDR_START,VADDR_END,MEMNODE_MAC,PHYS_START """
         self.mem_map = []
 
+    def checkpoint_config(self):
+        cfg = super().checkpoint_config()
+        cfg.update({'sync': self.sync, 'mem_map': self.mem_map})
+        return cfg
+
     def run_cmd(self, env):
         cmd = env.repodir + '/sims/mem/memswitch/memswitch'
         cmd += f' -S {self.sync_period} -E {self.eth_latency}'
@@ -806,21 +1022,24 @@ class MemSwitchNet(NetSim):
             cmd += ' -p ' + env.pcap_file
         for (_, n) in self.connect_sockets(env):
             cmd += ' -s ' + n
-        for (_, n) in self.listen_sockets(env):
-            cmd += ' -h ' + n
+        for (net, n) in self.listen_sockets(env):
+            cmd += f' -h {n}:{env.n2n_shm_path(self, net)}'
         for m in self.mem_map:
             cmd += ' -m ' + f' {m[0]},{m[1]},{m[2]},'
             cmd += (''.join(reversed(m[3].split(':'))))
             cmd += f',{m[4]}'
         return cmd
 
+    def shm_pools(self):
+        # one shm region per listening eth socket
+        return [SHM_QUEUE_POOL_SIZE] * len(self.net_listen)
+
     def sockets_cleanup(self, env):
         # cleanup here will just have listening eth sockets, switch also creates
-        # shm regions for each with a "-shm" suffix
-        cleanup = []
-        for s in super().sockets_cleanup(env):
-            cleanup.append(s)
-            cleanup.append(s + '-shm')
+        # shm regions for each
+        cleanup = super().sockets_cleanup(env)
+        for net in self.net_listen:
+            cleanup.append(env.n2n_shm_path(self, net))
         return cleanup
 
 
@@ -831,6 +1050,11 @@ class TofinoNet(NetSim):
         self.tofino_log_path = '/tmp/model.ldjson'
         self.sync = True
 
+    def checkpoint_config(self):
+        cfg = super().checkpoint_config()
+        cfg['sync'] = self.sync
+        return cfg
+
     def run_cmd(self, env):
         cmd = f'{env.repodir}/sims/net/tofino/tofino'
         cmd += (
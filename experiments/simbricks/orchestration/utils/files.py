@@ -0,0 +1,71 @@
+# Copyright 2022 Max Planck Institute for Software Systems, and
+# National University of Singapore
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""Helpers for copying files efficiently."""
+
+import fcntl
+import hashlib
+import os
+import shutil
+
+_FICLONE = 0x40049409
+
+
+def clone_file(src: str, dst: str):
+    """
+    Copy `src` to `dst`.
+
+    Shares data blocks if the file system supports reflinks and otherwise
+    copies in the kernel with `copy_file_range` where possible.
+    """
+    with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+        try:
+            fcntl.ioctl(f_dst.fileno(), _FICLONE, f_src.fileno())
+            return
+        except OSError:
+            pass
+
+        try:
+            left = os.fstat(f_src.fileno()).st_size
+            while left > 0:
+                n = os.copy_file_range(f_src.fileno(), f_dst.fileno(), left)
+                if n == 0:
+                    break
+                left -= n
+            if left == 0:
+                return
+        except (OSError, AttributeError):
+            pass
+
+        # start over with a plain copy
+        f_src.seek(0)
+        f_dst.seek(0)
+        f_dst.truncate()
+        shutil.copyfileobj(f_src, f_dst)
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 hash of the contents of `path` as a hex string."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
@@ -0,0 +1,220 @@
+# Copyright 2022 Max Planck Institute for Software Systems, and
+# National University of Singapore
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""Event-driven waiting for files (e.g. unix sockets) to appear."""
+
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import typing as tp
+
+_IN_ATTRIB = 0x00000004
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_IGNORED = 0x00008000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = os.O_CLOEXEC
+_IN_MASK = _IN_CREATE | _IN_MOVED_TO | _IN_ATTRIB
+
+_EVENT_HDR = struct.Struct('iIII')
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32
+        ]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError, TypeError):
+        return None
+
+
+class FileWatcher(object):
+    """
+    Waits for files to appear using inotify.
+
+    A single inotify instance is shared by all waiters and each directory is
+    only watched once, no matter how many paths in it are being waited for.
+    Where inotify is not available (or a directory cannot be watched), the
+    watcher falls back to polling with `os.path.exists`.
+    """
+
+    def __init__(self, poll_delay=0.05):
+        self.poll_delay = poll_delay
+        self._loop: tp.Optional[asyncio.AbstractEventLoop] = None
+        self._libc = None
+        self._fd = -1
+        self._dir_wds: tp.Dict[str, int] = {}
+        """Watch descriptor for each watched directory."""
+        self._wd_dirs: tp.Dict[int, str] = {}
+        self._waiters: tp.Dict[str, tp.List[asyncio.Future]] = {}
+        """Futures to resolve for each awaited (absolute) path."""
+
+    def _init_inotify(self):
+        if self._libc is None:
+            self._libc = _load_libc()
+        if self._libc is None:
+            return False
+
+        fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if fd < 0:
+            return False
+        self._fd = fd
+        self._loop.add_reader(fd, self._read_events)
+        return True
+
+    def _ensure_loop(self):
+        """(Re-)initialize when used from a new event loop, e.g. when the
+        executor outlives an `asyncio.run()` invocation."""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self.close()
+        self._loop = loop
+        self._init_inotify()
+
+    def _add_watch(self, directory: str) -> bool:
+        if self._fd < 0:
+            return False
+        if directory in self._dir_wds:
+            return True
+
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(directory), _IN_MASK
+        )
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err not in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                print(
+                    f'FileWatcher: inotify_add_watch({directory}) failed: '
+                    f'{os.strerror(err)}'
+                )
+            return False
+        self._dir_wds[directory] = wd
+        self._wd_dirs[wd] = directory
+        return True
+
+    def _rm_watch_if_unused(self, directory: str):
+        if directory not in self._dir_wds:
+            return
+        for p in self._waiters:
+            if os.path.dirname(p) == directory:
+                return
+        wd = self._dir_wds.pop(directory)
+        del self._wd_dirs[wd]
+        self._libc.inotify_rm_watch(self._fd, wd)
+
+    def _resolve(self, path: str):
+        for fut in self._waiters.pop(path, []):
+            if not fut.done():
+                fut.set_result(None)
+
+    def _read_events(self):
+        try:
+            buf = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        pos = 0
+        while pos + _EVENT_HDR.size <= len(buf):
+            wd, mask, _, name_len = _EVENT_HDR.unpack_from(buf, pos)
+            pos += _EVENT_HDR.size
+            name = buf[pos:pos + name_len].rstrip(b'\0')
+            pos += name_len
+
+            directory = self._wd_dirs.get(wd)
+            if directory is None:
+                continue
+            if mask & _IN_IGNORED:
+                # directory was removed, remaining waiters have to poll
+                del self._wd_dirs[wd]
+                del self._dir_wds[directory]
+                for p, futs in self._waiters.items():
+                    if os.path.dirname(p) == directory:
+                        for fut in futs:
+                            if not fut.done():
+                                fut.set_result(False)
+                continue
+            if name:
+                self._resolve(os.path.join(directory, os.fsdecode(name)))
+
+    async def _poll(self, path: str):
+        while not os.path.exists(path):
+            await asyncio.sleep(self.poll_delay)
+
+    async def _wait(self, path: str):
+        directory = os.path.dirname(path)
+        while True:
+            if not self._add_watch(directory):
+                await self._poll(path)
+                return
+
+            fut = self._loop.create_future()
+            self._waiters.setdefault(path, []).append(fut)
+            try:
+                # the file might have appeared before the watch was in place
+                if os.path.exists(path):
+                    return
+                if await fut is not False:
+                    return
+            finally:
+                futs = self._waiters.get(path)
+                if futs is not None:
+                    futs.remove(fut)
+                    if not futs:
+                        del self._waiters[path]
+                if directory in self._dir_wds:
+                    self._rm_watch_if_unused(directory)
+
+    async def wait(self, path: str, timeout: tp.Optional[float] = None):
+        """Wait for `path` to exist, raises `TimeoutError` after `timeout`
+        seconds."""
+        self._ensure_loop()
+        path = os.path.abspath(path)
+        if os.path.exists(path):
+            return
+        try:
+            await asyncio.wait_for(self._wait(path), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f'timed out waiting for {path}') from None
+
+    def close(self):
+        """Release the inotify instance. Pending waiters fall back to polling
+        on their next use."""
+        if self._fd >= 0:
+            if self._loop is not None and not self._loop.is_closed():
+                self._loop.remove_reader(self._fd)
+            os.close(self._fd)
+        self._fd = -1
+        self._dir_wds.clear()
+        self._wd_dirs.clear()
+        for futs in self._waiters.values():
+            for fut in futs:
+                if not fut.done() and not fut.get_loop().is_closed():
+                    fut.set_result(False)
+        self._waiters.clear()
+        self._loop = None
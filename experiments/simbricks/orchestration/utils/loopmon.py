@@ -0,0 +1,81 @@
+# Copyright 2022 Max Planck Institute for Software Systems, and
+# National University of Singapore
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""Measurement of how long the asyncio event loop is blocked."""
+
+import asyncio
+import typing as tp
+
+
+class LoopStallMonitor(object):
+    """
+    Measures stalls of the running event loop.
+
+    A task repeatedly sleeps for `interval` seconds; whenever it wakes up more
+    than `threshold` seconds late, the loop was blocked (e.g. by synchronous
+    I/O or serialization) and the delay is accounted as a stall.
+    """
+
+    def __init__(self, interval: float = 0.05, threshold: float = 0.01):
+        self.interval = interval
+        self.threshold = threshold
+        self.total = 0.0
+        """Sum of all stalls in seconds."""
+        self.max = 0.0
+        """Longest stall in seconds."""
+        self.count = 0
+        """Number of stalls."""
+        self._task: tp.Optional[asyncio.Task] = None
+
+    async def _run(self, before: float):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            now = loop.time()
+            late = now - before - self.interval
+            if late > self.threshold:
+                self.total += late
+                self.max = max(self.max, late)
+                self.count += 1
+            before = now
+
+    def start(self):
+        # measure from now, so a stall before the task first runs counts too
+        loop = asyncio.get_running_loop()
+        self._task = loop.create_task(self._run(loop.time()))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def result(self) -> tp.Dict[str, float]:
+        return {'total': self.total, 'max': self.max, 'count': self.count}
+
+    def summary(self) -> str:
+        return (
+            f'event loop stalled {self.count} times for {self.total:.3f}s in '
+            f'total, longest stall {self.max:.3f}s'
+        )
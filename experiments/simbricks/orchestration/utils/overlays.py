@@ -0,0 +1,113 @@
+# Copyright 2022 Max Planck Institute for Software Systems, and
+# National University of Singapore
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""Creation of qcow2 overlay images by cloning cached templates."""
+
+import asyncio
+import hashlib
+import os
+import tempfile
+import typing as tp
+
+from simbricks.orchestration.utils.files import clone_file
+
+
+class OverlayCache(object):
+    """
+    Creates qcow2 overlays on top of backing images.
+
+    All fresh overlays of the same backing image are identical, so
+    `qemu-img create` only runs once per backing image to create a template
+    in `cachedir`, which is reused across runs until the backing image
+    changes. Overlays are then created by cloning the template.
+    """
+
+    def __init__(self, cachedir: str, qemu_img_path: str):
+        self.cachedir = cachedir
+        self.qemu_img_path = qemu_img_path
+        self._templates: tp.Dict[str, asyncio.Future] = {}
+        """Template creation, by template path."""
+
+    def template_path(self, backing: str) -> str:
+        backing = os.path.abspath(backing)
+        st = os.stat(backing)
+        key = f'{backing}\0{st.st_size}\0{st.st_mtime_ns}\0{self.qemu_img_path}'
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cachedir, digest + '.qcow2')
+
+    async def _create_template(self, backing: str, path: str):
+        os.makedirs(self.cachedir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.cachedir, suffix='.tmp')
+        os.close(fd)
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                self.qemu_img_path,
+                'create',
+                '-q',
+                '-f',
+                'qcow2',
+                '-o',
+                f'backing_file={os.path.abspath(backing)}',
+                tmp,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE
+            )
+            _, err = await proc.communicate()
+            if proc.returncode != 0:
+                raise RuntimeError(
+                    f'creating overlay template for {backing} failed: '
+                    f'{err.decode("utf-8", "replace").strip()}'
+                )
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+    async def template(self, backing: str) -> str:
+        """Path of the template overlay for `backing`, created if
+        necessary."""
+        path = self.template_path(backing)
+        if os.path.exists(path):
+            return path
+        fut = self._templates.get(path)
+        if fut is None:
+            fut = asyncio.ensure_future(self._create_template(backing, path))
+            self._templates[path] = fut
+        try:
+            await asyncio.shield(fut)
+        except Exception:
+            # allow retrying on the next call
+            if self._templates.get(path) is fut:
+                del self._templates[path]
+            raise
+        return path
+
+    async def create(self, overlays: tp.List[tp.Tuple[str, str]]):
+        """Create overlays given as pairs of backing image and overlay
+        path."""
+        loop = asyncio.get_running_loop()
+
+        async def create_one(backing, path):
+            template = await self.template(backing)
+            await loop.run_in_executor(None, clone_file, template, path)
+
+        await asyncio.gather(*[create_one(b, p) for (b, p) in overlays])
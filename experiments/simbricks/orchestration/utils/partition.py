@@ -0,0 +1,173 @@
+# Copyright 2022 Max Planck Institute for Software Systems, and
+# National University of Singapore
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""Balanced partitioning of weighted graphs, e.g. simulators onto hosts."""
+
+import typing as tp
+
+T = tp.TypeVar('T')
+
+
+def cut_size(
+    assignment: tp.Dict[T, int], links: tp.Dict[tp.Tuple[T, T], float]
+) -> float:
+    """Summed weight of links between nodes in different parts."""
+    return sum(
+        w for ((a, b), w) in links.items() if assignment[a] != assignment[b]
+    )
+
+
+class Partitioner(object):
+    """
+    Assigns weighted nodes to parts with given capacities, balancing the load
+    relative to the capacities while keeping the weight of links between parts
+    low.
+
+    An initial assignment is grown part by part from the heaviest unassigned
+    node, preferring nodes strongly linked to the part. It is then refined by
+    moving single nodes to other parts as long as that reduces the cut or the
+    overload of a part.
+    """
+
+    def __init__(
+        self,
+        capacities: tp.List[float],
+        mem_limits: tp.Optional[tp.List[tp.Optional[float]]] = None,
+        imbalance: float = 0.1,
+        max_passes: int = 20
+    ):
+        self.capacities = capacities
+        """Relative capacity of each part for node weights, e.g. cores."""
+        self.mem_limits = mem_limits or [None] * len(capacities)
+        """Hard limit for the summed memory of nodes in each part, if known."""
+        self.imbalance = imbalance
+        """Tolerated load above the fair share of a part."""
+        self.max_passes = max_passes
+
+    def partition(
+        self,
+        weights: tp.Dict[T, float],
+        mems: tp.Dict[T, float],
+        links: tp.Dict[tp.Tuple[T, T], float]
+    ) -> tp.Dict[T, int]:
+        """Assign each node in `weights` to a part."""
+        nparts = len(self.capacities)
+        total = sum(weights.values())
+        cap_sum = sum(self.capacities)
+        if cap_sum > 0:
+            targets = [total * c / cap_sum for c in self.capacities]
+        else:
+            targets = [0.0] * nparts
+        bounds = [t * (1 + self.imbalance) for t in targets]
+
+        adj: tp.Dict[T, tp.Dict[T, float]] = {n: {} for n in weights}
+        for (a, b), w in links.items():
+            if a != b:
+                adj[a][b] = adj[a].get(b, 0) + w
+                adj[b][a] = adj[b].get(a, 0) + w
+
+        assignment: tp.Dict[T, int] = {}
+        loads = [0.0] * nparts
+        mem_used = [0.0] * nparts
+
+        def mem_fits(n: T, p: int) -> bool:
+            limit = self.mem_limits[p]
+            return limit is None or mem_used[p] + mems[n] <= limit
+
+        def assign(n: T, p: int):
+            if n in assignment:
+                q = assignment[n]
+                loads[q] -= weights[n]
+                mem_used[q] -= mems[n]
+            assignment[n] = p
+            loads[p] += weights[n]
+            mem_used[p] += mems[n]
+
+        # summed weight of links from each node to the part being grown
+        conn: tp.Dict[T, float] = {}
+
+        def attraction(n: T) -> tp.Tuple[float, float]:
+            return (conn.get(n, 0), weights[n])
+
+        def fill(p: int) -> float:
+            """Load of part `p` relative to its bound."""
+            if bounds[p] > 0:
+                return loads[p] / bounds[p]
+            return float('inf') if loads[p] > 0 else 0.0
+
+        # grow parts, largest capacity first
+        order = sorted(range(nparts), key=lambda p: -self.capacities[p])
+        for p in order[:-1]:
+            conn.clear()
+            while True:
+                fits = [
+                    n for n in weights if n not in assignment and
+                    (loads[p] + weights[n] <= targets[p] or loads[p] == 0) and
+                    mem_fits(n, p)
+                ]
+                if not fits:
+                    break
+                n = max(fits, key=attraction)
+                assign(n, p)
+                for m, w in adj[n].items():
+                    conn[m] = conn.get(m, 0) + w
+        for n in weights:
+            if n not in assignment:
+                ps = [p for p in order if mem_fits(n, p)] or order
+                assign(n, min(ps, key=fill))
+
+        # refine by moving single nodes
+        for _ in range(self.max_passes):
+            moved = False
+            for n in weights:
+                p = assignment[n]
+                to_part = [0.0] * nparts
+                for m, w in adj[n].items():
+                    to_part[assignment[m]] += w
+                overloaded = loads[p] > bounds[p]
+                best = None
+                best_gain = 0.0
+                for q in range(nparts):
+                    if q == p or not mem_fits(n, q):
+                        continue
+                    gain = to_part[q] - to_part[p]
+                    if loads[q] + weights[n] > bounds[q]:
+                        continue
+                    if overloaded:
+                        # any move reducing the overload is worth it, prefer
+                        # the one adding the least to the cut
+                        gain += total
+                    if gain > best_gain:
+                        best = q
+                        best_gain = gain
+                if best is not None:
+                    assign(n, best)
+                    moved = True
+            if not moved:
+                break
+
+        for p in range(nparts):
+            limit = self.mem_limits[p]
+            if limit is not None and mem_used[p] > limit:
+                raise RuntimeError(
+                    f'Not enough memory to place simulators on part {p}'
+                )
+        return assignment
@@ -0,0 +1,170 @@
+# Copyright 2022 Max Planck Institute for Software Systems, and
+# National University of Singapore
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""Assignment of dedicated cores on NUMA nodes to simulators."""
+
+import glob
+import os
+import re
+import typing as tp
+
+
+def parse_cpulist(s: str) -> tp.List[int]:
+    """Parse a kernel cpu list such as `0-3,8,10-11`."""
+    cpus = []
+    for part in s.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus += range(int(first), int(last) + 1)
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def numa_topology() -> tp.Dict[int, tp.List[int]]:
+    """Usable cpus of this process for each NUMA node."""
+    usable = os.sched_getaffinity(0)
+    nodes = {}
+    for path in glob.glob('/sys/devices/system/node/node*/cpulist'):
+        node = int(re.search(r'node(\d+)/cpulist$', path).group(1))
+        with open(path, 'r', encoding='utf-8') as f:
+            cpus = [c for c in parse_cpulist(f.read()) if c in usable]
+        if cpus:
+            nodes[node] = cpus
+    if not nodes:
+        # no NUMA information, treat as a single node
+        nodes[0] = sorted(usable)
+    return nodes
+
+
+class Placement(object):
+    """Cores and NUMA node assigned to each simulator of a run."""
+
+    def __init__(self):
+        self.cpus: tp.Dict[tp.Any, tp.List[int]] = {}
+        self.nodes: tp.Dict[tp.Any, int] = {}
+
+    def all_cpus(self) -> tp.List[int]:
+        return [c for cpus in self.cpus.values() for c in cpus]
+
+
+class CorePlacer(object):
+    """
+    Hands out dedicated cores to the simulators of runs.
+
+    The simulators of a run are placed on a single NUMA node if it has enough
+    free cores. Otherwise they are spread over nodes in the order of a
+    breadth-first traversal of the simulator graph, so that simulators
+    connected to each other mostly end up on the same node.
+    """
+
+    def __init__(
+        self, topology: tp.Optional[tp.Dict[int, tp.List[int]]] = None
+    ):
+        if topology is None:
+            topology = numa_topology()
+        self.free: tp.Dict[int, tp.List[int]] = {
+            n: list(cpus) for (n, cpus) in topology.items()
+        }
+        """Free cpus on each node."""
+        self.node_of = {c: n for (n, cpus) in topology.items() for c in cpus}
+
+    def num_cpus(self) -> int:
+        return len(self.node_of)
+
+    def num_free(self) -> int:
+        return sum(len(cpus) for cpus in self.free.values())
+
+    @staticmethod
+    def _bfs_order(
+        graph: tp.Dict[tp.Any, tp.Set[tp.Any]], sims: tp.List[tp.Any]
+    ) -> tp.List[tp.Any]:
+        adj: tp.Dict[tp.Any, tp.List[tp.Any]] = {s: [] for s in sims}
+        for s, deps in graph.items():
+            for d in deps:
+                if s in adj and d in adj:
+                    adj[s].append(d)
+                    adj[d].append(s)
+        order = []
+        seen = set()
+        for start in sims:
+            if start in seen:
+                continue
+            seen.add(start)
+            queue = [start]
+            while queue:
+                s = queue.pop(0)
+                order.append(s)
+                for n in adj[s]:
+                    if n not in seen:
+                        seen.add(n)
+                        queue.append(n)
+        return order
+
+    def place(
+        self,
+        demands: tp.Dict[tp.Any, int],
+        graph: tp.Dict[tp.Any, tp.Set[tp.Any]]
+    ) -> tp.Optional[Placement]:
+        """
+        Assign `demands[sim]` cores to each simulator, where `graph` maps
+        simulators to the ones they are connected to.
+
+        Returns None if there are not enough free cores.
+        """
+        total = sum(demands.values())
+        if total > self.num_free():
+            return None
+
+        # best fit on a single node
+        fitting = [n for (n, cpus) in self.free.items() if len(cpus) >= total]
+        if fitting:
+            node = min(fitting, key=lambda n: len(self.free[n]))
+            node_order = [node]
+        else:
+            node_order = sorted(
+                self.free, key=lambda n: len(self.free[n]), reverse=True
+            )
+
+        placement = Placement()
+        order = self._bfs_order(graph, list(demands.keys()))
+        ni = 0
+        for sim in order:
+            need = demands[sim]
+            cpus = []
+            while len(cpus) < need:
+                node = node_order[ni]
+                if not self.free[node]:
+                    ni += 1
+                    continue
+                cpus.append(self.free[node].pop(0))
+                if sim not in placement.nodes:
+                    placement.nodes[sim] = node
+            placement.cpus[sim] = cpus
+        return placement
+
+    def release(self, placement: Placement):
+        for c in placement.all_cpus():
+            self.free[self.node_of[c]].append(c)
+        for cpus in self.free.values():
+            cpus.sort()
@@ -0,0 +1,141 @@
+# Copyright 2022 Max Planck Institute for Software Systems, and
+# National University of Singapore
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""Sampling of resource usage of local process trees through /proc."""
+
+import asyncio
+import os
+import time
+import typing as tp
+
+_CLK_TCK = os.sysconf('SC_CLK_TCK')
+
+
+def _children(pid: int) -> tp.List[int]:
+    children = []
+    try:
+        for tid in os.listdir(f'/proc/{pid}/task'):
+            with open(
+                f'/proc/{pid}/task/{tid}/children', 'r', encoding='utf-8'
+            ) as f:
+                children += [int(c) for c in f.read().split()]
+    except OSError:
+        pass
+    return children
+
+
+def proc_tree(pid: int) -> tp.List[int]:
+    """`pid` and all its descendants."""
+    pids = [pid]
+    i = 0
+    while i < len(pids):
+        pids += _children(pids[i])
+        i += 1
+    return pids
+
+
+def proc_usage(pid: int) -> tp.Optional[tp.Tuple[int, float]]:
+    """Current resident set size in KB and consumed CPU time in seconds of a
+    single process, or None if it does not exist (anymore)."""
+    try:
+        with open(f'/proc/{pid}/stat', 'r', encoding='utf-8') as f:
+            stat = f.read()
+        rss = 0
+        with open(f'/proc/{pid}/status', 'r', encoding='utf-8') as f:
+            for l in f:
+                if l.startswith('VmRSS:'):
+                    rss = int(l.split()[1])
+                    break
+    except (OSError, ValueError):
+        return None
+    # the command name may contain spaces, fields start after the last ')'
+    fields = stat[stat.rfind(')') + 2:].split()
+    cpu = (int(fields[11]) + int(fields[12])) / _CLK_TCK
+    return (rss, cpu)
+
+
+class ResourceSampler(object):
+    """
+    Periodically samples memory and CPU usage of a process and its
+    descendants.
+
+    Memory is the peak of the summed resident set sizes of all processes in
+    the tree at sampling time. CPU time accumulates the last observed value of
+    every process in the tree, so usage after the last sample before a
+    process exits is not accounted for.
+    """
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        """Peak resident set size in KB."""
+        self.cpu_times: tp.Dict[int, float] = {}
+        """Last observed CPU time for each process in the tree."""
+        self.start_time: tp.Optional[float] = None
+        self.end_time: tp.Optional[float] = None
+        self._task: tp.Optional[asyncio.Task] = None
+
+    def sample(self) -> bool:
+        """Take one sample, returns False once the root process is gone."""
+        rss = 0
+        alive = False
+        for pid in proc_tree(self.pid):
+            usage = proc_usage(pid)
+            if usage is None:
+                continue
+            if pid == self.pid:
+                alive = True
+            rss += usage[0]
+            self.cpu_times[pid] = usage[1]
+        self.peak_rss = max(self.peak_rss, rss)
+        return alive
+
+    async def _run(self):
+        while self.sample():
+            await asyncio.sleep(self.interval)
+        self.end_time = time.monotonic()
+
+    def start(self):
+        self.start_time = time.monotonic()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop sampling, after taking a final sample if the process is still
+        around."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            if self.end_time is None:
+                self.sample()
+                self.end_time = time.monotonic()
+
+    def result(self) -> tp.Dict[str, float]:
+        wall = (self.end_time or time.monotonic()) - self.start_time
+        return {
+            'peak_rss_mb': self.peak_rss / 1024,
+            'cpu_time': sum(self.cpu_times.values()),
+            'wall_time': wall,
+        }
@@ -0,0 +1,126 @@
+# Copyright 2022 Max Planck Institute for Software Systems, and
+# National University of Singapore
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""Detection of memory-backed file systems for shared memory pools."""
+
+import os
+import re
+import typing as tp
+
+
+class Mount(object):
+
+    def __init__(self, path: str, fstype: str, options: tp.List[str]):
+        self.path = path
+        self.fstype = fstype
+        self.options = options
+
+    def page_size(self) -> int:
+        """Size of pages backing files on this file system in bytes."""
+        if self.fstype != 'hugetlbfs':
+            return os.sysconf('SC_PAGE_SIZE')
+        for o in self.options:
+            if o.startswith('pagesize='):
+                return parse_size(o[len('pagesize='):])
+        return default_hugepage_size()
+
+
+def parse_size(s: str) -> int:
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    if s[-1].upper() in units:
+        return int(s[:-1]) * units[s[-1].upper()]
+    return int(s)
+
+
+def default_hugepage_size() -> int:
+    try:
+        with open('/proc/meminfo', 'r', encoding='utf-8') as f:
+            for l in f:
+                if l.startswith('Hugepagesize:'):
+                    return int(l.split()[1]) * 1024
+    except OSError:
+        pass
+    return 2 << 20
+
+
+def unescape(path: str) -> str:
+    """Decode the octal escapes for spaces etc. in /proc/mounts paths."""
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), path)
+
+
+def mounts() -> tp.List[Mount]:
+    ms = []
+    try:
+        with open('/proc/mounts', 'r', encoding='utf-8') as f:
+            for l in f:
+                parts = l.split()
+                if len(parts) < 4:
+                    continue
+                ms.append(
+                    Mount(unescape(parts[1]), parts[2], parts[3].split(','))
+                )
+    except OSError:
+        pass
+    return ms
+
+
+def existing_parent(path: str) -> str:
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def mount_of(path: str) -> tp.Optional[Mount]:
+    """Mount containing `path`, which does not need to exist yet."""
+    path = os.path.realpath(existing_parent(path))
+    best = None
+    for m in mounts():
+        if path == m.path or path.startswith(m.path.rstrip('/') + '/'):
+            if best is None or len(m.path) >= len(best.path):
+                best = m
+    return best
+
+
+def free_bytes(path: str) -> int:
+    """Space available to unprivileged users on the file system of `path`."""
+    st = os.statvfs(existing_parent(path))
+    return st.f_bavail * st.f_frsize
+
+
+def candidates() -> tp.List[Mount]:
+    """Writable memory-backed file systems to place shared memory pools on, in
+    order of preference: hugetlbfs mounts, then tmpfs at /dev/shm."""
+    hugetlb = []
+    tmpfs = []
+    for m in mounts():
+        if 'ro' in m.options or not os.access(m.path, os.W_OK | os.X_OK):
+            continue
+        if m.fstype == 'hugetlbfs':
+            hugetlb.append(m)
+        elif m.fstype == 'tmpfs' and m.path == '/dev/shm':
+            tmpfs.append(m)
+    return hugetlb + tmpfs
+
+
+def usage_for(pools: tp.List[int], page_size: int) -> int:
+    """Space taken by `pools` with sizes rounded up to whole pages."""
+    return sum((p + page_size - 1) // page_size * page_size for p in pools)
@@ -20,18 +20,18 @@
 # TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import json
 import os
 import re
 
+from results.utils.output import load_output
+
 
 def parse_netperf_run(path):
     ret = {}
 
     if not os.path.exists(path):
         return ret
-    with open(path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    data = load_output(path, 'host.client.0')
 
     ret['simtime'] = data['end_time'] - data['start_time']
 
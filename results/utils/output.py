@@ -0,0 +1,63 @@
+# Copyright 2021 Max Planck Institute for Software Systems, and
+# National University of Singapore
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import fnmatch
+import json
+import os
+
+from simbricks.orchestration.experiment.experiment_output import (
+    INDEXED_FORMAT, IndexedOutputReader
+)
+
+
+def load_output(path, pattern='*', streams=('stdout',)):
+    """
+    Load experiment output, in either the JSON or the indexed format.
+
+    Only simulators whose name matches `pattern` are included in `sims`, and
+    for those only the requested `streams`. With the indexed format, output of
+    other simulators is never decoded.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    reader = None
+    if data.get('format') == INDEXED_FORMAT:
+        reader = IndexedOutputReader(path, data)
+
+    sims = {}
+    for name in fnmatch.filter(data['sims'].keys(), pattern):
+        sim = data['sims'][name]
+        if reader is not None:
+            for s in streams:
+                sim[s] = reader.lines(name, s)
+        else:
+            for s in streams:
+                if s not in sim and s + '_file' in sim:
+                    log_path = os.path.join(
+                        os.path.dirname(path), sim[s + '_file']
+                    )
+                    with open(log_path, 'r', encoding='utf-8') as f:
+                        sim[s] = f.read().splitlines()
+        sims[name] = sim
+    data['sims'] = sims
+    return data
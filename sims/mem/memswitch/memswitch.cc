@@ -237,25 +237,24 @@ class NetPort {
 class NetListenPort : public NetPort {
  protected:
   struct SimbricksBaseIfSHMPool pool_;
+  std::string shm_path_;
 
  public:
-  NetListenPort(const char *path, int sync) : NetPort(path, sync) {
+  NetListenPort(const char *path, const char *shm_path, int sync)
+      : NetPort(path, sync), shm_path_(shm_path) {
     memset(&pool_, 0, sizeof(pool_));
   }
 
   NetListenPort(const NetListenPort &other)
-      : NetPort(other), pool_(other.pool_) {
+      : NetPort(other), pool_(other.pool_), shm_path_(other.shm_path_) {
   }
 
   bool Prepare() override {
     if (!Init())
       return false;
 
-    std::string shm_path = path_;
-    shm_path += "-shm";
-
     if (SimbricksBaseIfSHMPoolCreate(
-            &pool_, shm_path.c_str(),
+            &pool_, shm_path_.c_str(),
             SimbricksBaseIfSHMSize(&netif_.base.params)) != 0) {
       perror("Prepare: SimbricksBaseIfSHMPoolCreate failed");
       return false;
@@ -492,7 +491,17 @@ int main(int argc, char *argv[]) {
       }
 
       case 'h': {
-        NetListenPort *port = new NetListenPort(optarg, sync_eth);
+        // SOCKET[:SHM], shared memory defaults to SOCKET-shm
+        std::string shm_path = optarg;
+        char *sep = strchr(optarg, ':');
+        if (sep) {
+          *sep = '\0';
+          shm_path = sep + 1;
+        } else {
+          shm_path += "-shm";
+        }
+        NetListenPort *port =
+            new NetListenPort(optarg, shm_path.c_str(), sync_eth);
         fprintf(stderr, "Switch listening on: %s\n", optarg);
         ports.push_back(port);
         break;